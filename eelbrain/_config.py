@@ -7,6 +7,8 @@ from matplotlib.colors import colorConverter
 
 CONFIG = {
     'n_workers': cpu_count(),
+    'permutation_batch': 0,
+    'permutation_backend': 'process',
     'eelbrain': True,
     'autorun': None,
     'show': True,
@@ -26,6 +28,8 @@ def configure(
         figure_background=None,
         prompt_toolkit=None,
         animate=None,
+        permutation_batch=None,
+        permutation_backend=None,
 ):
     """Set basic configuration parameters for the current session
 
@@ -64,6 +68,18 @@ def configure(
         ``prompt_toolkit=False``.
     animate : bool
         Animate plot navigation (default True).
+    permutation_batch : int
+        Number of permutations that are evaluated together in permutation
+        tests. Evaluating a batch of permutations with a single matrix product
+        reduces per-permutation overhead, but results can differ from the
+        one-at-a-time evaluation at the level of floating point precision.
+        ``0`` (default) to evaluate permutations one at a time.
+    permutation_backend : 'process' | 'thread'
+        How ``n_workers`` are used in permutation tests: ``'process'``
+        (default) starts new worker processes for each test; ``'thread'`` uses
+        a persistent pool of threads that is reused across tests and shares
+        data with the main process without copying. Threads avoid the cost of
+        starting processes, which dominates for many small tests.
     """
     # don't change values before raising an error
     new = {}
@@ -100,5 +116,13 @@ def configure(
         new['prompt_toolkit'] = bool(prompt_toolkit)
     if animate is not None:
         new['animate'] = bool(animate)
+    if permutation_batch is not None:
+        if not isinstance(permutation_batch, int) or permutation_batch < 0:
+            raise ValueError("permutation_batch=%r" % (permutation_batch,))
+        new['permutation_batch'] = int(permutation_batch)
+    if permutation_backend is not None:
+        if permutation_backend not in ('process', 'thread'):
+            raise ValueError("permutation_backend=%r" % (permutation_backend,))
+        new['permutation_backend'] = permutation_backend
 
     CONFIG.update(new)
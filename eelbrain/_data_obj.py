@@ -42,6 +42,7 @@ from collections import Iterator, OrderedDict, Sequence
 from copy import deepcopy
 from fnmatch import fnmatchcase
 from functools import partial
+import hashlib
 import itertools
 from itertools import chain, izip
 from keyword import iskeyword
@@ -61,20 +62,20 @@ from nibabel.freesurfer import read_annot
 import numpy as np
 from numpy import newaxis
 import scipy.signal
+import scipy.sparse
 import scipy.stats
-from scipy.linalg import inv, norm
+from scipy.linalg import inv, norm, solve
 from scipy.optimize import leastsq
-from scipy.spatial import ConvexHull
+from scipy.spatial import ConvexHull, cKDTree
 from scipy.spatial.distance import cdist, pdist, squareform
 
 from . import fmtxt
 from . import _colorspaces as cs
 from ._exceptions import DimensionMismatchError
-from ._data_opt import gaussian_smoother
 from ._info import merge_info
 from ._utils import (
-    deprecated, deprecated_attribute, intervals, ui, LazyProperty, n_decimals,
-    natsorted)
+    deprecated, deprecated_attribute, intervals, ui, LazyProperty, LRUCache,
+    n_decimals, natsorted)
 from ._utils.numpy_utils import (
     apply_numpy_index, digitize_index, digitize_slice_endpoint, FULL_AXIS_SLICE,
     FULL_SLICE, index_length, index_to_int_array, slice_to_arange)
@@ -97,6 +98,17 @@ preferences = dict(fullrepr=False,  # whether to display full arrays/dicts in __
 
 UNNAMED = '<?>'
 LIST_INDEX_TYPES = (int, slice)
+# bytes of memory-mapped NDVar data processed at once
+MEMMAP_CHUNK_SIZE = 2 ** 26
+# Gaussian smoothing over irregular dimensions ignores weights beyond this
+# number of standard deviations
+GAUSSIAN_TRUNCATE = 4.
+# number of source space connectivity graphs kept in memory
+SOURCE_SPACE_GRAPH_CACHE_SIZE = 32
+# NDVar.dot() applies 2d operators with at most this fraction of non-zero
+# elements (such as label operators) as sparse matrices
+DOT_SPARSE_DENSITY = 0.1
+_source_space_graphs = LRUCache(SOURCE_SPACE_GRAPH_CACHE_SIZE)
 _pickled_ds_wildcard = ("Pickled Dataset (*.pickled)", '*.pickled')
 _tex_wildcard = ("TeX (*.tex)", '*.tex')
 _tsv_wildcard = ("Plain Text Tab Separated Values (*.txt)", '*.txt')
@@ -921,6 +933,116 @@ def shuffled_index(n, cells=None):
     return out
 
 
+class CellIndex(object):
+    """Index of the cases in each cell of a categorial model
+
+    Determines cell membership for all cases in a single pass, so that data
+    can be reduced over all cells at once instead of with one boolean index
+    per cell.
+
+    Parameters
+    ----------
+    x : categorial
+        Model defining the cells.
+
+    Attributes
+    ----------
+    cells : tuple
+        Non-empty cells, in the order of ``x.cells``.
+    codes : array of int  (n_cases,)
+        For each case, the index of its cell in :attr:`cells`.
+    counts : array of int  (n_cells,)
+        Number of cases in each cell.
+    order : array of int  (n_cases,)
+        Case indexes sorted by cell (in the original order within each cell).
+    starts : array of int  (n_cells,)
+        Index of the first case of each cell in :attr:`order`.
+    """
+    def __init__(self, x):
+        self.x = x
+        codes = x._cell_codes()
+        counts = np.bincount(codes, minlength=len(x.cells))
+        nonempty = np.flatnonzero(counts)
+        self.cells = tuple(x.cells[i] for i in nonempty)
+        self.n_cells = len(nonempty)
+        self.n_cases = len(codes)
+        self.counts = counts[nonempty]
+        if len(nonempty) < len(counts):
+            lut = np.empty(len(counts), np.intp)
+            lut[nonempty] = np.arange(len(nonempty))
+            codes = lut[codes]
+        self.codes = codes
+        self.order = np.argsort(codes, kind='mergesort')
+        self.starts = np.cumsum(self.counts) - self.counts
+        self._is_sorted = np.all(codes[1:] >= codes[:-1])
+        self._cell_ids = {cell: i for i, cell in enumerate(self.cells)}
+
+    def __len__(self):
+        return self.n_cases
+
+    def _sorted(self, x):
+        "Data with cases sorted by cell"
+        return x if self._is_sorted else x[self.order]
+
+    def index(self, i):
+        "Array with the ``int`` indexes of the cases in cell number ``i``"
+        start = self.starts[i]
+        return self.order[start:start + self.counts[i]]
+
+    def index_opt(self, cell):
+        "Like :meth:`_Effect.index_opt`, accepting any cell of ``x``"
+        if cell not in self._cell_ids:
+            return np.empty(0, np.intp)
+        index = self.index(self._cell_ids[cell])
+        if len(index) > 1:
+            d_values = np.unique(np.diff(index))
+            if len(d_values) == 1:
+                start = index[0] or None
+                step = d_values[0]
+                stop = index[-1] + 1
+                if stop > self.n_cases - step:
+                    stop = None
+                if step == 1:
+                    step = None
+                return slice(start, stop, step)
+        return index
+
+    def sum(self, x):
+        "Sum of ``x`` (cases on the first axis) in each cell"
+        if x.dtype.kind in 'biu':
+            x = x.astype(np.float64)
+        return np.add.reduceat(self._sorted(x), self.starts, axis=0)
+
+    def mean(self, x):
+        "Mean of ``x`` (cases on the first axis) in each cell"
+        out = self.sum(x)
+        out /= self.counts.reshape((-1,) + (1,) * (out.ndim - 1))
+        return out
+
+    def split(self, x):
+        "List with the data of each cell (as views where possible)"
+        return np.split(self._sorted(x), self.starts[1:])
+
+    def reduce(self, x, func, **kwargs):
+        "Apply ``func`` to the data in each cell"
+        # for 1d data, numpy uses pairwise summation
+        if x.ndim > 1 and kwargs == {'axis': 0}:
+            if func is np.mean:
+                return self.mean(x)
+            elif func is np.sum:
+                return self.sum(x)
+        return np.array([func(x_cell, **kwargs) for x_cell in self.split(x)])
+
+
+def as_cell_index(x, n=None):
+    "Create a :class:`CellIndex` unless ``x`` is one already"
+    if not isinstance(x, CellIndex):
+        x = CellIndex(x)
+    if n is not None and len(x) != n:
+        raise ValueError("Length mismatch: %i (data) != %i (X)" % (n, len(x)))
+    return x
+
+
 class Celltable(object):
     """Divide Y into cells defined by X.
 
@@ -1080,8 +1202,9 @@ class Celltable(object):
         self.cells = cat if cat is not None else X.cells
         self.n_cells = len(self.cells)
         self.groups = {}
+        cell_index = CellIndex(X)
         for cell in X.cells:
-            idx = X.index_opt(cell)
+            idx = cell_index.index_opt(cell)
             self.data_indexes[cell] = idx
             self.data[cell] = Y[idx]
             if match:
@@ -1261,7 +1384,8 @@ class Celltable(object):
                         self.get_statistic(func=func, a=a, **kwargs)))
 
 
-def combine(items, name=None, check_dims=True, incomplete='raise'):
+def combine(items, name=None, check_dims=True, incomplete='raise',
+            memmap=None):
     """Combine a list of items of the same type into one item.
 
     Parameters
@@ -1283,6 +1407,13 @@ def combine(items, name=None, check_dims=True, incomplete='raise'):
         KeyError to be raised. With ``"drop"``, partially missing variables are
         dropped. With ``"fill in"``, they are retained and missing values are
         filled in with empty values (``""`` for factors, ``NaN`` for variables).
+    memmap : str
+        Only applies when combining NDVars: path of a ``*.npy`` file. The data
+        are written to this file one item at a time, and the resulting NDVar
+        is backed by a memory-mapped array (:class:`numpy.memmap`) instead of
+        an array in memory. This allows combining data that do not fit into
+        memory (for example, when the items are memory-mapped NDVars
+        themselves).
 
     Notes
     -----
@@ -1293,6 +1424,8 @@ def combine(items, name=None, check_dims=True, incomplete='raise'):
         raise TypeError("incomplete=%s, need str" % repr(incomplete))
     elif incomplete not in ('raise', 'drop', 'fill in'):
         raise ValueError("incomplete=%s" % repr(incomplete))
+    elif memmap is not None and not isinstance(memmap, basestring):
+        raise TypeError("memmap=%r, need str" % (memmap,))
 
     # check input
     if isinstance(items, Iterator):
@@ -1319,6 +1452,10 @@ def combine(items, name=None, check_dims=True, incomplete='raise'):
         names = filter(None, (item.name for item in items))
         name = os.path.commonprefix(names) or None
 
+    if memmap is not None and stype is not NDVar:
+        raise TypeError("memmap is only supported for combining NDVars, got "
+                        "%s" % stype.__name__)
+
     # combine objects
     if stype is Dataset:
         out = Dataset(name=name, info=merge_info(items))
@@ -1388,7 +1525,17 @@ def combine(items, name=None, check_dims=True, incomplete='raise'):
             else:
                 sub_items.append(item.sub(**idx))
         # combine data
-        if has_case:
+        if memmap is not None:
+            n_cases = [len(v) if has_case else 1 for v in sub_items]
+            shape = (sum(n_cases),) + sub_items[0].shape[has_case:]
+            dtype = np.result_type(*(v.x for v in sub_items))
+            x = np.lib.format.open_memmap(memmap, 'w+', dtype, shape)
+            start = 0
+            for v, n in izip(sub_items, n_cases):
+                x[start:start + n] = v.x
+                start += n
+            x.flush()
+        elif has_case:
             x = np.concatenate([v.x for v in sub_items], axis=0)
         else:
             x = np.array([v.x for v in sub_items])
@@ -1918,7 +2065,7 @@ class Var(object):
 
         Parameters
         ----------
-        X : categorial
+        X : categorial | CellIndex
             Model defining cells in which to aggregate.
         func : callable
             Function that converts arrays into scalars, used to summarize data
@@ -1932,20 +2079,12 @@ class Var(object):
         aggregated_var : Var
             A Var instance with a single value for each cell in X.
         """
-        if len(X) != len(self):
-            err = "Length mismatch: %i (Var) != %i (X)" % (len(self), len(X))
-            raise ValueError(err)
-
-        x = []
-        for cell in X.cells:
-            x_cell = self.x[X == cell]
-            if len(x_cell) > 0:
-                x.append(func(x_cell))
+        index = as_cell_index(X, len(self))
+        x = index.reduce(self.x, func)
 
         if name is True:
             name = self.name
 
-        x = np.array(x)
         return Var(x, name, info=self.info.copy())
 
     @property
@@ -2230,6 +2369,13 @@ class _Effect(object):
         """
         return Var(np.cumsum(self == value) + start)
 
+    def _cell_codes(self):
+        "For each case, the index of its cell in ``self.cells``"
+        codes = np.empty(len(self), np.intp)
+        for i, cell in enumerate(self.cells):
+            codes[self == cell] = i
+        return codes
+
     def enumerate_cells(self, name=None):
         """Enumerate the occurrence of each cell value throughout the data
 
@@ -2652,6 +2798,14 @@ class Factor(_Effect):
     def cells(self):
         return tuple(self._labels.values())
 
+    def _cell_codes(self):
+        codes = np.fromiter(self._labels, np.intp, len(self._labels))
+        if len(codes) == 0:
+            return np.empty(0, np.intp)
+        lut = np.empty(codes.max() + 1, np.intp)
+        lut[codes] = np.arange(len(codes))
+        return lut[self.x]
+
     def _cellsize(self):
         "-1 if cell size is not equal"
         codes = self._labels.keys()
@@ -2671,7 +2825,7 @@ class Factor(_Effect):
 
         Parameters
         ----------
-        X : categorial
+        X : categorial | CellIndex
             A categorial model defining cells to collapse.
         name : None | True | str
             Name of the output Factor, ``True`` to keep the current name
@@ -2682,26 +2836,23 @@ class Factor(_Effect):
         f : Factor
             A copy of self with only one value for each cell in X
         """
-        if len(X) != len(self):
-            err = "Length mismatch: %i (Var) != %i (X)" % (len(self), len(X))
+        index = as_cell_index(X, len(self))
+        x_sorted = index._sorted(self.x)
+        x = np.minimum.reduceat(x_sorted, index.starts)
+        x_max = np.maximum.reduceat(x_sorted, index.starts)
+        bad = np.flatnonzero(x != x_max)
+        if len(bad):
+            i = bad[0]
+            x_i = np.unique(x_sorted[index.starts[i]:
+                                     index.starts[i] + index.counts[i]])
+            labels = tuple(self._labels[code] for code in x_i)
+            err = ("Can not determine aggregated value for Factor %r "
+                   "in cell %r because the cell contains multiple "
+                   "values %r. Set drop_bad=True in order to ignore "
+                   "this inconsistency and drop the Factor."
+                   % (self.name, index.cells[i], labels))
             raise ValueError(err)
 
-        x = []
-        for cell in X.cells:
-            idx = (X == cell)
-            if np.sum(idx):
-                x_i = np.unique(self.x[idx])
-                if len(x_i) > 1:
-                    labels = tuple(self._labels[code] for code in x_i)
-                    err = ("Can not determine aggregated value for Factor %r "
-                           "in cell %r because the cell contains multiple "
-                           "values %r. Set drop_bad=True in order to ignore "
-                           "this inconsistency and drop the Factor."
-                           % (self.name, cell, labels))
-                    raise ValueError(err)
-                else:
-                    x.append(x_i[0])
-
         if name is True:
             name = self.name
 
@@ -3049,6 +3200,12 @@ class NDVar(object):
     ``ndvar.sub(time=0.1)``, regardless of which axis represents the time
     dimension.
 
+    *Memory-mapped data*: ``x`` can be a :class:`numpy.memmap` (see, e.g.,
+    the ``memmap`` parameter of :func:`combine`). Indexing cases with slices
+    then returns views on the file, and methods that summarize data
+    (:meth:`.mean`, :meth:`.summary` etc.) process the data in chunks of
+    cases.
+
     *Shallow copies*: ``x`` and ``dims`` are stored without copying. A shallow
     copy of ``info`` is stored. Make sure the relevant objects are not modified
     externally later. When indexing an NDVar, the new NDVar will contain a view
@@ -3082,7 +3239,8 @@ class NDVar(object):
         else:
             dims_ = list(dims)
 
-        x = np.asarray(x)
+        if not isinstance(x, np.memmap):
+            x = np.asarray(x)
         if len(dims_) != x.ndim:
             raise DimensionMismatchError(
                 "Unequal number of dimensions (data: %i, dims: %i)" %
@@ -3559,7 +3717,7 @@ class NDVar(object):
 
         Parameters
         ----------
-        X : categorial
+        X : categorial | CellIndex
             Categorial whose cells define which cases to aggregate.
         func : function with axis argument
             Function that is used to create a summary of the cases falling
@@ -3576,17 +3734,8 @@ class NDVar(object):
         """
         if not self.has_case:
             raise DimensionMismatchError("%r has no case dimension" % self)
-        if len(X) != len(self):
-            err = "Length mismatch: %i (Var) != %i (X)" % (len(self), len(X))
-            raise ValueError(err)
-
-        x = []
-        for cell in X.cells:
-            idx = (X == cell)
-            if np.sum(idx):
-                x_cell = self.x[idx]
-                x.append(func(x_cell, axis=0))
-        x = np.array(x)
+        index = as_cell_index(X, len(self))
+        x = index.reduce(self.x, func, axis=0)
 
         # update info for summary
         info = self.info.copy()
@@ -3612,7 +3761,7 @@ class NDVar(object):
                     axis = list(axis) + additional_axis
             return data._aggregate_over_dims(axis, {'name': name}, func)
         elif not axis:
-            return func(self.x)
+            return self._reduce(func, None)
         elif isinstance(axis, NDVar):
             if axis.ndim == 1:
                 dim = axis.dims[0]
@@ -3646,15 +3795,87 @@ class NDVar(object):
                     return func(self_x[index])
         elif isinstance(axis, basestring):
             axis = self._dim_2_ax[axis]
-            x = func(self.x, axis=axis)
+            x = self._reduce(func, axis)
             dims = tuple(self.dims[i] for i in xrange(self.ndim) if i != axis)
         else:
             axes = tuple(self._dim_2_ax[dim_name] for dim_name in axis)
-            x = func(self.x, axes)
+            x = self._reduce(func, axes)
             dims = tuple(self.dims[i] for i in xrange(self.ndim) if i not in axes)
 
         return self._package_aggregated_output(x, dims, self.info.copy(), name)
 
+    def _reduce(self, func, axis):
+        """Apply ``func`` along ``axis``, in chunks of cases for memmaps
+
+        ``axis=None`` reduces all axes (``func`` is called without ``axis``).
+        """
+        x = self.x
+        if axis is None:
+            if not isinstance(x, np.memmap):
+                return func(x)
+            axis = tuple(xrange(x.ndim))
+            full_func = func
+        else:
+            full_func = partial(func, axis=axis)
+        if not isinstance(x, np.memmap) or not self.has_case or len(x) < 2:
+            return full_func(x)
+        n_chunk = max(1, MEMMAP_CHUNK_SIZE * len(x) // x.nbytes)
+        if n_chunk >= len(x):
+            return full_func(x)
+        chunks = [x[i:i + n_chunk] for i in xrange(0, len(x), n_chunk)]
+        axes = axis if isinstance(axis, tuple) else (axis,)
+        if 0 not in axes:
+            return np.concatenate([func(chunk, axis=axis) for chunk in chunks])
+        elif func is np.sum or func is np.mean:
+            if func is np.mean and x.dtype.kind in 'biu':
+                dtype = np.float64
+            else:
+                dtype = None
+            out = np.sum(chunks[0], axis, dtype)
+            for chunk in chunks[1:]:
+                out += np.sum(chunk, axis, dtype)
+            if func is np.mean:
+                out /= reduce(operator.mul, (x.shape[i] for i in axes))
+            return out
+        elif func is np.max or func is np.min:
+            ufunc = np.maximum if func is np.max else np.minimum
+            out = func(chunks[0], axis)
+            for chunk in chunks[1:]:
+                out = ufunc(out, func(chunk, axis))
+            return out
+
+        # rms, std and var from sums of squares
+        from ._stats.stats import rms
+        if (isinstance(func, partial) and not func.args and
+                set(func.keywords or ()) <= {'ddof'}):
+            base_func = func.func
+            ddof = func.keywords.get('ddof', 0)
+        else:
+            base_func = func
+            ddof = 0
+        n = reduce(operator.mul, (x.shape[i] for i in axes))
+        dtype = x.dtype if x.dtype.kind == 'f' else np.float64
+        if base_func is rms:
+            ss = 0
+            for chunk in chunks:
+                ss += np.sum(np.square(chunk, dtype=np.float64), axis)
+            return np.sqrt(ss / n).astype(dtype)
+        elif base_func is np.var or base_func is np.std:
+            # two passes to avoid loss of precision for data with large mean
+            mean = 0
+            for chunk in chunks:
+                mean += np.sum(chunk, axis, np.float64, keepdims=True)
+            mean /= n
+            ss = 0
+            for chunk in chunks:
+                ss += np.sum(np.square(chunk - mean), axis)
+            out = ss / (n - ddof)
+            if base_func is np.std:
+                out = np.sqrt(out)
+            return out.astype(dtype)
+        else:
+            return full_func(x)
+
     def astype(self, dtype):
         """Copy of the NDVar with data cast to the specified type
 
@@ -3854,10 +4075,20 @@ class NDVar(object):
 
         x1 = self.get_data(v1_dimnames)
         x2 = ndvar.get_data(v2_dimnames)
+        n = x1.shape[-1]
+        x1_2d = x1.reshape((-1, n))
+        if (x1.ndim == 2 and
+                np.count_nonzero(x1) <= DOT_SPARSE_DENSITY * x1.size):
+            x1_2d = scipy.sparse.csr_matrix(x1_2d)
         if ndvar.has_case:
-            x = np.array([np.tensordot(x1, x2_, 1) for x2_ in x2])
-        else:
-            x = np.tensordot(x1, x2, 1)
+            # one case at a time to avoid a transposed copy of x2
+            x = np.empty((len(x2),) + x1.shape[:-1] + x2.shape[2:],
+                         np.result_type(x1, x2))
+            for x_i, x2_i in izip(x, x2):
+                x_i[...] = x1_2d.dot(x2_i.reshape((n, -1))).reshape(x_i.shape)
+        else:
+            x = x1_2d.dot(x2.reshape((n, -1)))
+            x = x.reshape(x1.shape[:-1] + x2.shape[1:])
         return NDVar(x, dims, {}, name or ndvar.name)
 
     def envelope(self, dim='time', name=None):
@@ -4470,6 +4701,10 @@ class NDVar(object):
         the standard deviation can be calculated with the following conversion::
 
         >>> std = fwhm / (2 * (sqrt(2 * log(2))))
+
+        For dimensions with irregular spacing, the Gaussian window is truncated
+        at :data:`GAUSSIAN_TRUNCATE` standard deviations, and the smoothing
+        matrix is stored as sparse matrix and cached on the dimension.
         """
         axis = self.get_axis(dim)
         dim_object = self.get_dim(dim)
@@ -4478,11 +4713,13 @@ class NDVar(object):
                 raise ValueError("For gaussian smoothing, mode must be "
                                  "'center'; got mode=%r" % (mode,))
             elif dim_object._connectivity_type == 'custom':
-                m = gaussian_smoother(dim_object._distances(), window_size)
+                m = dim_object._gaussian_smoother(window_size)
             else:
                 raise NotImplementedError("Gaussian smoothing for %s "
                                           "dimension" % (dim_object.name,))
-            x = np.tensordot(m, self.x, (1, axis))
+            x = self.x.swapaxes(0, axis) if axis else self.x
+            shape = x.shape
+            x = m.dot(x.reshape((shape[0], -1))).reshape(shape)
             if axis:
                 x = x.swapaxes(0, axis)
         elif dim_object._connectivity_type == 'custom':
@@ -4611,11 +4848,14 @@ class NDVar(object):
             dims.extend(dim for dim in regions if data.has_dim(dim))
             return data.summary(*dims, func=func, name=name)
         else:
-            x = self.x
+            x = None
             axes = [self._dim_2_ax[dim] for dim in dims]
             dims = list(self.dims)
             for axis in sorted(axes, reverse=True):
-                x = func(x, axis=axis)
+                if x is None:
+                    x = self._reduce(func, axis)
+                else:
+                    x = func(x, axis=axis)
                 dims.pop(axis)
 
             # update info for summary
@@ -4942,19 +5182,16 @@ class Datalist(list):
 
         Parameters
         ----------
-        X : categorial
+        X : categorial | CellIndex
             Cells which to aggregate.
         merge : str
             How to merge entries.
             ``'mean'``: sum elements and dividie by cell length
         """
-        if len(X) != len(self):
-            err = "Length mismatch: %i (Var) != %i (X)" % (len(self), len(X))
-            raise ValueError(err)
-
+        index = as_cell_index(X, len(self))
         x = []
-        for cell in X.cells:
-            x_cell = self[X == cell]
+        for i in xrange(index.n_cells):
+            x_cell = self[index.index(i)]
             n = len(x_cell)
             if n == 1:
                 x.append(x_cell)
@@ -5720,24 +5957,21 @@ class Dataset(OrderedDict):
             x = Factor('a' * self.n_cases)
 
         ds = Dataset(name=name.format(name=self.name), info=self.info)
+        # cell membership is determined once for all variables
+        index = CellIndex(x)
 
         if count:
-            n_cases = filter(None, (np.sum(x == cell) for cell in x.cells))
-            ds[count] = Var(n_cases)
+            ds[count] = Var(index.counts)
 
         for k, v in self.iteritems():
             if k in drop:
                 continue
             try:
                 if hasattr(v, 'aggregate'):
-                    ds[k] = v.aggregate(x)
+                    ds[k] = v.aggregate(index)
                 elif isinstance(v, MNE_EPOCHS):
-                    evokeds = []
-                    for cell in x.cells:
-                        idx = (x == cell)
-                        if idx.sum():
-                            evokeds.append(v[idx].average())
-                    ds[k] = evokeds
+                    ds[k] = [v[index.index(i)].average() for i in
+                             xrange(index.n_cells)]
                 else:
                     err = ("Unsupported value type: %s" % type(v))
                     raise TypeError(err)
@@ -5781,9 +6015,8 @@ class Dataset(OrderedDict):
         """
         X = ascategorial(X, ds=self)
         self._check_n_cases(X, empty_ok=False)
-        indexes = np.array([X == cell for cell in X.cells])
-        n_by_cell = indexes.sum(1)
-        n_max = np.setdiff1d(n_by_cell, [0]).min()
+        cell_index = CellIndex(X)
+        n_max = cell_index.counts.min()
         if n is None:
             n_ = n_max
         elif n < 0:
@@ -5795,9 +6028,11 @@ class Dataset(OrderedDict):
             raise ValueError("Invalid value n=%i; the maximum numer of cases "
                              "per cell is %i" % (n, n_max))
 
-        for index in indexes:
-            np.logical_and(index, index.cumsum() <= n_, index)
-        index = indexes.any(0)
+        # position of each case within its cell
+        rank = np.arange(self.n_cases) - np.repeat(cell_index.starts,
+                                                   cell_index.counts)
+        index = np.zeros(self.n_cases, bool)
+        index[cell_index.order[rank < n_]] = True
         return self[index]
 
     def head(self, n=10):
@@ -6398,7 +6633,17 @@ class Interaction(_Effect):
         return [delim.join(filter(None, map(str, case))) for case in self]
 
     def aggregate(self, X):
-        return Interaction(f.aggregate(X) for f in self.base)
+        index = as_cell_index(X, len(self))
+        return Interaction(f.aggregate(index) for f in self.base)
+
+    def _cell_codes(self):
+        if not self.is_categorial:
+            return _Effect._cell_codes(self)
+        codes = [f._cell_codes() for f in self.base]
+        shape = [len(f.cells) for f in self.base]
+        if len(self) == 0:
+            return np.empty(0, np.intp)
+        return np.ravel_multi_index(codes, shape)
 
     def isin(self, cells):
         """An index that is true where the Interaction equals any of the cells.
@@ -6482,6 +6727,9 @@ class NestedEffect(_Effect):
             return self.effect[index]
         return NestedEffect(self.effect[index], self.nestedin[index])
 
+    def _cell_codes(self):
+        return self.effect._cell_codes()
+
     @property
     def df(self):
         return len(self.effect.cells) - len(self.nestedin.cells)
@@ -7184,6 +7432,11 @@ class Dimension(object):
         "Distance matrix for dimension elements"
         raise NotImplementedError("Distances for %s" % self.__class__.__name__)
 
+    def _gaussian_smoother(self, std, truncate=None):
+        "Sparse Gaussian smoothing matrix (see :meth:`NDVar.smooth`)"
+        raise NotImplementedError("Gaussian smoothing for %s" %
+                                  self.__class__.__name__)
+
     def intersect(self, dim, check_dims=True):
         """Create a Dimension that is the intersection with dim
 
@@ -7778,6 +8031,8 @@ class Sensor(Dimension):
 
         # cache for transformed locations
         self._transformed = {}
+        # cache for topomap interpolation matrices
+        self._interpolators = {}
 
     def __getstate__(self):
         out = Dimension.__getstate__(self)
@@ -8043,6 +8298,64 @@ class Sensor(Dimension):
 
         return locs2d
 
+    def _topomap_interpolator(self, proj, res, frame=0):
+        """Matrix for thin-plate spline interpolation of topomaps
+
+        Parameters
+        ----------
+        proj : str
+            2d projection (see class documentation).
+        res : int
+            Resolution of the topomap image.
+        frame : scalar
+            Frame for the sensor location projection (see
+            :meth:`.get_locs_2d`).
+
+        Returns
+        -------
+        interpolator : array (res * res, n_sensors)
+            Matrix that maps sensor data to the flattened ``res`` by ``res``
+            image (columns for invisible sensors are 0).
+
+        Notes
+        -----
+        Adapted from mne-python topomap ``_griddata()``. The spline weights
+        depend linearly on the data, so that the image is the product of a
+        matrix that only depends on the sensor layout with the data.
+        """
+        proj = self._interpret_proj(proj)
+        key = (proj, res, frame)
+        if key in self._interpolators:
+            return self._interpolators[key]
+
+        locs = self.get_locs_2d(proj, frame=frame)
+        visible = self._visible_sensors(proj)
+        if visible is not None:
+            locs = locs[visible]
+        xy = locs[:, 0] - locs[:, 1] * 1j
+        grid = np.linspace(0, 1, res)
+        xi, yi = np.meshgrid(grid, grid)
+        grid_xy = (xi - yi * 1j).ravel()
+
+        def green(d):
+            with np.errstate(divide='ignore', invalid='ignore'):
+                g = d * d * (np.log(d) - 1.)
+            g[d == 0] = 0.
+            return g
+
+        g_sensors = green(np.abs(xy - xy[:, newaxis]))
+        g_grid = green(np.abs(grid_xy[:, newaxis] - xy))
+        # g_sensors is symmetric
+        m = solve(g_sensors, g_grid.T).T
+        if visible is not None:
+            interpolator = np.zeros((len(grid_xy), len(self)))
+            interpolator[:, visible] = m
+        else:
+            interpolator = m
+        interpolator.flags.writeable = False
+        self._interpolators[key] = interpolator
+        return interpolator
+
     def _topomap_outlines(self, proj):
         "Outline argument for mne-python topomaps"
         proj = self._interpret_proj(proj)
@@ -8245,27 +8558,18 @@ class Sensor(Dimension):
             ``connect_dist`` times the distance of the closest neighbor.
             e.g., 1.75 or 1.6
         """
-        pairs = set()
         if neighbors is not None and connect_dist is not None:
             raise TypeError("Can only specify either neighbors or connect_dist")
         elif connect_dist is None:
-            for src, dst in neighbors:
-                a = self.names.index(src)
-                b = self.names.index(dst)
-                if a < b:
-                    pairs.add((a, b))
-                else:
-                    pairs.add((b, a))
+            pairs = [(self.names.index(src), self.names.index(dst)) for
+                     src, dst in neighbors]
         else:
-            nb = self.neighbors(connect_dist)
-            for k, vals in nb.iteritems():
-                for v in vals:
-                    if k < v:
-                        pairs.add((k, v))
-                    else:
-                        pairs.add((v, k))
+            dist = squareform(pdist(self.locs))
+            np.fill_diagonal(dist, np.inf)
+            threshold = dist.min(1) * connect_dist
+            pairs = np.column_stack(np.nonzero(dist < threshold[:, newaxis]))
 
-        self._connectivity = np.array(sorted(pairs), np.uint32)
+        self._connectivity = _unique_edges(pairs)
         self._connectivity_type = 'custom'
 
     def set_sensor_positions(self, pos, names=None):
@@ -8318,29 +8622,59 @@ def as_sensor(obj):
         raise TypeError("Can't get sensors from %r" % (obj,))
 
 
-def _point_graph(coords, dist_threshold):
-    "Connectivity graph for points based on distance"
-    n = len(coords)
-    dist = pdist(coords)
+def _vertices_hash(*vertices_lists):
+    "Hash for one or several lists of vertex arrays"
+    sha = hashlib.sha1()
+    for vertices in vertices_lists:
+        for v in vertices:
+            v = np.asarray(v, np.int64)
+            sha.update(np.int64(len(v)).tobytes())
+            sha.update(v.tobytes())
+    return sha.hexdigest()[:16]
+
+
+def _unique_edges(edges):
+    """Sorted unique edges from an array of vertex pairs
+
+    Parameters
+    ----------
+    edges : array_like, (n_pairs, 2)
+        Vertex pairs in any order; pairs connecting a vertex to itself are
+        dropped.
 
-    # construct vertex pairs corresponding to dist
-    graph = np.empty((len(dist), 2), np.uint32)
-    i0 = 0
-    for vert, di in enumerate(xrange(n - 1, 0, -1)):
-        i1 = i0 + di
-        graph[i0:i1, 0] = vert
-        graph[i0:i1, 1] = np.arange(vert + 1, n)
-        i0 = i1
+    Returns
+    -------
+    edges : array (n_edges, 2)
+        Sorted ``[src, dst]`` pairs with ``src < dst``.
+    """
+    edges = np.sort(np.asarray(edges, np.int64).reshape((-1, 2)), 1)
+    edges = edges[edges[:, 0] != edges[:, 1]]
+    out = np.empty((0, 2), np.uint32)
+    if len(edges) == 0:
+        return out
+    n = edges[:, 1].max() + 1
+    index = np.unique(edges[:, 0] * n + edges[:, 1])
+    src, dst = index // n, index % n
+    return np.column_stack((src, dst)).astype(np.uint32)
 
-    return graph[dist < dist_threshold]
+
+def _point_graph(coords, dist_threshold):
+    "Connectivity graph for points based on distance"
+    pairs = cKDTree(coords).query_pairs(dist_threshold)
+    if not pairs:
+        return np.empty((0, 2), np.uint32)
+    pairs = np.array(sorted(pairs))
+    # query_pairs() includes pairs at exactly dist_threshold
+    diff = coords[pairs[:, 0]] - coords[pairs[:, 1]]
+    dist = np.sqrt((diff ** 2).sum(1))
+    return _unique_edges(pairs[dist < dist_threshold])
 
 
 def _matrix_graph(matrix):
     "Create connectivity from matrix"
     coo = matrix.tocoo()
     assert np.all(coo.data)
-    edges = {(min(a, b), max(a, b)) for a, b in izip(coo.col, coo.row) if a != b}
-    return np.array(sorted(edges), np.uint32)
+    return _unique_edges(np.column_stack((coo.row, coo.col)))
 
 
 def _tri_graph(tris):
@@ -8356,13 +8690,9 @@ def _tri_graph(tris):
     edges : array (n_edges, 2)
         All edges between vertices of tris.
     """
-    pairs = set()
-    for tri in tris:
-        a, b, c = sorted(tri)
-        pairs.add((a, b))
-        pairs.add((a, c))
-        pairs.add((b, c))
-    return np.array(sorted(pairs), np.uint32)
+    tris = np.asarray(tris)
+    return _unique_edges(np.vstack((tris[:, [0, 1]], tris[:, [0, 2]],
+                                    tris[:, [1, 2]])))
 
 
 def _mne_tri_soure_space_graph(source_space, vertices_list):
@@ -8458,6 +8788,7 @@ class SourceSpace(Dimension):
 
     def _init_secondary(self):
         self._n_vert = sum(len(v) for v in self.vertices)
+        self._smoothers = {}
         match = re.match("(ico|vol)-(\d)", self.src)
         # The source-space type is needed to determine connectivity
         if match is None:
@@ -8662,6 +8993,49 @@ class SourceSpace(Dimension):
             i0 = i
         return dist
 
+    def _gaussian_smoother(self, std, truncate=None):
+        """Sparse Gaussian smoothing matrix based on surface distances
+
+        Parameters
+        ----------
+        std : scalar
+            Standard deviation of the Gaussian kernel (in m).
+        truncate : scalar
+            Ignore sources that are farther than ``truncate * std`` from each
+            other (default :data:`GAUSSIAN_TRUNCATE`).
+
+        Returns
+        -------
+        smoother : scipy.sparse.csr_matrix, (n_sources, n_sources)
+            Smoothing matrix; each row contains the normalized weights for
+            smoothing one source. The matrix is cached, do not modify it.
+        """
+        if truncate is None:
+            truncate = GAUSSIAN_TRUNCATE
+        key = (std, truncate)
+        if key in self._smoothers:
+            return self._smoothers[key]
+
+        max_dist = truncate * std
+        blocks = []
+        for vertices, ss in izip(self.vertices, self.get_source_space()):
+            if ss['dist'] is None:
+                raise RuntimeError("Source-space does not contain distances")
+            # remove distances beyond max_dist before selecting columns
+            dist = ss['dist'][vertices].tocsr()
+            dist.data[dist.data > max_dist] = 0
+            dist.eliminate_zeros()
+            dist = dist[:, vertices].tocsr()
+            dist.data = np.exp(-(dist.data / std) ** 2 / 2)
+            # distance of each source to itself is 0 and not stored
+            eye = scipy.sparse.identity(len(vertices), format='csr')
+            blocks.append(dist + eye)
+        m = scipy.sparse.block_diag(blocks, 'csr')
+        # normalize weights for each target
+        m = scipy.sparse.diags(1. / np.asarray(m.sum(1)).ravel()).dot(m).tocsr()
+        self._smoothers[key] = m
+        return m
+
     def _link_midline(self, maxdist=0.015):
         """Link sources in the left and right hemispheres
 
@@ -8715,19 +9089,12 @@ class SourceSpace(Dimension):
                     "connectivity information it needs to be initialized with "
                     "src, subject and subjects_dir parameters")
 
-            src = self.get_source_space()
-            if self.kind == 'vol':
-                coords = src[0]['rr'][self.vertices[0]]
-                dist_threshold = self.grade * 0.0011
-                connectivity = _point_graph(coords, dist_threshold)
-            elif self.kind == 'ico':
-                connectivity = _mne_tri_soure_space_graph(src, self.vertices)
-            else:
-                msg = "Connectivity for %r source space" % self.kind
-                raise NotImplementedError(msg)
-
-            if connectivity.max() >= len(self):
-                raise RuntimeError("SourceSpace connectivity failed")
+            key = self._graph_cache_key()
+            connectivity = _source_space_graphs.get(key)
+            if connectivity is None:
+                connectivity = self._read_connectivity()
+                if key is not None:
+                    _source_space_graphs[key] = connectivity
             self._connectivity = connectivity
         else:
             connectivity = self._connectivity
@@ -8737,11 +9104,39 @@ class SourceSpace(Dimension):
             if parc is None:
                 raise RuntimeError("SourceSpace has no parcellation (use "
                                    ".set_parc())")
-            idx = np.array([parc[s] == parc[d] for s, d in connectivity])
+            idx = parc.x[connectivity[:, 0]] == parc.x[connectivity[:, 1]]
             connectivity = connectivity[idx]
 
         return connectivity
 
+    def _graph_cache_key(self):
+        """Key for caching connectivity across SourceSpace instances
+
+        Cached connectivity arrays are shared between instances and should not
+        be modified in place.
+        """
+        path = self._SRC_PATH.format(subjects_dir=self.subjects_dir,
+                                     subject=self.subject, src=self.src)
+        if os.path.exists(path):
+            return (path, os.path.getmtime(path), _vertices_hash(self.vertices))
+
+    def _read_connectivity(self):
+        "Connectivity based on the source space file"
+        src = self.get_source_space()
+        if self.kind == 'vol':
+            coords = src[0]['rr'][self.vertices[0]]
+            dist_threshold = self.grade * 0.0011
+            connectivity = _point_graph(coords, dist_threshold)
+        elif self.kind == 'ico':
+            connectivity = _mne_tri_soure_space_graph(src, self.vertices)
+        else:
+            msg = "Connectivity for %r source space" % self.kind
+            raise NotImplementedError(msg)
+
+        if connectivity.max() >= len(self):
+            raise RuntimeError("SourceSpace connectivity failed")
+        return connectivity
+
     def circular_index(self, seeds, extent=0.05, name="globe"):
         """Return an index into all vertices within extent of seed
 
@@ -0,0 +1,106 @@
+# Author: Christian Brodbeck <christianbrodbeck@nyu.edu>
+"""Command line interface for building MneExperiment cache files
+
+Used by the ``eelbrain-make-cache`` script::
+
+    $ eelbrain-make-cache my_experiment.py /path/to/root -s epoch=target --stc
+"""
+from __future__ import print_function
+
+from argparse import ArgumentParser
+import imp
+import inspect
+import logging
+import os
+
+from .mne_experiment import MneExperiment
+
+
+def parse_state(items):
+    "Parse a list of ``key=value`` strings into a state dictionary"
+    state = {}
+    for item in items:
+        key, sep, value = item.partition('=')
+        if not sep or not key:
+            raise ValueError("Invalid state parameter: %r; need key=value" %
+                             (item,))
+        state[key] = value
+    return state
+
+
+def load_experiment_class(path, name=None):
+    """Load an MneExperiment subclass from a Python file
+
+    Parameters
+    ----------
+    path : str
+        Python file containing the experiment class definition.
+    name : str
+        Name of the class (only needed if the file defines more than one
+        MneExperiment subclass).
+    """
+    module_name = os.path.splitext(os.path.basename(path))[0]
+    module = imp.load_source(module_name, path)
+    if name is not None:
+        cls = getattr(module, name, None)
+        if not (inspect.isclass(cls) and issubclass(cls, MneExperiment)):
+            raise ValueError("%s does not contain an MneExperiment subclass "
+                             "named %r" % (path, name))
+        return cls
+    classes = [c for c in vars(module).itervalues() if
+               inspect.isclass(c) and issubclass(c, MneExperiment) and
+               c.__module__ == module.__name__]
+    if len(classes) == 1:
+        return classes[0]
+    elif classes:
+        raise ValueError("%s contains multiple MneExperiment subclasses (%s); "
+                         "specify one with --class" %
+                         (path, ', '.join(sorted(c.__name__ for c in classes))))
+    raise ValueError("%s does not define an MneExperiment subclass" % (path,))
+
+
+def make_cache(argv=None):
+    """Run :meth:`MneExperiment.make_cache` from the command line
+
+    Returns
+    -------
+    status : int
+        Exit status (1 if making files failed for any subject).
+    """
+    parser = ArgumentParser(
+        description="Make missing and outdated cache files for an "
+                    "MneExperiment, processing subjects in parallel.")
+    parser.add_argument('path', help="Python file defining the experiment")
+    parser.add_argument('root', help="Experiment root directory")
+    parser.add_argument('--class', dest='cls', metavar='NAME',
+                        help="Name of the experiment class (if the file "
+                             "defines more than one)")
+    parser.add_argument('-g', '--group', help="Group of subjects")
+    parser.add_argument('-s', '--state', action='append', default=[],
+                        metavar='KEY=VALUE',
+                        help="State parameter (can be used multiple times)")
+    parser.add_argument('-n', '--n-workers', type=int,
+                        help="Number of worker processes")
+    parser.add_argument('--no-cov', dest='cov', action='store_false',
+                        help="Do not make covariance files")
+    parser.add_argument('--no-fwd', dest='fwd', action='store_false',
+                        help="Do not make forward solutions")
+    parser.add_argument('--no-evoked', dest='evoked', action='store_false',
+                        help="Do not make evoked files")
+    parser.add_argument('--epochs', action='store_true',
+                        help="Make the single trial sensor data cache")
+    parser.add_argument('--stc', action='store_true',
+                        help="Make the single trial source estimate cache")
+    args = parser.parse_args(argv)
+
+    try:
+        state = parse_state(args.state)
+    except ValueError as error:
+        parser.error(str(error))
+
+    logging.basicConfig(format="%(levelname)s %(message)s", level=logging.INFO)
+    cls = load_experiment_class(args.path, args.cls)
+    e = cls(args.root)
+    errors = e.make_cache(args.group, args.cov, args.fwd, args.evoked,
+                          args.epochs, args.stc, args.n_workers, **state)
+    return 1 if errors else 0
@@ -12,6 +12,7 @@ from os.path import exists, getmtime, isdir, join, relpath
 import re
 import shutil
 import time
+import traceback
 
 import numpy as np
 
@@ -28,18 +29,20 @@ from .. import plot
 from .. import save
 from .. import table
 from .. import testnd
+from .._config import CONFIG
 from .._data_obj import (
-    Datalist, Dataset, Factor, Var, align, all_equal,
+    Datalist, Dataset, Factor, NDVar, SourceSpace, UTS, Var, align, all_equal,
     asfactor, assert_is_legal_dataset_key, combine)
 from .._exceptions import DimensionMismatchError, OldVersionError
 from .._info import BAD_CHANNELS
-from .._io.fiff import KIT_NEIGHBORS
+from .._io.fiff import KIT_NEIGHBORS, _source_estimate_info
 from .._io.pickle import update_subjects_dir
 from .._names import INTERPOLATE_CHANNELS
 from .._meeg import new_rejection_ds
 from .._mne import (
-    dissolve_label, labels_from_mni_coords, rename_label, combination_label,
-    morph_source_space, shift_mne_epoch_trigger)
+    InverseKernel, dissolve_label, labels_from_mni_coords, rename_label, combination_label,
+    morph_matrix, morph_source_space, read_source_space_vertices,
+    shift_mne_epoch_trigger)
 from ..mne_fixes import (
     write_labels_to_annot, _interpolate_bads_eeg, _interpolate_bads_meg)
 from ..mne_fixes._trans import hsp_equal, mrk_equal
@@ -49,18 +52,20 @@ from .._report import named_list, enumeration, plural
 from .._resources import predefined_connectivity
 from .._stats.stats import ttest_t
 from .._stats.testnd import _MergedTemporalClusterDist
-from .._utils import WrappedFormater, ask, subp, keydefaultdict, log_level
+from .._utils import (
+    WrappedFormater, ask, subp, keydefaultdict, log_level, LRUCache)
 from .._utils.mne_utils import fix_annot_names, is_fake_mri
 from .definitions import (
     DefinitionError, assert_dict_has_args, find_dependent_epochs,
     find_epochs_vars, find_test_vars)
 from .experiment import FileTree
+from .parallel import FORK_AVAILABLE, iter_subjects
 from .parc import (
     FS_PARC, FSA_PARC, PARC_CLASSES, SEEDED_PARC_RE,
     Parcellation, CombinationParcellation, EelbrainParcellation,
     FreeSurferParcellation, FSAverageParcellation, SeededParcellation)
 from .preprocessing import (
-    assemble_pipeline, RawICA, pipeline_dict, compare_pipelines,
+    assemble_pipeline, CachedRawPipe, RawICA, pipeline_dict, compare_pipelines,
     ask_to_delete_ica_files)
 from .test_def import EvokedTest, TwoStageTest, assemble_tests
 
@@ -68,6 +73,14 @@ from .test_def import EvokedTest, TwoStageTest, assemble_tests
 # current cache state version
 CACHE_STATE_VERSION = 7
 
+# number of prepared inverse operators kept in memory
+INV_KERNEL_CACHE_SIZE = 2
+
+# steps for MneExperiment.make_cache() in the order in which they are made, and
+# steps that need to be possible for a given step
+CACHE_STEPS = ('cov', 'fwd', 'evoked', 'epochs', 'stc')
+CACHE_STEP_DEPS = {'stc': ('cov', 'fwd')}
+
 # Allowable parameters
 ICA_REJ_PARAMS = {'kind', 'source', 'epoch', 'interpolation', 'n_components',
                   'random_state', 'method'}
@@ -296,6 +309,14 @@ def _mask_ndvar(ds, name):
         ds[name] = y.sub(source=np.invert(mask))
 
 
+def _epochs_baseline_str(epoch, baseline):
+    "Component of cached epochs file names (None if data are not cached)"
+    if not baseline:
+        return 'nobl'
+    elif baseline is True or baseline == epoch.baseline:
+        return 'bl'
+
+
 def _time_str(t):
     "String for representing a time value"
     if t is None:
@@ -405,7 +426,7 @@ temp = {
     'raw-cache-dir': join('{cache-dir}', 'raw', '{subject}'),
     'raw-cache-base': join('{raw-cache-dir}', '{session} {raw}'),
     'cached-raw-file': '{raw-cache-base}-raw.fif',
-    'event-file': '{raw-cache-base}-evts.pickled',
+    'event-file': '{raw-cache-base}-evts.eds',
     'interp-file': '{raw-cache-base}-interp.pickled',
 
     # forward modeling:
@@ -422,17 +443,28 @@ temp = {
     'cov-base': join('{cov-dir}', '{subject}', '{sns_kind} {cov}-{rej}'),
     'cov-file': '{cov-base}-cov.fif',
     'cov-info-file': '{cov-base}-info.txt',
+    # morph matrices
+    'morph-dir': join('{cache-dir}', 'morph'),
     # evoked
     'evoked-dir': join('{cache-dir}', 'evoked'),
     'evoked-base': join('{evoked-dir}', '{subject}',
                         '{session} {sns_kind} {epoch} {model} {evoked_kind}'),
     'evoked-file': join('{evoked-base}-ave.fif'),
     'evoked-old-file': join('{evoked-base}.pickled'),  # removed for 0.25
+    # epochs
+    'epochs-dir': join('{cache-dir}', 'epochs'),
+    'epochs_baseline': 'bl',  # baseline correction of cached epochs
+    'epochs-file': join('{epochs-dir}', '{subject}',
+                        '{sns_kind} {epoch} {rej} {epochs_baseline}-epo.eds'),
+    'epochs-stc-file': join('{epochs-dir}', '{subject}',
+                            '{src_kind} {epoch} {rej} {epochs_baseline}-stc.eds'),
     # test files
     'test-dir': join('{cache-dir}', 'test'),
     'data_parc': 'unmasked',  # for some tests, parc and mask parameter can be saved in same file
     'test-file': join('{test-dir}', '{analysis} {group}',
                       '{epoch} {test} {test_options} {data_parc}.pickled'),
+    'test-checkpoint-file': join('{test-dir}', '{analysis} {group}',
+                                 '{epoch} {test} {test_options} {data_parc}.checkpoint'),
 
     # MRIs
     'common_brain': 'fsaverage',
@@ -735,6 +767,7 @@ class MneExperiment(FileTree):
 
         FileTree.__init__(self)
         self._log = log = logging.Logger(self.__class__.__name__, logging.DEBUG)
+        self._inv_kernels = LRUCache(INV_KERNEL_CACHE_SIZE)
 
         ########################################################################
         # sessions
@@ -1467,6 +1500,8 @@ class MneExperiment(FileTree):
                 # evoked files are based on old events
                 for subject, session in invalid_cache['events']:
                     rm['evoked-file'].add({'subject': subject, 'session': session})
+                    rm['epochs-file'].add({'subject': subject})
+                    rm['epochs-stc-file'].add({'subject': subject})
 
                 # variables
                 for var in invalid_cache['variables']:
@@ -1482,6 +1517,8 @@ class MneExperiment(FileTree):
                 for raw in invalid_cache['raw']:
                     rm['cached-raw-file'].add({'raw': raw})
                     rm['evoked-file'].add({'raw': raw})
+                    rm['epochs-file'].add({'raw': raw})
+                    rm['epochs-stc-file'].add({'raw': raw})
                     analysis = {'analysis': '* %s *' % raw}
                     rm['test-file'].add(analysis)
                     rm['report-file'].add(analysis)
@@ -1491,9 +1528,12 @@ class MneExperiment(FileTree):
                 # epochs
                 for epoch in invalid_cache['epochs']:
                     rm['evoked-file'].add({'epoch': epoch})
+                    rm['epochs-file'].add({'epoch': epoch})
+                    rm['epochs-stc-file'].add({'epoch': epoch})
                     for cov, cov_params in self._covs.iteritems():
                         if cov_params.get('epoch') != epoch:
                             continue
+                        rm['epochs-stc-file'].add({'cov': cov})
                         analysis = '* %s *' % cov
                         rm['test-file'].add({'analysis': analysis})
                         rm['report-file'].add({'analysis': analysis})
@@ -1527,6 +1567,9 @@ class MneExperiment(FileTree):
                     rm['test-file'].add({'test': test})
                     rm['report-file'].add({'test': test})
 
+                if 'test-file' in rm:
+                    rm['test-checkpoint-file'] = rm['test-file']
+
                 # find actual files to delete
                 log.debug("Outdated cache files:")
                 files = set()
@@ -1861,6 +1904,51 @@ class MneExperiment(FileTree):
 
         return subject_, group
 
+    def _group_n_workers(self, group):
+        "Number of worker processes for loading data for ``group``"
+        if not FORK_AVAILABLE:
+            return 0
+        n_subjects = len(list(self.iter(group=group)))
+        n_workers = min(CONFIG['n_workers'], n_subjects)
+        return n_workers if n_workers > 1 else 0
+
+    def _iter_group(self, method, group, args=(), kwargs=None, desc=None):
+        """Call a loading method for each subject in ``group``
+
+        Subjects are loaded in parallel worker processes if
+        ``configure(n_workers)`` allows it and processes can be forked (i.e.,
+        not on Windows). Results are yielded in subject order.
+
+        Parameters
+        ----------
+        method : str
+            Name of the method; the first parameter needs to be ``subject``.
+        group : str
+            Group of subjects.
+        args : tuple
+            Positional arguments for the method (after ``subject``).
+        kwargs : dict
+            Keyword arguments for the method.
+        desc : str
+            Description for showing a progress bar.
+        """
+        if kwargs is None:
+            kwargs = {}
+        n_workers = self._group_n_workers(group)
+        if n_workers:
+            subjects = list(self.iter(group=group))
+            for result in iter_subjects(self, method, subjects, args, kwargs,
+                                        n_workers, desc):
+                yield result
+        else:
+            func = getattr(self, method)
+            subjects = self.iter(group=group)
+            if desc is not None:
+                subjects = tqdm(subjects, desc,
+                                len(self.get_field_values('subject')))
+            for _ in subjects:
+                yield func(None, *args, **kwargs)
+
     def _cluster_criteria_kwargs(self, dims):
         criteria = self._cluster_criteria[self.get('select_clusters')]
         return {'min' + dim: criteria[dim] for dim in dims if dim in criteria}
@@ -1968,43 +2056,109 @@ class MneExperiment(FileTree):
             baseline = self._epochs[self.get('epoch')].baseline
 
         epochs = ds['epochs']
-        inv = self.load_inv(epochs)
-        stc = apply_inverse_epochs(epochs, inv, **self._params['apply_inv_kw'])
-
         if ndvar:
-            parc = self.get('parc') or None
-            if isinstance(mask, basestring) and parc != mask:
-                parc = mask
-                self.set(parc=mask)
-            self.make_annot()
-            subject = self.get('mrisubject')
-            src = self.get('src')
-            mri_sdir = self.get('mri-sdir')
-            src = load.fiff.stc_ndvar(stc, subject, src, mri_sdir,
-                                      self._params['apply_inv_kw']['method'],
-                                      self._params['make_inv_kw'].get('fixed', False),
-                                      parc=parc,
-                                      connectivity=self.get('connectivity'))
-            if baseline:
-                src -= src.summary(time=baseline)
-
-            if morph:
-                common_brain = self.get('common_brain')
-                with self._temporary_state:
-                    self.make_annot(mrisubject=common_brain)
-                ds['srcm'] = morph_source_space(src, common_brain)
-                if mask:
-                    _mask_ndvar(ds, 'srcm')
-            else:
-                ds['src'] = src
-                if mask:
-                    _mask_ndvar(ds, 'src')
+            src = self._apply_inv_epochs(epochs)
+            self._add_src_ndvar(ds, src, baseline, morph, mask)
         else:
             if baseline:
                 raise NotImplementedError("Baseline for SourceEstimate")
             if morph:
                 raise NotImplementedError("Morphing for SourceEstimate")
-            ds['stc'] = stc
+            inv = self.load_inv(epochs)
+            ds['stc'] = apply_inverse_epochs(epochs, inv,
+                                             **self._params['apply_inv_kw'])
+
+    def _apply_inv_epochs(self, epochs):
+        """Source estimates for epochs as NDVar (without parcellation)
+
+        The prepared inverse kernel is applied to the data of all epochs at
+        once, without creating :class:`mne.SourceEstimate` objects.
+        """
+        kernel = self._load_inv_kernel(epochs)
+        x = kernel.apply(epochs.get_data(), epochs.info)
+        source = SourceSpace(kernel.vertices, self.get('mrisubject'),
+                             self.get('src'), self.get('mri-sdir'), None)
+        uts = UTS(epochs.times[0], 1. / epochs.info['sfreq'], len(epochs.times))
+        info = _source_estimate_info(
+            self._params['apply_inv_kw']['method'],
+            self._params['make_inv_kw'].get('fixed', False))
+        return NDVar(x, ('case', source, uts), info)
+
+    def _load_inv_kernel(self, fiff):
+        """Prepared inverse operator for data with ``fiff.info``
+
+        The most recently used kernels are kept in memory and reused as long as
+        the forward solution and covariance files are not modified.
+        """
+        fwd_path = self.get('fwd-file', make=True)
+        cov_path = self.get('cov-file', make=True)
+        info = fiff.info
+        key = (fwd_path, getmtime(fwd_path), cov_path, getmtime(cov_path),
+               self.get('inv'), tuple(info['ch_names']), tuple(info['bads']),
+               tuple(proj['desc'] for proj in info['projs']))
+        kernel = self._inv_kernels.get(key)
+        if kernel is None:
+            inv = self.load_inv(fiff)
+            apply_kw = self._params['apply_inv_kw']
+            pick_ori = 'normal' if apply_kw.get('pick_normal') else None
+            kernel = InverseKernel(inv, apply_kw['lambda2'], apply_kw['method'],
+                                   pick_ori)
+            self._inv_kernels[key] = kernel
+        return kernel
+
+    def _add_src_ndvar(self, ds, src, baseline, morph, mask):
+        """Add single trial source estimates as NDVar
+
+        Parameters
+        ----------
+        ds : Dataset
+            Dataset to which to add the data.
+        src : NDVar
+            Source estimates without parcellation and connectivity
+            modification.
+        baseline, morph, mask :
+            See :meth:`._add_epochs_stc`.
+        """
+        parc = self.get('parc') or None
+        if isinstance(mask, basestring) and parc != mask:
+            parc = mask
+            self.set(parc=mask)
+        self.make_annot()
+        if parc:
+            src.source.set_parc(parc)
+        if self.get('connectivity') == 'link-midline':
+            src.source._link_midline()
+
+        if baseline:
+            src -= src.summary(time=baseline)
+
+        if morph:
+            common_brain = self.get('common_brain')
+            with self._temporary_state:
+                self.make_annot(mrisubject=common_brain)
+            ds['srcm'] = morph_source_space(src, common_brain,
+                                            cache_dir=self.get('morph-dir'))
+            if mask:
+                _mask_ndvar(ds, 'srcm')
+        else:
+            ds['src'] = src
+            if mask:
+                _mask_ndvar(ds, 'src')
+
+    def _load_epochs_cache(self, path, mtime, ds):
+        """Load cached epoch data if the cache is valid for the events in ds
+
+        Returns None if the cache file does not exist, is outdated, or was
+        made for different events.
+        """
+        if not mtime or not exists(path) or getmtime(path) <= mtime:
+            return
+        cache = load.dataset(path, mmap=True)
+        if (cache.n_cases == ds.n_cases and
+                np.all(cache['i_start'] == ds['i_start'])):
+            return cache
+        self._log.debug("Cached epochs for different events: %s",
+                        relpath(path, self.get('root')))
 
     def _add_evoked_stc(self, ds, ind_stc=False, ind_ndvar=False, morph_stc=False,
                         morph_ndvar=False, baseline=None, keep_evoked=False,
@@ -2339,6 +2493,7 @@ class MneExperiment(FileTree):
             print("All cached data cleared.")
         else:
             if level <= 2:
+                self.rm('epochs-dir', confirm=True)
                 self.rm('evoked-dir', confirm=True)
                 self.rm('cov-dir', confirm=True)
                 print("Cached epoch data cleared")
@@ -2693,14 +2848,11 @@ class MneExperiment(FileTree):
         subject, group = self._process_subject_arg(subject, kwargs)
 
         if group is not None:
-            dss = []
-            for _ in self.iter(group=group):
-                ds = self.load_epochs(None, baseline, ndvar, add_bads, reject,
-                                      cat, decim, pad, data_raw, vardef,
-                                      tmin=tmin, tmax=tmax, tstop=tstop)
-                dss.append(ds)
-
-            return combine(dss)
+            dss = self._iter_group('load_epochs', group,
+                                   (baseline, ndvar, add_bads, reject, cat,
+                                    decim, pad, data_raw, vardef),
+                                   {'tmin': tmin, 'tmax': tmax, 'tstop': tstop})
+            return combine(list(dss))
         elif self.get('modality') == 'meeg':  # single subject, combine MEG and EEG
             # FIXME: combine MEG/EEG based on different pipes
             with self._temporary_state:
@@ -2718,10 +2870,26 @@ class MneExperiment(FileTree):
             return ds
         # single subject, single modality
         epoch = self._epochs[self.get('epoch')]
+        # NDVars with the epoch's default parameters are cached for all events
+        cache_baseline = _epochs_baseline_str(epoch, baseline)
+        use_cache = (ndvar is True and add_bads is True and reject is True and
+                     self.get('modality') == '' and
+                     cache_baseline is not None and not pad and not eog and
+                     trigger_shift and apply_ica and tmin is None and
+                     tmax is None and tstop is None and
+                     (not decim or decim == epoch.decim))
         with self._temporary_state:
             ds = self.load_selected_events(add_bads=add_bads, reject=reject,
                                            data_raw=data_raw or True,
-                                           vardef=vardef, cat=cat)
+                                           vardef=vardef,
+                                           cat=None if use_cache else cat)
+            if use_cache and ds.n_cases:
+                ds = self._add_epochs_cached(ds, epoch, baseline,
+                                             cache_baseline, data_raw)
+                if cat:
+                    model = ds.eval(self.get('model'))
+                    ds = ds.sub(model.isin(cat))
+
             if ds.n_cases == 0:
                 err = ("No events left for epoch=%r, subject=%r" %
                        (epoch.name, subject))
@@ -2730,12 +2898,33 @@ class MneExperiment(FileTree):
                 raise RuntimeError(err)
 
             # load sensor space data
-            ds = self._add_epochs(ds, epoch, baseline, ndvar, data_raw, pad,
-                                  decim, reject, apply_ica, trigger_shift, eog,
-                                  tmin, tmax, tstop)
+            if not use_cache:
+                ds = self._add_epochs(ds, epoch, baseline, ndvar, data_raw,
+                                      pad, decim, reject, apply_ica,
+                                      trigger_shift, eog, tmin, tmax, tstop)
 
         return ds
 
+    def _add_epochs_cached(self, ds, epoch, baseline, cache_baseline,
+                           data_raw):
+        "Add epochs as NDVar to ``ds`` (all events), using the epochs cache"
+        name = self._ndvar_name_for_modality(self.get('modality'))
+        dst = self.get('epochs-file', mkdir=True,
+                       epochs_baseline=cache_baseline)
+        mtime = self._epochs_mtime()
+        cache = self._load_epochs_cache(dst, mtime, ds)
+        if cache is None:
+            ds = self._add_epochs(ds, epoch, baseline, True, data_raw, 0, None,
+                                  True, True, True, False, None, None, None)
+            if mtime:
+                save.dataset(Dataset([('i_start', ds['i_start']),
+                                      (name, ds[name])]), dst)
+        else:
+            ds[name] = cache[name]
+            if data_raw is False:
+                del ds.info['raw']
+        return ds
+
     def load_epochs_stc(self, subject=None, sns_baseline=True,
                         src_baseline=False, ndvar=True, cat=None,
                         keep_epochs=False, morph=False, mask=False,
@@ -2804,20 +2993,56 @@ class MneExperiment(FileTree):
                 raise ValueError("Source estimates can only be combined after "
                                  "morphing data to common brain model. Set "
                                  "morph=True.")
-            dss = []
-            for _ in self.iter(group=group):
-                ds = self.load_epochs_stc(None, sns_baseline, src_baseline,
-                                          ndvar, cat, keep_epochs, morph, mask,
-                                          False, vardef, decim)
-                dss.append(ds)
-            return combine(dss)
+            self._make_common_brain_annot(mask)
+            dss = self._iter_group('load_epochs_stc', group,
+                                   (sns_baseline, src_baseline, ndvar, cat,
+                                    keep_epochs, morph, mask, False, vardef,
+                                    decim))
+            return combine(list(dss))
+        epoch = self._epochs[self.get('epoch')]
+        cache_baseline = _epochs_baseline_str(epoch, sns_baseline)
+        if (ndvar and not keep_epochs and cache_baseline is not None and
+                (not decim or decim == epoch.decim)):
+            return self._load_epochs_stc_cached(sns_baseline, src_baseline,
+                                                cat, morph, mask, data_raw,
+                                                vardef, cache_baseline)
+        ds = self.load_epochs(subject, sns_baseline, False, cat=cat,
+                              decim=decim, data_raw=data_raw, vardef=vardef)
+        self._add_epochs_stc(ds, ndvar, src_baseline, morph, mask)
+        if not keep_epochs:
+            del ds['epochs']
+        return ds
+
+    def _load_epochs_stc_cached(self, sns_baseline, src_baseline, cat, morph,
+                                mask, data_raw, vardef, cache_baseline):
+        "Load single trial source estimates as NDVar using the stc cache"
+        ds = self.load_selected_events(data_raw=data_raw, vardef=vardef)
+        dst = self.get('epochs-stc-file', mkdir=True,
+                       epochs_baseline=cache_baseline)
+        mtime = self._epochs_stc_mtime()
+        cache = self._load_epochs_cache(dst, mtime, ds)
+        if cache is None:
+            ds = self.load_epochs(None, sns_baseline, False, data_raw=data_raw,
+                                  vardef=vardef)
+            src = self._apply_inv_epochs(ds.pop('epochs'))
+            if mtime:
+                save.dataset(Dataset([('i_start', ds['i_start']),
+                                      ('src', src)]), dst)
         else:
-            ds = self.load_epochs(subject, sns_baseline, False, cat=cat,
-                                  decim=decim, data_raw=data_raw, vardef=vardef)
-            self._add_epochs_stc(ds, ndvar, src_baseline, morph, mask)
-            if not keep_epochs:
-                del ds['epochs']
-            return ds
+            src = cache['src']
+            update_subjects_dir(src, self.get('mri-sdir'))
+
+        if cat:
+            ds['src'] = src
+            model = ds.eval(self.get('model'))
+            ds = ds.sub(model.isin(cat))
+            if ds.n_cases == 0:
+                raise RuntimeError("No events left for epoch=%r, subject=%r, "
+                                   "cat=%r" % (self.get('epoch'),
+                                               self.get('subject'), cat))
+            src = ds.pop('src')
+        self._add_src_ndvar(ds, src, src_baseline, morph, mask)
+        return ds
 
     def load_events(self, subject=None, add_bads=True, data_raw=True, **kwargs):
         """
@@ -2848,7 +3073,7 @@ class MneExperiment(FileTree):
         ds = None
         if exists(evt_file):
             if getmtime(evt_file) > self._raw_mtime():
-                ds = load.unpickle(evt_file)
+                ds = load.dataset(evt_file)
                 #  <0.19 cache
                 if 'sfreq' not in ds.info:
                     ds = None
@@ -2871,7 +3096,7 @@ class MneExperiment(FileTree):
                 edf.add_t_to(ds)
                 ds.info['edf'] = edf
 
-            save.pickle(ds, evt_file)
+            save.dataset(ds, evt_file)
         elif data_raw is True:
             raw = self.load_raw(add_bads, subject=subject)
 
@@ -2946,27 +3171,10 @@ class MneExperiment(FileTree):
             baseline = epoch.baseline
 
         if group is not None:
-            dss = [self.load_evoked(None, baseline, False, cat, decim, data_raw,
-                                    vardef)
-                   for _ in self.iter(group=group)]
-            if ndvar:
-                sysnames = set(ds.info['sysname'] for ds in dss)
-                if len(sysnames) != 1:
-                    err = ("Can not combine different MEG systems in a single "
-                           "NDVar (trying to load data with systems %s)" %
-                           enumeration(sysnames))
-                    raise NotImplementedError(err)
-            ds = combine(dss, incomplete='drop')
-
-            # check consistency in MNE objects' number of time points
-            lens = [len(e.times) for e in ds['evoked']]
-            ulens = set(lens)
-            if len(ulens) > 1:
-                err = ["Unequal time axis sampling (len):"]
-                alens = np.array(lens)
-                for l in ulens:
-                    err.append('%i: %r' % (l, ds['subject', alens == l].cells))
-                raise DimensionMismatchError('\n'.join(err))
+            dss = self._iter_group('load_evoked', group,
+                                   (baseline, False, cat, decim, data_raw,
+                                    vardef))
+            ds = self._combine_evoked(list(dss), ndvar)
         else:  # single subject
             ds = self._make_evoked(decim, data_raw)
 
@@ -3001,6 +3209,29 @@ class MneExperiment(FileTree):
 
         return ds
 
+    @staticmethod
+    def _combine_evoked(dss, ndvar):
+        "Combine evoked datasets from different subjects"
+        if ndvar:
+            sysnames = set(ds.info['sysname'] for ds in dss)
+            if len(sysnames) != 1:
+                err = ("Can not combine different MEG systems in a single "
+                       "NDVar (trying to load data with systems %s)" %
+                       enumeration(sysnames))
+                raise NotImplementedError(err)
+        ds = combine(dss, incomplete='drop')
+
+        # check consistency in MNE objects' number of time points
+        lens = [len(e.times) for e in ds['evoked']]
+        ulens = set(lens)
+        if len(ulens) > 1:
+            err = ["Unequal time axis sampling (len):"]
+            alens = np.array(lens)
+            for l in ulens:
+                err.append('%i: %r' % (l, ds['subject', alens == l].cells))
+            raise DimensionMismatchError('\n'.join(err))
+        return ds
+
     def load_epochs_stf(self, subject=None, sns_baseline=True, mask=True,
                         morph=False, keep_stc=False, **kwargs):
         """Load frequency space single trial data
@@ -3146,6 +3377,28 @@ class MneExperiment(FileTree):
                                       "implemented for baseline correction in "
                                       "source space")
 
+        if not (ind_stc or ind_ndvar):
+            # morphed data for different subjects can be loaded separately
+            _, group = self._process_subject_arg(subject, {})
+            if group is not None and self._group_n_workers(group):
+                self._make_common_brain_annot(mask)
+                dss = self._iter_group('load_evoked_stc', group,
+                                       (sns_baseline, src_baseline, False,
+                                        False, False, morph_stc, morph_ndvar,
+                                        cat, True, mask, data_raw, vardef))
+                ds = self._combine_evoked(list(dss), sns_ndvar)
+                if sns_ndvar:
+                    modality = self.get('modality')
+                    name = self._ndvar_name_for_modality(modality)
+                    ds[name] = load.fiff.evoked_ndvar(
+                        ds['evoked'], data=self._data_arg(modality),
+                        sysname=ds.info['sysname'])
+                    if modality == 'eeg':
+                        self._fix_eeg_ndvar(ds[name], group)
+                if not keep_evoked:
+                    del ds['evoked']
+                return ds
+
         ds = self.load_evoked(subject, sns_baseline, sns_ndvar, cat, None,
                               data_raw, vardef)
         self._add_evoked_stc(ds, ind_stc, ind_ndvar, morph_stc, morph_ndvar,
@@ -3153,6 +3406,13 @@ class MneExperiment(FileTree):
 
         return ds
 
+    def _make_common_brain_annot(self, mask):
+        "Make the common brain annot file (before loading subjects in parallel)"
+        with self._temporary_state:
+            if isinstance(mask, basestring):
+                self.set(parc=mask)
+            self.make_annot(mrisubject=self.get('common_brain'))
+
     def load_fwd(self, surf_ori=True, ndvar=False, mask=None):
         """Load the forward solution
 
@@ -3285,6 +3545,9 @@ class MneExperiment(FileTree):
     def load_morph_matrix(self, **state):
         """Load the morph matrix from mrisubject to common_brain
 
+        Morph matrices are cached in memory and in the experiment's cache
+        directory.
+
         Parameters
         ----------
         ...
@@ -3301,14 +3564,13 @@ class MneExperiment(FileTree):
         subject_to = self.get('common_brain')
         subject_from = self.get('mrisubject')
 
-        src_to = self.load_src(mrisubject=subject_to, match=False)
-        src_from = self.load_src(mrisubject=subject_from, match=False)
+        vertices_to = read_source_space_vertices(
+            self.get('src-file', make=True, mrisubject=subject_to, match=False))
+        vertices_from = read_source_space_vertices(
+            self.get('src-file', make=True, mrisubject=subject_from, match=False))
 
-        vertices_to = [src_to[0]['vertno'], src_to[1]['vertno']]
-        vertices_from = [src_from[0]['vertno'], src_from[1]['vertno']]
-
-        mm = mne.compute_morph_matrix(subject_from, subject_to, vertices_from,
-                                      vertices_to, None, subjects_dir)
+        mm = morph_matrix(subject_from, subject_to, vertices_from, vertices_to,
+                          subjects_dir, self.get('morph-dir'))
         return mm, vertices_to
 
     def load_raw(self, add_bads=True, preload=False, ndvar=False, decim=1, **kwargs):
@@ -3734,6 +3996,7 @@ class MneExperiment(FileTree):
 
         # try to load cached test
         res = None
+        res_prev = None  # cached test with fewer samples
         load_data = True
         desc = self._get_rel('test-file', 'test-dir')
         if self._result_file_mtime(dst, data):
@@ -3753,6 +4016,7 @@ class MneExperiment(FileTree):
                                   "make=True to perform the test." %
                                   (desc, res.samples, samples))
                 else:
+                    res_prev = res
                     res = None
         elif not make and exists(dst):
             raise IOError("The requested test is outdated: %s. Set make=True "
@@ -3778,18 +4042,19 @@ class MneExperiment(FileTree):
                 # stage 1
                 lms = []
                 dss = []
-                for subject in tqdm(self, "Loading stage 1 models",
-                                    len(self.get_field_values('subject'))):
-                    if test_obj.model is None:
-                        ds = self.load_epochs_stc(subject, sns_baseline,
-                                                  src_baseline, morph=True,
-                                                  mask=mask, vardef=test_obj.vars)
-                    else:
-                        ds = self.load_evoked_stc(subject, sns_baseline,
-                                                  src_baseline, morph_ndvar=True,
-                                                  mask=mask, vardef=test_obj.vars)
-
+                if test_obj.model is None:
+                    method = 'load_epochs_stc'
+                    kwargs = {'morph': True}
+                else:
+                    method = 'load_evoked_stc'
+                    kwargs = {'morph_ndvar': True}
+                kwargs.update(mask=mask, vardef=test_obj.vars)
+                self._make_common_brain_annot(mask)
+                for ds in self._iter_group(method, self.get('group'),
+                                           (sns_baseline, src_baseline), kwargs,
+                                           "Loading stage 1 models"):
                     if res is None:
+                        subject = ds['subject'].cells[0]
                         lms.append(testnd.LM(y_name, test_obj.stage_1, ds,
                                              subject=subject))
                     if return_data:
@@ -3818,7 +4083,9 @@ class MneExperiment(FileTree):
         # perform the test if it was not cached
         if res is None:
             self._log.info("Make test: %s", desc)
-            res = self._make_test(ds[y_name], ds, test, test_kwargs)
+            checkpoint = self.get('test-checkpoint-file')
+            with testnd.PermutationCheckpoint(checkpoint, res_prev):
+                res = self._make_test(ds[y_name], ds, test, test_kwargs)
             # cache
             save.pickle(res, dst)
 
@@ -4032,6 +4299,224 @@ class MneExperiment(FileTree):
         epoch = self._epochs[self.get('epoch')]
         save.besa_evt(ds, tstart=epoch.tmin, tstop=epoch.tmax, dest=evt_dest)
 
+    def make_cache(self, group=None, cov=True, fwd=True, evoked=True,
+                   epochs=False, stc=False, n_workers=None, **state):
+        """Make missing and outdated cache files for a group of subjects
+
+        First determines for each subject which cache files need to be made,
+        then makes them with one worker process per subject. For each subject,
+        files are made in the order of their dependencies (raw cache, then
+        covariance and forward solution, then evoked and single trial data).
+        Files for which input files are missing (e.g., because epoch rejection
+        has not been done yet for a subject) are skipped with a warning.
+
+        Parameters
+        ----------
+        group : str
+            Group of subjects (default is the current group).
+        cov : bool
+            Make the noise covariance (default True).
+        fwd : bool
+            Make the forward solution (default True).
+        evoked : bool
+            Make the evoked file for the current ``model`` (default True).
+        epochs : bool
+            Make the single trial sensor data cache used by
+            :meth:`.load_epochs` (default False; only MEG data are cached).
+        stc : bool
+            Make the single trial source estimate cache used by
+            :meth:`.load_epochs_stc` (default False).
+        n_workers : int
+            Number of worker processes (default is the ``n_workers`` setting of
+            :func:`configure`). With ``n_workers=1``, and on Windows, files are
+            made in the current process.
+        ...
+            State parameters.
+
+        Returns
+        -------
+        errors : dict
+            ``{subject: traceback}`` for subjects for which making a cache file
+            failed. Errors in one subject do not affect other subjects.
+
+        See Also
+        --------
+        eelbrain-make-cache : command line interface
+
+        Notes
+        -----
+        The raw cache is made for the current ``raw`` setting and all sessions;
+        all other files for the current state (e.g., ``epoch``, ``rej``,
+        ``cov``, ``model``).
+        """
+        if state:
+            self.set(**state)
+        if group is None:
+            group = self.get('group')
+        if n_workers is None:
+            n_workers = CONFIG['n_workers']
+        make = {'cov': cov, 'fwd': fwd, 'evoked': evoked, 'epochs': epochs,
+                'stc': stc}
+        steps = [step for step in CACHE_STEPS if make[step]]
+
+        # determine what needs to be done
+        plan = {}
+        subjects = []
+        scaled_mri = False
+        for subject in self.iter(group=group):
+            sessions, todo, missing = self._make_cache_plan(steps)
+            if missing:
+                self._log.warning("make_cache %s: missing input files for %s",
+                                  subject, ', '.join(missing))
+            if sessions or todo:
+                plan[subject] = (sessions, todo)
+                subjects.append(subject)
+                if ('fwd' in todo or 'stc' in todo) and not scaled_mri:
+                    scaled_mri = is_fake_mri(self.get('mri-dir'))
+        if not subjects:
+            self._log.info("make_cache: no cache files to make")
+            return {}
+        self._log.info("make_cache: making %i files for %i subjects",
+                       sum(len(s) + len(t) for s, t in plan.itervalues()),
+                       len(subjects))
+
+        # files that are shared between subjects
+        if scaled_mri:
+            with self._temporary_state:
+                self.make_src(mrisubject=self.get('common_brain'))
+            if 'stc' in steps:
+                self._make_common_brain_annot(False)
+
+        n_workers = min(n_workers, len(subjects))
+        if n_workers > 1 and FORK_AVAILABLE:
+            results = iter_subjects(self, '_make_subject_cache', subjects,
+                                    (plan,), n_workers=n_workers,
+                                    desc="Making cache")
+        else:
+            results = (self._make_subject_cache(subject, plan) for subject in
+                       tqdm(subjects, "Making cache"))
+
+        errors = {}
+        for subject, error in izip(subjects, results):
+            if error:
+                self._log.error("make_cache %s: %s", subject, error)
+                errors[subject] = error
+        if errors:
+            self._log.warning("make_cache: failed for %i of %i subjects: %s",
+                              len(errors), len(subjects),
+                              ', '.join(s for s in subjects if s in errors))
+        return errors
+
+    def _make_cache_plan(self, steps):
+        """Determine which cache files need to be made for the current subject
+
+        Parameters
+        ----------
+        steps : list of str
+            Steps to check (in the order of :data:`CACHE_STEPS`).
+
+        Returns
+        -------
+        sessions : list of str
+            Sessions for which the raw cache needs to be made.
+        todo : list of str
+            Steps for which cache files need to be made.
+        missing : list of str
+            Steps that can not be made because input files are missing.
+        """
+        subject = self.get('subject')
+        pipe = self._raw[self.get('raw')]
+        sessions = []
+        if isinstance(pipe, CachedRawPipe):
+            source = pipe
+            while isinstance(source, CachedRawPipe):
+                if (isinstance(source, RawICA) and
+                        not exists(source.ica_path.format(subject=subject))):
+                    return [], [], ['raw'] + steps
+                source = source.source
+            for session in self.iter('session'):
+                if (pipe.mtime(subject, session, False) and
+                        pipe.cache_is_outdated(subject, session)):
+                    sessions.append(session)
+
+        todo = []
+        missing = []
+        with self._temporary_state:
+            for step in steps:
+                if any(dep in missing for dep in CACHE_STEP_DEPS.get(step, ())):
+                    missing.append(step)
+                    continue
+                elif step in ('fwd', 'stc'):
+                    if not exists(self.get('trans-file')):
+                        missing.append(step)
+                        continue
+
+                if step == 'cov':
+                    mtime = self._cov_mtime()
+                    dst = self.get('cov-file')
+                elif step == 'fwd':
+                    mtime = self._fwd_mtime()
+                    dst = self.get('fwd-file')
+                    if not mtime:  # source space needs to be made
+                        todo.append(step)
+                        continue
+                elif step == 'evoked':
+                    mtime = self._evoked_mtime()
+                    dst = self.get('evoked-file')
+                elif step == 'epochs':
+                    if self.get('modality') != '':
+                        # load_epochs() only caches MEG data
+                        continue
+                    mtime = self._epochs_mtime()
+                    dst = self.get('epochs-file', epochs_baseline='bl')
+                elif step == 'stc':
+                    if not self._epochs_mtime():
+                        missing.append(step)
+                        continue
+                    mtime = self._epochs_stc_mtime()
+                    dst = self.get('epochs-stc-file', epochs_baseline='bl')
+                    if not mtime:  # cov or fwd need to be made
+                        todo.append(step)
+                        continue
+                else:
+                    raise RuntimeError("step=%r" % (step,))
+
+                if not mtime:
+                    missing.append(step)
+                elif not exists(dst) or getmtime(dst) <= mtime:
+                    todo.append(step)
+        return sessions, todo, missing
+
+    def _make_subject_cache(self, subject, plan):
+        """Make the cache files in ``plan[subject]`` (see :meth:`.make_cache`)
+
+        Returns
+        -------
+        error : None | str
+            Traceback if making a file failed.
+        """
+        sessions, steps = plan[subject]
+        with self._temporary_state:
+            self.set(subject=subject)
+            jobs = [('raw', s) for s in sessions] + [(s, None) for s in steps]
+            for step, session in jobs:
+                try:
+                    if step == 'raw':
+                        self.make_raw(session=session)
+                    elif step == 'cov':
+                        self.make_cov()
+                    elif step == 'fwd':
+                        self.make_fwd()
+                    elif step == 'evoked':
+                        self.load_evoked(ndvar=False)
+                    elif step == 'epochs':
+                        self.load_epochs(baseline=True)
+                    elif step == 'stc':
+                        self.load_epochs_stc(sns_baseline=True)
+                except Exception:
+                    return ("making %s failed:\n%s" %
+                            (step, traceback.format_exc()))
+
     def make_copy(self, temp, field, src, dst, redo=False):
         """Make a copy of a file
 
@@ -0,0 +1,152 @@
+# Author: Christian Brodbeck <christianbrodbeck@nyu.edu>
+"""Run experiment methods for several subjects in worker processes
+
+Workers are forked from the current process, so that each worker operates on
+its own copy of the experiment and its state. Datasets are returned through
+files in shared memory (:func:`save.dataset`) and loaded memory-mapped, other
+results are pickled. Experiments can not be pickled, so workers are only used
+where processes can be forked (:data:`FORK_AVAILABLE`).
+"""
+from multiprocessing import Process, Queue
+import os
+from Queue import Empty
+import shutil
+import signal
+import sys
+import tempfile
+import traceback
+
+from tqdm import tqdm
+
+from .. import load, save
+from .._data_obj import Dataset
+from .._utils.system import SHARED_DIR
+
+
+JOB_TERMINATE = None
+# worker processes that are forked inherit the experiment without pickling
+FORK_AVAILABLE = sys.platform != 'win32'
+# seconds between checks whether workers are still alive
+POLL_INTERVAL = 1.
+
+
+def subject_worker(experiment, method, args, kwargs, tempdir, job_queue,
+                   result_queue):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    func = getattr(experiment, method)
+    while True:
+        job = job_queue.get()
+        if job is JOB_TERMINATE:
+            return
+        i, subject = job
+        try:
+            with experiment._temporary_state:
+                result = func(subject, *args, **kwargs)
+            if isinstance(result, Dataset):
+                path = os.path.join(tempdir, '%i.eds' % i)
+                save.dataset(result, path)
+                result_queue.put((i, True, path))
+            else:
+                result_queue.put((i, False, result))
+        except Exception:
+            result_queue.put((i, None, traceback.format_exc()))
+
+
+def get_result(result_queue, workers):
+    """Get the next result, raising an error if workers died
+
+    Parameters
+    ----------
+    result_queue : Queue
+        Queue to which the workers write results.
+    workers : list of Process
+        Worker processes writing to ``result_queue``.
+    """
+    while True:
+        try:
+            return result_queue.get(True, POLL_INTERVAL)
+        except Empty:
+            dead = [w for w in workers if w.exitcode not in (None, 0)]
+            if dead or not any(w.is_alive() for w in workers):
+                codes = ', '.join(str(w.exitcode) for w in dead)
+                raise RuntimeError("Worker process terminated unexpectedly "
+                                   "(exit code %s)" % (codes or 0,))
+
+
+def iter_subjects(experiment, method, subjects, args=(), kwargs=None,
+                  n_workers=2, desc=None):
+    """Call ``experiment.method(subject, *args, **kwargs)`` for each subject
+
+    Results are yielded in the order of ``subjects`` as soon as they are
+    available, so that the caller can process and discard them one by one.
+
+    Parameters
+    ----------
+    experiment : MneExperiment
+        The experiment.
+    method : str
+        Name of the method to call. The method's first argument needs to be
+        ``subject``.
+    subjects : sequence of str
+        Subjects for which to call the method.
+    args : tuple
+        Additional positional arguments for the method.
+    kwargs : dict
+        Keyword arguments for the method.
+    n_workers : int
+        Number of worker processes.
+    desc : str
+        Description for the progress bar (default is no progress bar).
+
+    Yields
+    ------
+    result :
+        Return value of the method for each subject.
+    """
+    if kwargs is None:
+        kwargs = {}
+    n = len(subjects)
+    n_workers = min(n_workers, n)
+    tempdir = tempfile.mkdtemp(dir=SHARED_DIR)
+    job_queue = Queue()
+    result_queue = Queue()
+    workers = [Process(target=subject_worker,
+                       args=(experiment, method, args, kwargs, tempdir,
+                             job_queue, result_queue))
+               for _ in xrange(n_workers)]
+    try:
+        for worker in workers:
+            worker.daemon = True
+            worker.start()
+        for job in enumerate(subjects):
+            job_queue.put(job)
+        for _ in xrange(n_workers):
+            job_queue.put(JOB_TERMINATE)
+
+        # collect results and yield them in order
+        pending = {}
+        pbar = tqdm(desc=desc, total=n, disable=desc is None)
+        for i_next in xrange(n):
+            while i_next not in pending:
+                i, is_ds, result = get_result(result_queue, workers)
+                if is_ds is None:
+                    raise RuntimeError("Error in worker for subject %s:\n%s" %
+                                       (subjects[i], result))
+                pending[i] = (is_ds, result)
+                pbar.update()
+            is_ds, result = pending.pop(i_next)
+            if is_ds:
+                path = result
+                result = load.dataset(path, mmap=True)
+                # without fork (Windows) workers are not used; elsewhere a file
+                # can be removed while it is memory-mapped
+                os.remove(path)
+            yield result
+        pbar.close()
+        for worker in workers:
+            worker.join()
+    finally:
+        for worker in workers:
+            if worker.is_alive():
+                worker.terminate()
+        shutil.rmtree(tempdir, True)
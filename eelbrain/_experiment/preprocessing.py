@@ -124,9 +124,8 @@ class CachedRawPipe(RawPipe):
 
     def cache(self, subject, session):
         "Make sure the cache is up to date"
-        path = self.path.format(subject=subject, session=session)
-        if (not exists(path) or getmtime(path) <
-                self.mtime(subject, session, self._bad_chs_affect_cache)):
+        if self.cache_is_outdated(subject, session):
+            path = self.path.format(subject=subject, session=session)
             dir_path = dirname(path)
             if not exists(dir_path):
                 mkdir(dir_path)
@@ -134,6 +133,12 @@ class CachedRawPipe(RawPipe):
                 raw = self._make(subject, session)
             raw.save(path, overwrite=True)
 
+    def cache_is_outdated(self, subject, session):
+        "Whether the cache file is missing or older than its input files"
+        path = self.path.format(subject=subject, session=session)
+        return (not exists(path) or getmtime(path) <
+                self.mtime(subject, session, self._bad_chs_affect_cache))
+
     def load(self, subject, session, add_bads=True, preload=False):
         self.cache(subject, session)
         return RawPipe.load(self, subject, session, add_bads, preload)
@@ -0,0 +1,42 @@
+# Author: Christian Brodbeck <christianbrodbeck@nyu.edu>
+import os
+
+from nose.tools import eq_, assert_raises
+
+from eelbrain._experiment.cli import (
+    load_experiment_class, make_cache, parse_state)
+from eelbrain._utils.testing import TempDir
+
+
+EXPERIMENT = """
+from eelbrain import MneExperiment
+
+
+class CLIExperiment(MneExperiment):
+
+    path_version = 1
+
+    sessions = 'file'
+"""
+
+
+def test_make_cache_cli():
+    "Test the eelbrain-make-cache command line interface"
+    eq_(parse_state(['epoch=target', 'rej=man']),
+        {'epoch': 'target', 'rej': 'man'})
+    assert_raises(ValueError, parse_state, ['epoch'])
+
+    tempdir = TempDir()
+    path = os.path.join(tempdir, 'cli_experiment.py')
+    with open(path, 'w') as fid:
+        fid.write(EXPERIMENT)
+    eq_(load_experiment_class(path).__name__, 'CLIExperiment')
+    eq_(load_experiment_class(path, 'CLIExperiment').__name__,
+        'CLIExperiment')
+    assert_raises(ValueError, load_experiment_class, path, 'MneExperiment2')
+
+    # experiment without input files: nothing to do
+    root = os.path.join(tempdir, 'root')
+    for subject in ('R0001', 'R0002'):
+        os.makedirs(os.path.join(root, 'meg', subject))
+    eq_(make_cache([path, root, '-n', '1', '-s', 'session=file', '--stc']), 0)
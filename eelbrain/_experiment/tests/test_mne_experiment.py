@@ -5,7 +5,7 @@ from nose.tools import eq_, ok_, assert_raises
 import numpy as np
 from numpy.testing import assert_array_equal
 
-from eelbrain import Dataset, Factor, Var, MneExperiment
+from eelbrain import Dataset, Factor, NDVar, UTS, Var, MneExperiment, save
 from ..._utils.testing import assert_dataobj_equal, TempDir
 
 
@@ -93,6 +93,11 @@ def test_mne_experiment_templates():
     eq_(e.find_keys('evoked-file', False),
         {'subject', 'session', 'modality', 'raw', 'epoch', 'rej',
          'equalize_evoked_count', 'model', })
+    eq_(e.find_keys('epochs-file', False),
+        {'subject', 'modality', 'raw', 'epoch', 'rej', 'epochs_baseline'})
+    eq_(e.find_keys('epochs-stc-file', False),
+        {'subject', 'modality', 'raw', 'epoch', 'rej', 'epochs_baseline',
+         'cov', 'mri', 'src-name', 'inv'})
 
     # inv
     SNR2 = 1. / 2**2
@@ -155,6 +160,34 @@ def test_test_experiment():
     eq_(e._epochs['cheese-tilsit'].tmin, -0.2)
 
 
+def test_epochs_cache():
+    "Test validation of cached epochs"
+    tempdir = TempDir()
+    e = BaseExperiment(tempdir, False)
+    ds = gen_triggers()
+    rng = np.random.RandomState(0)
+    epochs = NDVar(rng.normal(0, 1, (ds.n_cases, 10)),
+                   ('case', UTS(0, 0.01, 10)), name='epochs')
+    path = os.path.join(tempdir, 'epochs.eds')
+    eq_(e._load_epochs_cache(path, 1., ds), None)
+    save.dataset(Dataset([('i_start', ds['i_start']), ('epochs', epochs)]),
+                 path)
+    mtime = os.path.getmtime(path)
+
+    # matching events
+    cache = e._load_epochs_cache(path, mtime - 1, ds)
+    assert_dataobj_equal(cache['epochs'], epochs)
+    # different events
+    ds_ = ds.copy()
+    ds_['i_start'] = ds['i_start'] + 1
+    eq_(e._load_epochs_cache(path, mtime - 1, ds_), None)
+    eq_(e._load_epochs_cache(path, mtime - 1, ds[1:]), None)
+    # stale cache
+    eq_(e._load_epochs_cache(path, mtime, ds), None)
+    eq_(e._load_epochs_cache(path, mtime + 1, ds), None)
+    eq_(e._load_epochs_cache(path, None, ds), None)
+
+
 class FileExperiment(MneExperiment):
 
     path_version = 1
@@ -0,0 +1,73 @@
+# Author: Christian Brodbeck <christianbrodbeck@nyu.edu>
+from contextlib import contextmanager
+import os
+
+from nose.tools import eq_, ok_, assert_raises
+import numpy as np
+
+from eelbrain import Dataset, Factor, NDVar, UTS, combine
+from eelbrain._experiment.parallel import iter_subjects
+from eelbrain._utils.testing import assert_dataobj_equal
+
+
+class Experiment(object):
+    "Minimal experiment with state"
+    def __init__(self):
+        self.state = {'subject': None, 'pid': None}
+
+    @property
+    @contextmanager
+    def _temporary_state(self):
+        state = self.state.copy()
+        yield
+        self.state = state
+
+    def load_data(self, subject, n):
+        if self.state['subject'] is not None:
+            raise RuntimeError("State leaked from previous subject")
+        self.state['subject'] = subject
+        ds = Dataset()
+        ds['subject'] = Factor([subject], repeat=n, random=True)
+        x = np.arange(n * 5.).reshape((n, 5)) + int(subject[1:])
+        ds['y'] = NDVar(x, ('case', UTS(0, 0.1, 5)), name='y')
+        ds.info['pid'] = os.getpid()
+        return ds
+
+    def get_pid(self, subject):
+        if subject == 'fail':
+            raise ValueError("Failing subject")
+        return os.getpid()
+
+    def exit(self, subject):
+        os._exit(1)
+
+
+def test_iter_subjects():
+    "Test loading subjects in parallel worker processes"
+    e = Experiment()
+    subjects = ['s%i' % i for i in xrange(5)]
+
+    dss = list(iter_subjects(e, 'load_data', subjects, (3,), n_workers=2))
+    eq_([ds['subject'][0] for ds in dss], subjects)
+    ok_(isinstance(dss[0]['y'].x, np.memmap))
+    ok_(all(ds.info['pid'] != os.getpid() for ds in dss))
+    ds = combine(dss)
+    target = []
+    for subject in subjects:
+        with e._temporary_state:
+            target.append(e.load_data(subject, 3))
+    target = combine(target)
+    assert_dataobj_equal(ds['y'], target['y'])
+
+    # other results
+    pids = list(iter_subjects(e, 'get_pid', subjects, n_workers=2))
+    ok_(len(set(pids)) <= 2)
+    ok_(os.getpid() not in pids)
+
+    # errors in workers
+    assert_raises(RuntimeError, list,
+                  iter_subjects(e, 'get_pid', ['s1', 'fail'], n_workers=2))
+
+    # worker dying without result
+    assert_raises(RuntimeError, list,
+                  iter_subjects(e, 'exit', ['s1', 's2'], n_workers=2))
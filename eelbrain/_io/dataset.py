@@ -0,0 +1,230 @@
+# Author: Christian Brodbeck <christianbrodbeck@nyu.edu>
+"""Columnar binary file format for datasets
+
+File layout
+-----------
+The file starts with :data:`MAGIC`, followed by the length of the header as
+unsigned 64 bit integer and the pickled header. The header describes the
+:class:`Dataset` attributes and, for each column, how to reconstruct the
+data-object and where its data are stored. The data section starts at the
+first multiple of :data:`ALIGN` bytes after the header. Each data array is
+stored C-contiguous at an offset (relative to the data section) that is a
+multiple of :data:`ALIGN` bytes, so that it can be read independently of the
+other columns, or memory-mapped.
+"""
+from __future__ import print_function
+
+from cPickle import dumps, HIGHEST_PROTOCOL, Unpickler
+from cStringIO import StringIO
+import os
+import struct
+
+import numpy as np
+
+from .._data_obj import Dataset, Factor, NDVar, Var
+from .._utils import ui
+from .pickle import map_paths
+
+
+MAGIC = b'\x93EELDS'
+VERSION = 1
+ALIGN = 64
+EXT = '.eds'
+FILETYPES = [("Eelbrain Datasets (*%s)" % EXT, '*' + EXT)]
+HEADER_LEN = struct.Struct('<Q')
+
+# column kinds
+VAR = 'var'
+FACTOR = 'factor'
+NDVAR = 'ndvar'
+PICKLE = 'pickle'
+
+
+def _loads(string):
+    "Unpickle, handling changes in module paths"
+    unpickler = Unpickler(StringIO(string))
+    unpickler.find_global = map_paths
+    return unpickler.load()
+
+
+def _column_state(obj):
+    "Split a data-object into (kind, state without data, data array)"
+    if isinstance(obj, (Var, Factor, NDVar)) and not obj.x.dtype.hasobject:
+        if isinstance(obj, Var):
+            x, name, info = obj.__getstate__()
+            return VAR, {'name': name, 'info': info}, x
+        state = obj.__getstate__()
+        x = state.pop('x')
+        if isinstance(obj, Factor):
+            return FACTOR, state, x
+        else:
+            return NDVAR, state, x
+    x = np.frombuffer(dumps(obj, HIGHEST_PROTOCOL), np.uint8)
+    return PICKLE, None, x
+
+
+def _column_object(kind, state, x):
+    "Reconstruct a data-object from :func:`_column_state` output"
+    if kind == PICKLE:
+        return _loads(x.tobytes())
+    elif kind == VAR:
+        obj = Var.__new__(Var)
+        obj.__setstate__((x, state['name'], state['info']))
+        return obj
+    elif kind == FACTOR:
+        cls = Factor
+    elif kind == NDVAR:
+        cls = NDVar
+    else:
+        raise IOError("Unknown column kind in dataset file: %r" % (kind,))
+    state = dict(state, x=x)
+    obj = cls.__new__(cls)
+    obj.__setstate__(state)
+    return obj
+
+
+def _aligned(pos):
+    return -(-pos // ALIGN) * ALIGN
+
+
+def save_dataset(ds, dest=None):
+    """Save a Dataset in Eelbrain's columnar binary format
+
+    Parameters
+    ----------
+    ds : Dataset
+        Dataset to save.
+    dest : None | str
+        Path to destination where to save the file. If no destination is
+        provided, a file dialog is shown. If a destination without extension
+        is provided, ``'.eds'`` is appended.
+
+    See Also
+    --------
+    load.dataset : load a dataset saved with this function
+
+    Notes
+    -----
+    Unlike :func:`save.pickle`, each column is stored as raw array with its
+    metadata, which allows loading only selected columns, or memory-mapping
+    :class:`NDVar` data instead of reading them into memory (see
+    :func:`load.dataset`). :class:`Var`, :class:`Factor` and :class:`NDVar`
+    columns are stored as arrays; other columns (e.g. :class:`Datalist`), as
+    well as ``ds.info``, are pickled.
+    """
+    if not isinstance(ds, Dataset):
+        raise TypeError("ds=%r: need Dataset" % (ds,))
+
+    if dest is None:
+        dest = ui.ask_saveas("Save Dataset", "", FILETYPES)
+        if dest is False:
+            raise RuntimeError("User canceled")
+        else:
+            print('dest=%r' % dest)
+    else:
+        dest = os.path.expanduser(dest)
+        if not os.path.splitext(dest)[1]:
+            dest += EXT
+
+    # header
+    columns = []
+    arrays = []
+    pos = 0
+    for key, obj in ds.iteritems():
+        kind, state, x = _column_state(obj)
+        x = np.ascontiguousarray(x)
+        columns.append((key, kind, state, x.dtype.str, x.shape, pos))
+        arrays.append((pos, x))
+        pos = _aligned(pos + x.nbytes)
+    header = {'version': VERSION,
+              'name': ds.name,
+              'caption': ds._caption,
+              'info': ds.info,
+              'n_cases': ds.n_cases,
+              'columns': columns}
+    header_string = dumps(header, HIGHEST_PROTOCOL)
+    data_start = _aligned(len(MAGIC) + HEADER_LEN.size + len(header_string))
+
+    with open(dest, 'wb') as fid:
+        fid.write(MAGIC)
+        fid.write(HEADER_LEN.pack(len(header_string)))
+        fid.write(header_string)
+        for offset, x in arrays:
+            fid.seek(data_start + offset)
+            x.tofile(fid)
+        fid.truncate(data_start + pos)
+
+
+def _read_header(fid, path):
+    "Read the header and return it with the position of the data section"
+    if fid.read(len(MAGIC)) != MAGIC:
+        raise IOError("Not an Eelbrain dataset file: %s" % (path,))
+    n, = HEADER_LEN.unpack(fid.read(HEADER_LEN.size))
+    header = _loads(fid.read(n))
+    if header['version'] > VERSION:
+        raise IOError("Dataset file was saved with a newer version of "
+                      "Eelbrain (file format version %i): %s" %
+                      (header['version'], path))
+    return header, _aligned(fid.tell())
+
+
+def load_dataset(path=None, columns=None, mmap=False):
+    """Load a Dataset saved with :func:`save.dataset`
+
+    Parameters
+    ----------
+    path : None | str
+        Path to the file. If None (default), a system file dialog will be
+        shown. If the user cancels the file dialog, a RuntimeError is raised.
+    columns : sequence of str
+        Only load these columns (default is all columns).
+    mmap : bool
+        Memory-map :class:`NDVar` data instead of reading them into memory
+        (default False). Memory-mapped data are opened in copy-on-write mode,
+        i.e., changes are not written back to the file.
+
+    Returns
+    -------
+    ds : Dataset
+        The dataset.
+    """
+    if path is None:
+        path = ui.ask_file("Load Dataset", "Select a dataset file to load",
+                           FILETYPES + [("All files", '*')])
+        if path is False:
+            raise RuntimeError("User canceled")
+        else:
+            print(repr(path))
+    else:
+        path = os.path.expanduser(path)
+        if not os.path.exists(path) and not os.path.splitext(path)[1]:
+            path += EXT
+
+    with open(path, 'rb') as fid:
+        header, data_start = _read_header(fid, path)
+        all_keys = [c[0] for c in header['columns']]
+        if columns is None:
+            index = range(len(all_keys))
+        else:
+            if isinstance(columns, basestring):
+                columns = (columns,)
+            missing = [key for key in columns if key not in all_keys]
+            if missing:
+                raise KeyError("Columns not in %s: %s" %
+                               (path, ', '.join(map(repr, missing))))
+            index = [all_keys.index(key) for key in columns]
+
+        items = []
+        for i in index:
+            key, kind, state, dtype, shape, offset = header['columns'][i]
+            dtype = np.dtype(dtype)
+            if mmap and kind == NDVAR and dtype.itemsize * np.prod(shape):
+                x = np.memmap(path, dtype, 'c', data_start + offset, shape)
+            else:
+                fid.seek(data_start + offset)
+                count = int(np.prod(shape))
+                x = np.fromfile(fid, dtype, count).reshape(shape)
+            items.append((key, _column_object(kind, state, x)))
+
+    return Dataset(items, header['name'], header['caption'], header['info'],
+                   header['n_cases'])
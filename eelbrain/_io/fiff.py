@@ -1042,7 +1042,12 @@ def stc_ndvar(stc, subject, src, subjects_dir=None, method=None, fixed=None,
     else:
         dims = (ss, time)
 
-    # find the right measurement info
+    info = _source_estimate_info(method, fixed)
+    return NDVar(x, dims, info, name)
+
+
+def _source_estimate_info(method, fixed):
+    "Find the right measurement info for source estimates"
     info = {}
     if fixed is False:
         info['meas'] = 'Activation'
@@ -1060,8 +1065,7 @@ def stc_ndvar(stc, subject, src, subjects_dir=None, method=None, fixed=None,
             raise ValueError("method=%s" % repr(method))
     elif fixed is not None:
         raise ValueError("fixed=%s" % repr(fixed))
-
-    return NDVar(x, dims, info, name)
+    return info
 
 
 def _trim_ds(ds, epochs):
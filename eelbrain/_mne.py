@@ -5,13 +5,26 @@ import re
 
 import numpy as np
 import scipy as sp
+import scipy.sparse
 from scipy.spatial.distance import cdist
 
 import mne
+from mne.io.constants import FIFF
 from mne.label import Label, BiHemiLabel
+from mne.minimum_norm.inverse import (
+    _assemble_kernel, _check_ch_names, _pick_channels_inverse_operator,
+    prepare_inverse_operator)
 from mne.utils import get_subjects_dir
 
-from ._data_obj import NDVar, SourceSpace
+from ._data_obj import NDVar, SourceSpace, _vertices_hash
+from ._utils import LRUCache
+
+
+# number of morph matrices kept in memory
+MORPH_CACHE_SIZE = 8
+_morph_cache = LRUCache(MORPH_CACHE_SIZE)
+# {path: (mtime, vertices)}
+_src_vertices_cache = {}
 
 
 def _vertices_equal(v1, v0):
@@ -19,6 +32,209 @@ def _vertices_equal(v1, v0):
     return np.array_equal(v1[0], v0[0]) and np.array_equal(v1[1], v0[1])
 
 
+def read_source_space_vertices(path):
+    """Read the vertices of a source space file
+
+    Vertices are cached in memory for as long as the file is not modified.
+
+    Parameters
+    ----------
+    path : str
+        Path to a source space file (``*-src.fif``).
+
+    Returns
+    -------
+    vertices : list of array of int
+        Vertices in each hemisphere.
+    """
+    mtime = os.path.getmtime(path)
+    if path in _src_vertices_cache:
+        cached_mtime, vertices = _src_vertices_cache[path]
+        if cached_mtime == mtime:
+            return list(vertices)
+    vertices = [ss['vertno'] for ss in mne.read_source_spaces(path)]
+    _src_vertices_cache[path] = (mtime, vertices)
+    return list(vertices)
+
+
+def _morph_input_mtime(subject_from, subject_to, subjects_dir):
+    "Last modification of the spherical registrations used for morphing"
+    mtime = 0
+    for subject in (subject_from, subject_to):
+        for hemi in ('lh', 'rh'):
+            path = os.path.join(subjects_dir, subject, 'surf',
+                                '%s.sphere.reg' % hemi)
+            if os.path.exists(path):
+                mtime = max(mtime, os.path.getmtime(path))
+    return mtime
+
+
+def _save_sparse(path, mat):
+    "Save a CSR matrix (:func:`scipy.sparse.save_npz` requires scipy 0.19)"
+    with open(path, 'wb') as fid:
+        np.savez(fid, data=mat.data, indices=mat.indices, indptr=mat.indptr,
+                 shape=mat.shape)
+
+
+def _load_sparse(path):
+    "Load a CSR matrix saved with :func:`_save_sparse`"
+    with np.load(path) as npz:
+        return sp.sparse.csr_matrix(
+            (npz['data'], npz['indices'], npz['indptr']), tuple(npz['shape']))
+
+
+def morph_matrix(subject_from, subject_to, vertices_from, vertices_to,
+                 subjects_dir, cache_dir=None):
+    """Morph matrix between two source spaces
+
+    Wrapper for :func:`mne.compute_morph_matrix` that keeps the most recently
+    used matrices in memory (:data:`MORPH_CACHE_SIZE`) and, if ``cache_dir``
+    is specified, stores them on disk.
+
+    Parameters
+    ----------
+    subject_from, subject_to : str
+        MRI subjects.
+    vertices_from, vertices_to : list of 2 array of int
+        Source space vertices.
+    subjects_dir : str
+        MRI subjects directory.
+    cache_dir : str
+        Directory for caching morph matrices as sparse ``*.npz`` files.
+
+    Returns
+    -------
+    morph_mat : scipy.sparse.csr_matrix
+        The morph matrix (shared with the cache, do not modify in place).
+    """
+    digest = _vertices_hash(vertices_from, vertices_to)
+    key = (subjects_dir, subject_from, subject_to, digest)
+    morph_mat = _morph_cache.get(key)
+    if morph_mat is None:
+        if cache_dir:
+            path = os.path.join(cache_dir, '%s-%s-%s.npz' %
+                                (subject_from, subject_to, digest))
+            if (os.path.exists(path) and os.path.getmtime(path) >
+                    _morph_input_mtime(subject_from, subject_to, subjects_dir)):
+                morph_mat = _load_sparse(path)
+        if morph_mat is None:
+            morph_mat = mne.compute_morph_matrix(subject_from, subject_to,
+                                                 vertices_from, vertices_to,
+                                                 None, subjects_dir)
+            morph_mat = sp.sparse.csr_matrix(morph_mat)
+            if cache_dir:
+                if not os.path.exists(cache_dir):
+                    try:
+                        os.makedirs(cache_dir)
+                    except OSError:  # created by another process
+                        pass
+                # write under a temporary name so that other processes never
+                # read a partial file
+                tmp_path = '%s-%i.npz' % (path[:-4], os.getpid())
+                _save_sparse(tmp_path, morph_mat)
+                os.rename(tmp_path, path)
+        _morph_cache[key] = morph_mat
+    return morph_mat
+
+
+class InverseKernel(object):
+    """Inverse operator prepared for applying it to data arrays
+
+    Preparing an inverse operator (regularization, whitening, noise
+    normalization) is done once, so that the kernel can be applied to many
+    data arrays, e.g., to all epochs of a subject at once.
+
+    Parameters
+    ----------
+    inv : mne.minimum_norm.InverseOperator
+        The inverse operator.
+    lambda2 : scalar
+        Regularization parameter.
+    method : 'MNE' | 'dSPM' | 'sLORETA'
+        Inverse method.
+    pick_ori : None | 'normal'
+        With free or loose orientation, only keep the component normal to the
+        cortex (default is to combine the three components).
+    nave : int
+        Number of averages (default 1, for single trials).
+
+    Notes
+    -----
+    Results correspond to :func:`mne.minimum_norm.apply_inverse_epochs` with
+    the same parameters.
+    """
+    def __init__(self, inv, lambda2, method='dSPM', pick_ori=None, nave=1):
+        if pick_ori not in (None, 'normal'):
+            raise ValueError("pick_ori=%r" % (pick_ori,))
+        self._inv = inv
+        inv = prepare_inverse_operator(inv, nave, lambda2, method,
+                                       verbose=False)
+        kernel, noise_norm, vertices, _ = _assemble_kernel(
+            inv, None, method, pick_ori, verbose=False)
+        self.is_free_ori = (inv['source_ori'] == FIFF.FIFFV_MNE_FREE_ORI and
+                            pick_ori != 'normal')
+        if noise_norm is not None and not self.is_free_ori:
+            kernel *= noise_norm
+            noise_norm = None
+        self.kernel = kernel
+        self.noise_norm = noise_norm
+        self.vertices = vertices
+        self.n_sources = sum(map(len, vertices))
+
+    def apply(self, data, info, out=None):
+        """Apply the kernel to sensor data
+
+        Parameters
+        ----------
+        data : array, shape ([n_cases, ]n_channels, n_times)
+            Sensor data, with channels corresponding to ``info``.
+        info : mne.Info
+            Measurement info for ``data``.
+        out : array, shape ([n_cases, ]n_sources, n_times)
+            Array in which to store the source estimates.
+
+        Returns
+        -------
+        out : array, shape ([n_cases, ]n_sources, n_times)
+            Source estimates.
+        """
+        _check_ch_names(self._inv, info)
+        sel = _pick_channels_inverse_operator(info['ch_names'], self._inv)
+        if not np.array_equal(sel, np.arange(data.shape[-2])):
+            data = data[..., sel, :]
+        shape = data.shape[:-2] + (self.n_sources, data.shape[-1])
+        if out is None:
+            out = np.empty(shape)
+        elif out.shape != shape:
+            raise ValueError("out has wrong shape %s, need %s" %
+                             (out.shape, shape))
+        elif not out.flags.c_contiguous:
+            raise ValueError("out needs to be C-contiguous")
+
+        x = out.reshape((-1,) + shape[-2:])
+        data = data.reshape((-1,) + data.shape[-2:])
+        if not self.is_free_ori:
+            # np.dot() can only write to out with the exact result type
+            dot_out = out.dtype == np.result_type(self.kernel, data)
+            for x_i, data_i in izip(x, data):
+                if dot_out:
+                    np.dot(self.kernel, data_i, out=x_i)
+                else:
+                    x_i[:] = np.dot(self.kernel, data_i)
+            return out
+
+        # combine current components case by case to limit memory use
+        for x_i, data_i in izip(x, data):
+            sol = np.dot(self.kernel, data_i)
+            sol **= 2
+            np.add(sol[0::3], sol[1::3], x_i)
+            x_i += sol[2::3]
+            np.sqrt(x_i, x_i)
+            if self.noise_norm is not None:
+                x_i *= self.noise_norm
+        return out
+
+
 def shift_mne_epoch_trigger(epochs, trigger_shift, min_shift=None, max_shift=None):
     """Shift the trigger in an MNE Epochs object
 
@@ -218,7 +434,7 @@ def labels_from_mni_coords(seeds, extent=30., subject='fsaverage',
 
 
 def morph_source_space(ndvar, subject_to, vertices_to=None, morph_mat=None,
-                       copy=False, parc=True):
+                       copy=False, parc=True, cache_dir=None):
     """Morph source estimate to a different MRI subject
 
     Parameters
@@ -229,12 +445,12 @@ def morph_source_space(ndvar, subject_to, vertices_to=None, morph_mat=None,
         Name of the subject on which to morph.
     vertices_to : None | list of array of int
         The vertices on the destination subject's brain. If ndvar contains a
-        whole source space, vertices_to can be automatically loaded, although
-        providing them as argument can speed up processing by a second or two.
+        whole source space, vertices_to can be automatically loaded from the
+        destination subject's source space file.
     morph_mat : None | sparse matrix
         The morphing matrix. If ndvar contains a whole source space, the morph
-        matrix can be automatically loaded, although providing a cached matrix
-        can speed up processing by a second or two.
+        matrix can be computed automatically. Recently used morph matrices are
+        cached in memory (see ``cache_dir`` to also cache them on disk).
     copy : bool
         Make sure that the data of ``morphed_ndvar`` is separate from
         ``ndvar`` (default False).
@@ -243,6 +459,9 @@ def morph_source_space(ndvar, subject_to, vertices_to=None, morph_mat=None,
         parcellation from ``ndvar``. Set to ``False`` to load no parcellation.
         If the annotation files are missing for the target subject an IOError
         is raised.
+    cache_dir : str
+        Directory in which to cache computed morph matrices, so that they can
+        be reused across sessions.
 
     Returns
     -------
@@ -265,9 +484,9 @@ def morph_source_space(ndvar, subject_to, vertices_to=None, morph_mat=None,
     if vertices_to is None:
         path = SourceSpace._SRC_PATH.format(
             subjects_dir=subjects_dir, subject=subject_to, src=src)
-        src_to = mne.read_source_spaces(path)
-        vertices_to = [src_to[0]['vertno'] if ndvar.source.lh_n else np.empty(0, int),
-                       src_to[1]['vertno'] if ndvar.source.rh_n else np.empty(0, int)]
+        lh, rh = read_source_space_vertices(path)
+        vertices_to = [lh if ndvar.source.lh_n else np.empty(0, int),
+                       rh if ndvar.source.rh_n else np.empty(0, int)]
     elif not isinstance(vertices_to, list) or not len(vertices_to) == 2:
         raise ValueError('vertices_to must be a list of length 2')
 
@@ -320,9 +539,8 @@ def morph_source_space(ndvar, subject_to, vertices_to=None, morph_mat=None,
     if do_morph:
         vertices_from = ndvar.source.vertices
         if morph_mat is None:
-            morph_mat = mne.compute_morph_matrix(subject_from, subject_to,
-                                                 vertices_from, vertices_to,
-                                                 None, subjects_dir)
+            morph_mat = morph_matrix(subject_from, subject_to, vertices_from,
+                                     vertices_to, subjects_dir, cache_dir)
         elif not sp.sparse.issparse(morph_mat):
             raise ValueError('morph_mat must be a sparse matrix')
         elif not sum(len(v) for v in vertices_to) == morph_mat.shape[0]:
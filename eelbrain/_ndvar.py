@@ -3,11 +3,12 @@
 """NDVar operations"""
 from collections import defaultdict
 from itertools import izip, repeat
-from math import floor
+from math import ceil, floor
 from numbers import Real
 
 import mne
 import numpy as np
+from numpy.lib.stride_tricks import as_strided
 from scipy import linalg, signal
 
 from . import mne_fixes
@@ -19,7 +20,7 @@ from ._exceptions import DimensionMismatchError
 from ._info import merge_info
 from ._stats.connectivity import Connectivity
 from ._stats.connectivity import find_peaks as _find_peaks
-from ._stats.error_functions import l1
+from ._utils.numpy_utils import convolve_kernels
 
 
 def concatenate(ndvars, dim='time', name=None, tmin=0):
@@ -104,7 +105,7 @@ def concatenate(ndvars, dim='time', name=None, tmin=0):
     return NDVar(x, dims, info, name or ndvar.name)
 
 
-def convolve(h, x):
+def convolve(h, x, out=None):
     """Convolve ``h`` and ``x`` along the time dimension
 
     Parameters
@@ -113,77 +114,76 @@ def convolve(h, x):
         Kernel.
     x : NDVar | sequence of NDVar
         Data to convolve, corresponding to ``h``.
+    out : array
+        Buffer for the data of the result, with the shape of ``y.x`` (float64,
+        C-contiguous). Avoids allocating a new array when convolving long
+        signals repeatedly.
 
     Returns
     -------
     y : NDVar
         Convolution, with same time dimension as ``x``.
+
+    Notes
+    -----
+    Dimensions of ``x`` other than time also need to be in ``h``, and the
+    convolution is summed over them. Additional dimensions of ``h`` are
+    retained in the output, e.g., ``h`` with dimensions (sensor, predictor,
+    time) and ``x`` with dimensions (predictor, time) result in dimensions
+    (sensor, time). Long kernels are applied through the FFT.
     """
     if isinstance(h, NDVar):
         if not isinstance(x, NDVar):
             raise TypeError("If h is an NDVar, x also needs to be an NDVar "
                             "(got x=%r)" % (x,))
 
-        if h.ndim == 1:
-            ht = h.get_dim('time')
-            hdim = None
-        elif h.ndim == 2:
-            hdim, ht = h.get_dims((None, 'time'))
-        else:
-            raise NotImplementedError("h must be 1 or 2 dimensional, got h=%r" % h)
-
-        if x.ndim == 1:
-            xt = x.get_dim('time')
-            xdim = None
-        elif x.ndim == 2:
-            xdim, xt = x.get_dims((None, 'time'))
-            if xdim != hdim:
-                raise ValueError("h %s dimension and x %s dimension do not "
-                                 "match" % (hdim.name, xdim.name))
-        else:
-            raise NotImplementedError("x must be 1 or 2 dimensional, got x=%r" % h)
-
+        ht = h.get_dim('time')
+        xt = x.get_dim('time')
         if ht.tstep != xt.tstep:
             raise ValueError(
                 "h and x need to have same time-step (got h.time.tstep=%s, "
                 "x.time.tstep=%s)" % (ht.tstep, xt.tstep))
 
-        if h.ndim == 1:
-            data = np.convolve(h.x, x.x)
-            dims = (xt,)
-        elif x.ndim == 1:
-            xdata = x.get_data('time')
-            data = np.array(tuple(np.convolve(h_i, xdata) for h_i in
-                                  h.get_data((hdim.name, 'time'))))
-            dims = (hdim, xt)
-        else:
-            data = None
-            for h_i, x_i in izip(h.get_data((hdim.name, 'time')),
-                                 x.get_data((xdim.name, 'time'))):
-                if data is None:
-                    data = np.convolve(h_i, x_i)
-                else:
-                    data += np.convolve(h_i, x_i)
-            dims = (xt,)
-
+        x_dimnames = tuple(name for name in x.dimnames if name != 'time')
+        for name in x_dimnames:
+            if not h.has_dim(name):
+                raise ValueError("x has %s dimension that is not in h" % name)
+            elif h.get_dim(name) != x.get_dim(name):
+                raise ValueError("h %s dimension and x %s dimension do not "
+                                 "match" % (name, name))
+        y_dimnames = tuple(name for name in h.dimnames if
+                           name != 'time' and name not in x_dimnames)
+        y_dims = h.get_dims(y_dimnames)
+        n_y = int(np.prod([len(dim) for dim in y_dims]))
+        n_x = int(np.prod([len(x.get_dim(name)) for name in x_dimnames]))
+
+        h_data = h.get_data(y_dimnames + x_dimnames + ('time',))
+        x_data = x.get_data(x_dimnames + ('time',))
         i_start = -int(round(ht.tmin / ht.tstep))
-        i_stop = i_start + xt.nsamples
-        if i_start < 0:
-            data = np.concatenate((
-                np.zeros((len(hdim), -i_start) if data.ndim == 2 else -i_start),
-                data[..., :i_stop]), -1)
+        shape = tuple(len(dim) for dim in y_dims) + (len(xt),)
+        if out is None:
+            out_2d = None
+        elif out.shape != shape:
+            raise ValueError("out has wrong shape %s, need %s" %
+                             (out.shape, shape))
+        elif out.dtype != np.float64 or not out.flags.c_contiguous:
+            raise ValueError("out needs to be a C-contiguous float64 array")
         else:
-            data = data[..., i_start: i_stop]
-
-        return NDVar(data, dims, x.info.copy(), x.name)
+            out_2d = out.reshape((n_y, len(xt)))
+        data = convolve_kernels(h_data.reshape((n_y, n_x, len(ht))),
+                                x_data.reshape((n_x, len(xt))), out_2d,
+                                i_start)
+        if out is None:
+            out = data.reshape(shape)
+        return NDVar(out, y_dims + (xt,), x.info.copy(), x.name)
     else:
-        out = None
+        y = None
         for h_, x_ in izip(h, x):
-            if out is None:
-                out = convolve(h_, x_)
+            if y is None:
+                y = convolve(h_, x_, out)
             else:
-                out += convolve(h_, x_)
-        return out
+                y += convolve(h_, x_)
+        return y
 
 
 def cross_correlation(in1, in2, name="{in1} * {in2}"):
@@ -491,13 +491,26 @@ def label_operator(labels, operation='mean', exclude=None, weights=None,
                             "all strings or all real numbers; got %r" %
                             (dim_values,))
     # construct operator
-    x = np.empty((len(label_values), len(dim)))
-    for v, xs in izip(label_values, x):
-        np.equal(label_data, v, xs)
-        if weights is not None:
-            xs *= weights
-        if operation == 'mean':
-            xs /= l1(xs)
+    n_labels = len(label_values)
+    if n_labels:
+        index = np.searchsorted(label_values, label_data)
+        np.minimum(index, n_labels - 1, index)
+        sources = np.flatnonzero(label_values[index] == label_data)
+    else:
+        index = sources = np.empty(0, int)
+    rows = index[sources]
+    if weights is None:
+        values = np.ones(len(sources))
+    else:
+        values = weights[sources].astype(np.float64)
+    if operation == 'mean':
+        norm = np.bincount(rows, np.abs(values), n_labels)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            values /= norm[rows]
+    x = np.zeros((n_labels, len(dim)))
+    x[rows, sources] = values
+    if operation == 'mean':
+        x[norm == 0] = np.nan
     return NDVar(x, (label_dim, dim), {}, labels.name)
 
 
@@ -688,7 +701,7 @@ class Butterworth(Filter):
             raise ValueError("Neither low nor high set")
 
 
-def segment(continuous, times, tstart, tstop, decim=1):
+def segment(continuous, times, tstart, tstop, decim=1, copy=True):
     """Segment a continuous NDVar
 
     Parameters
@@ -704,6 +717,10 @@ def segment(continuous, times, tstart, tstop, decim=1):
     decim : int
         Decimate data after segmenting by factor ``decim`` (the default is
         ``1``, i.e. no decimation).
+    copy : bool
+        Copy the data into a new array (default). With ``copy=False``, if
+        ``times`` are evenly spaced, the segments are a read-only view into
+        ``continuous`` (segments can overlap without using additional memory).
 
     Returns
     -------
@@ -714,14 +731,43 @@ def segment(continuous, times, tstart, tstop, decim=1):
     if continuous.has_case:
         raise ValueError("Continuous data can't have case dimension")
     axis = continuous.get_axis('time')
-    tstep = None if decim == 1 else continuous.time.tstep * decim
-    segments = [continuous.sub(time=(t + tstart, t + tstop, tstep)) for
-                t in times]
+    time = continuous.time
+    if tstart >= tstop:
+        raise ValueError("tstart must be smaller than tstop")
+    times = np.asarray(times, np.float64)
+    if len(times) == 0:
+        raise ValueError("segment() needs at least one time")
+    # sample indexes (same rounding as UTS slicing)
+    i_starts = np.ceil((times + tstart - time.tmin) / time.tstep - 1e-6)
+    i_starts = i_starts.astype(np.intp)
+    i_stop = ceil((times[0] + tstop - time.tmin) / time.tstep - 1e-6)
+    n_samples = int(i_stop) - i_starts[0]
+    if i_starts.min() < 0 or i_starts.max() + n_samples > time.nsamples:
+        raise ValueError("Segments (%s, %s) out of range of the time axis "
+                         "(%s, %s)" % (times.min() + tstart,
+                                       times.max() + tstop, time.tmin,
+                                       time.tstop))
+    n_out = len(xrange(0, n_samples, decim))
+
+    # read-only view with a segment starting at each sample
+    x = continuous.x
+    windows = as_strided(
+        x, (time.nsamples - n_samples + 1,) + x.shape[:axis] + (n_out,) +
+        x.shape[axis + 1:],
+        (x.strides[axis],) + x.strides[:axis] + (decim * x.strides[axis],) +
+        x.strides[axis + 1:])
+    windows.flags.writeable = False
+    steps = np.unique(np.diff(i_starts))
+    if not copy and len(steps) <= 1 and np.all(steps > 0):
+        # evenly spaced segments: view
+        step = steps[0] if len(steps) else 1
+        data = windows[i_starts[0]:i_starts[-1] + 1:step]
+    else:
+        # gather all segments into a new array at once
+        data = windows[i_starts]
 
-    s0_time = segments[0].time
     dims = (('case',) +
             continuous.dims[:axis] +
-            (UTS(tstart, s0_time.tstep, s0_time.nsamples),) +
+            (UTS(tstart, time.tstep * decim, n_out),) +
             continuous.dims[axis + 1:])
-    return NDVar(np.array(tuple(s.x for s in segments)), dims,
-                 continuous.info.copy(), continuous.name)
+    return NDVar(data, dims, continuous.info.copy(), continuous.name)
@@ -1,132 +1,301 @@
 # Author: Christian Brodbeck <christianbrodbeck@nyu.edu>
-#cython: boundscheck=False, wraparound=False
+#cython: boundscheck=False, wraparound=False, cdivision=True
 
-from libc.stdlib cimport malloc, free
 import numpy as np
 cimport numpy as np
 
 
+ctypedef np.int8_t INT8
 ctypedef np.uint32_t UINT32
 ctypedef np.int64_t INT64
 ctypedef np.float64_t FLOAT64
 
-def merge_labels(np.ndarray[UINT32, ndim=2] cmap,
-                 long n_labels_in,
-                 np.ndarray[UINT32, ndim=2] edges,
-                 np.ndarray[INT64, ndim=1] edge_start,
-                 np.ndarray[INT64, ndim=1] edge_stop):
-    """Merge adjacent labels with non-standard connectivity
+cdef inline INT64 find(INT64 i, INT64[:] parent) nogil:
+    "Find the root of node i (with path halving)"
+    while parent[i] != i:
+        parent[i] = parent[parent[i]]
+        i = parent[i]
+    return i
+
+
+cdef inline void union(INT64 i, INT64 j, INT64[:] parent) nogil:
+    "Merge the trees of nodes i and j, keeping the lower root"
+    i = find(i, parent)
+    j = find(j, parent)
+    if i < j:
+        parent[j] = i
+    elif j < i:
+        parent[i] = j
+
+
+def label_graph(INT8[:] sign,
+                INT64[:] grid_strides,
+                INT64[:] grid_lengths,
+                UINT32[:, :] edges,
+                INT64[:] edge_start,
+                INT64[:] edge_stop,
+                INT64 custom_stride,
+                INT64[:] parent,
+                UINT32[:] cmap):
+    """Label connected clusters in a flattened map
 
     Parameters
     ----------
-    cmap : array of int, ndim=2
-        Array with labels, labels are merged along the second axis; cmap is
-        modified in-place.
-    n_labels_in : int
-        Number of labels in cmap.
-    edges : array of int (n_edges, 2)
-        Edges of the connectivity graph.
+    sign : array of int8 (n,)
+        Map of points to label: adjacent points with the same non-zero value
+        belong to the same cluster.
+    grid_strides, grid_lengths : array of int
+        Stride and length of all axes with grid connectivity.
+    edges, edge_start, edge_stop :
+        Connectivity of the first axis if it has custom connectivity (edges in
+        both directions, sorted by source).
+    custom_stride : int
+        Stride of the first axis if it has custom connectivity (0 otherwise).
+    parent : array of int (n,)
+        Buffer.
+    cmap : array of uint32 (n,)
+        Output for cluster labels (0 for points not in any cluster).
+
+    Returns
+    -------
+    n_labels : int
+        Number of clusters; clusters are labeled ``1, ..., n_labels`` in order
+        of their first point, clusters of positive values before clusters of
+        negative values.
     """
-    n_labels_in += 1
-
-    cdef unsigned int slice_i, i, dst_i, edge_i
-    cdef unsigned int n_vert = cmap.shape[0]
-    cdef unsigned int n_slices = cmap.shape[1]
-    cdef unsigned int label, connected_label, src, dst
-    cdef unsigned int relabel_src, relabel_dst
-
-    cdef unsigned int* relabel = <unsigned int*> malloc(sizeof(unsigned int) * n_labels_in)
-    for i in range(n_labels_in):
-        relabel[i] = i
-
-    # find targets for relabeling
-    for slice_i in range(n_slices):
-        for src in range(n_vert):
-            label = cmap[src, slice_i]
-            if label == 0:
+    cdef INT64 n = sign.shape[0]
+    cdef INT64 n_grid = grid_strides.shape[0]
+    cdef INT64 i, j, i_axis, stride, vertex, rest, edge_i, root
+    cdef INT8 s
+    cdef UINT32 n_labels = 0
+    cdef bint has_negative = False
+
+    with nogil:
+        # connect each point to preceding neighbors
+        for i in range(n):
+            s = sign[i]
+            if s == 0:
                 continue
+            parent[i] = i
+            for i_axis in range(n_grid):
+                stride = grid_strides[i_axis]
+                if (i // stride) % grid_lengths[i_axis] > 0:
+                    j = i - stride
+                    if sign[j] == s:
+                        union(i, j, parent)
+            if custom_stride:
+                vertex = i // custom_stride
+                rest = i % custom_stride
+                for edge_i in range(edge_start[vertex], edge_stop[vertex]):
+                    if edges[edge_i, 1] < vertex:
+                        j = edges[edge_i, 1] * custom_stride + rest
+                        if sign[j] == s:
+                            union(i, j, parent)
 
-            for edge_i in range(edge_start[src], edge_stop[src]):
-                dst = edges[edge_i, 1]
-                connected_label = cmap[dst, slice_i]
-                if connected_label == 0:
+        # label clusters by their root, positive before negative clusters
+        for i in range(n):
+            if sign[i] <= 0:
+                cmap[i] = 0
+                if sign[i] < 0:
+                    has_negative = True
+                continue
+            root = find(i, parent)
+            if root == i:
+                n_labels += 1
+                cmap[i] = n_labels
+            else:
+                cmap[i] = cmap[root]
+        if has_negative:
+            for i in range(n):
+                if sign[i] >= 0:
                     continue
+                root = find(i, parent)
+                if root == i:
+                    n_labels += 1
+                    cmap[i] = n_labels
+                else:
+                    cmap[i] = cmap[root]
+    return n_labels
 
-                while relabel[label] < label:
-                    label = relabel[label]
 
-                while relabel[connected_label] < connected_label:
-                    connected_label = relabel[connected_label]
+def cluster_extent(UINT32[:] cmap,
+                   UINT32 n_labels,
+                   INT64 stride,
+                   INT64 length,
+                   INT64[:] mark,
+                   INT64[:] out):
+    """Number of distinct positions each cluster occupies along one axis
 
-                if label > connected_label:
-                    relabel_src = label
-                    relabel_dst = connected_label
-                else:
-                    relabel_src = connected_label
-                    relabel_dst = label
-
-                relabel[relabel_src] = relabel_dst
-
-    # find lowest labels
-    cdef int n_labels_out = -1
-    for i in range(n_labels_in):
-        relabel_dst = relabel[i]
-        if relabel_dst == i:
-            n_labels_out += 1
-        else:
-            while relabel[relabel_dst] < relabel_dst:
-                relabel_dst = relabel[relabel_dst]
-            relabel[i] = relabel_dst
-
-    # relabel cmap
-    for i in range(n_vert):
-        for slice_i in range(n_slices):
-            label = cmap[i, slice_i]
-            if label != 0:
-                relabel_dst = relabel[label]
-                if relabel_dst != label:
-                    cmap[i, slice_i] = relabel_dst
-
-    # find all label ids in cmap
-    cdef np.ndarray[UINT32, ndim=1] out = np.empty(n_labels_out, dtype=np.uint32)
-    dst_i = 0
-    for i in range(1, n_labels_in):
-        if i == relabel[i]:
-            out[dst_i] = i
-            dst_i += 1
-
-    free(relabel)
-    return out
-
-
-def tfce_increment(np.ndarray[UINT32, ndim=1] labels,
-                   np.ndarray[UINT32, ndim=1] label_image,
-                   np.ndarray[FLOAT64, ndim=1] image,
-                   double e, double h_factor):
-    cdef unsigned int i, cid
-    cdef unsigned int n = image.shape[0]
-    cdef unsigned int n_labels = labels.max() + 1
-
-    cdef double* area = <double*> malloc(sizeof(double) * n_labels)
-
-    # initialize area
-    for i in range(n_labels):
-        area[i] = 0.
-
-    # determine area
-    for i in range(n):
-        cid = label_image[i]
-        if cid > 0:
-            area[cid] += 1.
-
-    # determine TFCE value
-    for cid in labels:
-        area[cid] = area[cid] ** e * h_factor
-
-    # update TFCE image
-    for i in range(n):
-        cid = label_image[i]
-        if cid > 0:
-            image[i] += area[cid]
-
-    free(area)
+    Parameters
+    ----------
+    cmap : array of uint32 (n,)
+        Flattened cluster map.
+    n_labels : int
+        Number of labels in ``cmap``.
+    stride, length : int
+        Stride and length of the axis.
+    mark : array of int (> n_labels)
+        Buffer.
+    out : array of int (> n_labels)
+        For each label, the number of positions along the axis.
+    """
+    cdef INT64 n_outer = cmap.shape[0] // (stride * length)
+    cdef INT64 i, i_outer, i_axis, i_inner, offset
+    cdef UINT32 label
+
+    with nogil:
+        for i in range(n_labels + 1):
+            mark[i] = -1
+            out[i] = 0
+        for i_axis in range(length):
+            for i_outer in range(n_outer):
+                offset = (i_outer * length + i_axis) * stride
+                for i_inner in range(stride):
+                    label = cmap[offset + i_inner]
+                    if label and mark[label] != i_axis:
+                        mark[label] = i_axis
+                        out[label] += 1
+
+
+cdef inline INT64 find_root(INT64 i, INT64[:] parent, double[:] offset,
+                            INT64[:] stack) nogil:
+    "Find the root of node i; path compression maintains cumulative offsets"
+    cdef INT64 root = i
+    cdef INT64 n_path = 0
+    cdef INT64 j, node
+
+    while parent[root] != root:
+        stack[n_path] = root
+        n_path += 1
+        root = parent[root]
+    # re-attach nodes to root, starting with the node closest to the root
+    if n_path > 1:
+        for j in range(n_path - 2, -1, -1):
+            node = stack[j]
+            offset[node] += offset[stack[j + 1]]
+            parent[node] = root
+    return root
+
+
+cdef inline void tfce_merge(INT64 src, INT64 dst, INT64 k, double[:] cum_factor,
+                            double e, INT64[:] parent, double[:] offset,
+                            INT64[:] size, INT64[:] t0, INT64[:] stack) nogil:
+    "Merge the clusters of src and dst at height index k"
+    cdef INT64 root, root_dst
+    if parent[dst] < 0:  # dst is below height k
+        return
+    root = find_root(src, parent, offset, stack)
+    root_dst = find_root(dst, parent, offset, stack)
+    if root == root_dst:
+        return
+    # add enhancement for the heights above k
+    offset[root] += size[root] ** e * (cum_factor[t0[root] + 1] - cum_factor[k + 1])
+    offset[root_dst] += size[root_dst] ** e * (cum_factor[t0[root_dst] + 1] - cum_factor[k + 1])
+    # attach smaller to larger cluster
+    if size[root] < size[root_dst]:
+        root, root_dst = root_dst, root
+    parent[root_dst] = root
+    offset[root_dst] -= offset[root]
+    size[root] += size[root_dst]
+    t0[root] = k
+
+
+def tfce_sweep(double[:] x,
+               INT64[:] order,
+               double[:] cum_factor,
+               INT64[:] level,
+               double e,
+               INT64[:] grid_strides,
+               INT64[:] grid_lengths,
+               UINT32[:, :] edges,
+               INT64[:] edge_start,
+               INT64[:] edge_stop,
+               INT64 custom_stride,
+               INT64[:] parent,
+               double[:] offset,
+               INT64[:] size,
+               INT64[:] t0,
+               INT64[:] stack,
+               double[:] out):
+    """Threshold-free cluster enhancement with a single union-find sweep
+
+    Parameters
+    ----------
+    x : array of float (n,)
+        Flattened statistical map (sign adjusted so that the relevant values
+        are positive).
+    order : array of int (n_above,)
+        Index of all points in ``x`` that are included at the lowest height,
+        in order of descending value.
+    cum_factor : array of float (n_levels + 1,)
+        Cumulative height factors: ``cum_factor[k]`` is the sum of
+        ``height ** h`` for all heights below height ``k``.
+    level : array of int (n_above,)
+        For each point in ``order``, the highest height index at which it is
+        included.
+    e : scalar
+        Extent exponent.
+    grid_strides, grid_lengths : array of int
+        Stride and length of all axes with grid connectivity.
+    edges, edge_start, edge_stop :
+        Connectivity of the first axis if it has custom connectivity.
+    custom_stride : int
+        Stride of the first axis if it has custom connectivity (0 otherwise).
+    parent, offset, size, t0, stack : array (n,)
+        Buffers.
+    out : array of float (n,)
+        TFCE values are added to ``out``.
+
+    Notes
+    -----
+    Points are added to a union-find forest from the highest to the lowest
+    value. Each root keeps the height index at which its cluster was last
+    modified; when a cluster changes (or at the end of the sweep) its
+    enhancement for the preceding heights is added to the root's offset.
+    Path compression maintains the sum of offsets along the path to the root,
+    so that the TFCE value of each point is the sum of offsets from the point
+    to its root.
+    """
+    cdef INT64 n_above = order.shape[0]
+    cdef INT64 n_grid = grid_strides.shape[0]
+    cdef INT64 i_order, i_axis, k, src, stride, coordinate, edge_i, vertex, rest
+
+    with nogil:
+        for i_order in range(n_above):
+            src = order[i_order]
+            k = level[i_order]
+            parent[src] = src
+            offset[src] = 0
+            size[src] = 1
+            t0[src] = k
+            # merge with neighbors that are already included
+            for i_axis in range(n_grid):
+                stride = grid_strides[i_axis]
+                coordinate = (src // stride) % grid_lengths[i_axis]
+                if coordinate > 0:
+                    tfce_merge(src, src - stride, k, cum_factor, e, parent,
+                               offset, size, t0, stack)
+                if coordinate < grid_lengths[i_axis] - 1:
+                    tfce_merge(src, src + stride, k, cum_factor, e, parent,
+                               offset, size, t0, stack)
+            if custom_stride:
+                vertex = src // custom_stride
+                rest = src % custom_stride
+                for edge_i in range(edge_start[vertex], edge_stop[vertex]):
+                    tfce_merge(src, edges[edge_i, 1] * custom_stride + rest, k,
+                               cum_factor, e, parent, offset, size, t0, stack)
+
+        # add enhancement for remaining heights
+        for i_order in range(n_above):
+            src = order[i_order]
+            if parent[src] == src:
+                offset[src] += size[src] ** e * (cum_factor[t0[src] + 1] - cum_factor[0])
+
+        # TFCE value of each point is the sum of offsets up to the root
+        for i_order in range(n_above):
+            src = order[i_order]
+            root = find_root(src, parent, offset, stack)
+            if root == src:
+                out[src] += offset[src]
+            else:
+                out[src] += offset[src] + offset[root]
@@ -80,3 +80,60 @@ def update_error(cnp.ndarray[FLOAT64, ndim=1] error,
 
     for i in range(shift, len(error)):
         error[i] -= delta * x[i - shift]
+
+
+def l1_for_delta_grid(cnp.ndarray[FLOAT64, ndim=1] y,
+                      cnp.ndarray[FLOAT64, ndim=2] x,
+                      double delta,
+                      cnp.ndarray[FLOAT64, ndim=2] e_pos,
+                      cnp.ndarray[FLOAT64, ndim=2] e_neg):
+    """Add l1 error after a +/- delta step for all stimuli and shifts
+
+    Equivalent to calling :func:`l1_for_delta` for each ``(i_stim, shift)``
+    in ``e_pos.shape`` and adding the results to ``e_pos`` and ``e_neg``.
+    """
+    cdef:
+        double out_pos, out_neg, d
+        double y_abs = 0.
+        size_t i, i_stim, shift
+        size_t n_times = y.shape[0]
+        size_t n_stims = e_pos.shape[0]
+        size_t n_shifts = e_pos.shape[1]
+
+    for shift in range(n_shifts):
+        if shift <= n_times:
+            if shift > 0:
+                y_abs += abs(y[shift - 1])
+        for i_stim in range(n_stims):
+            out_pos = y_abs
+            out_neg = y_abs
+            for i in range(shift, n_times):
+                d = delta * x[i_stim, i - shift]
+                out_pos += abs(y[i] - d)
+                out_neg += abs(y[i] + d)
+            e_pos[i_stim, shift] += out_pos
+            e_neg[i_stim, shift] += out_neg
+
+
+def l2_xcorr(cnp.ndarray[FLOAT64, ndim=1] y,
+             cnp.ndarray[FLOAT64, ndim=2] x,
+             cnp.ndarray[FLOAT64, ndim=2] out):
+    """Add the cross-correlation of y with each stimulus in x to out
+
+    ``out[i_stim, shift] += sum(y[shift:] * x[i_stim, :n_times - shift])``.
+    The change in l2 error for a step ``delta`` at ``(i_stim, shift)`` is
+    ``delta**2 * sum(x[i_stim, :n_times - shift]**2) - 2 * delta * out``.
+    """
+    cdef:
+        double acc
+        size_t i, i_stim, shift
+        size_t n_times = y.shape[0]
+        size_t n_stims = out.shape[0]
+        size_t n_shifts = out.shape[1]
+
+    for i_stim in range(n_stims):
+        for shift in range(min(n_shifts, n_times)):
+            acc = 0.
+            for i in range(shift, n_times):
+                acc += y[i] * x[i_stim, i - shift]
+            out[i_stim, shift] += acc
@@ -385,6 +385,37 @@ class _NDANOVA(object):
     def _map(self, y, flat_f_map, perm):
         raise NotImplementedError
 
+    def map_batch(self, y, perms, out):
+        """Fit the model to a batch of permutations of the dependent variables
+
+        Parameters
+        ----------
+        y : np.array (n_cases, n_tests)
+            Dependent variables (cases on the first axis).
+        perms : array of int (n_perm, n_cases)
+            Permutation index for each permutation (as for :meth:`.map`).
+        out : array (n_perm, n_effects, n_tests)
+            Container for the F-maps.
+
+        Notes
+        -----
+        Equivalent to calling :meth:`.map` for each permutation, but the
+        regression coefficients for all permutations are estimated with a
+        single matrix product.
+        """
+        if y.shape[0] != self._n_obs:
+            raise ValueError("Y has wrong number of observations (%i, model "
+                             "has %i)" % (y.shape[0], self._n_obs))
+        # all models include an intercept, so centering y does not affect the
+        # F-values but improves numerical precision
+        y = y - y.mean(0)
+        ss_y = np.einsum('ij,ij->j', y, y)
+        self._map_batch(y, ss_y, perms, out)
+        return out
+
+    def _map_batch(self, y, ss_y, perms, out):
+        raise NotImplementedError
+
     def p_maps(self, f_maps):
         """Convert F-maps for uncorrected p-maps
 
@@ -424,6 +455,49 @@ class _NDANOVA(object):
         return f_map
 
 
+def _perm_betas(xsinv, y, perms):
+    """Regression coefficients for a batch of permutations
+
+    Parameters
+    ----------
+    xsinv : array (n_betas, n_cases)
+        Projector for the unpermuted model.
+    y : array (n_cases, n_tests)
+        Dependent variables.
+    perms : array of int (n_perm, n_cases)
+        Permutation indexes.
+
+    Returns
+    -------
+    betas : array (n_perm, n_betas, n_tests)
+        Regression coefficients for each permutation.
+    """
+    n_perm, n_cases = perms.shape
+    n_betas = len(xsinv)
+    xsinv_perm = xsinv[:, perms].swapaxes(0, 1).reshape((-1, n_cases))
+    betas = xsinv_perm.dot(y)
+    return betas.reshape((n_perm, n_betas, -1))
+
+
+def _fitted_ss(betas, xtx):
+    """Sum of squares of the fitted values for a batch of permutations
+
+    Parameters
+    ----------
+    betas : array (n_perm, n_betas, n_tests)
+        Regression coefficients.
+    xtx : array (n_betas, n_betas)
+        ``x.T.dot(x)`` for the design matrix columns corresponding to
+        ``betas`` (invariant to permutations of the rows of ``x``).
+
+    Returns
+    -------
+    ss : array (n_perm, n_tests)
+        Sum of squares of ``x.dot(betas)``.
+    """
+    return np.einsum('pit,pit->pt', np.einsum('ij,pjt->pit', xtx, betas), betas)
+
+
 class _BalancedNDANOVA(_NDANOVA):
     "For balanced but not fully specified models"
     def __init__(self, x, effects, dfs_denom):
@@ -449,6 +523,17 @@ class _BalancedNDANOVA(_NDANOVA):
     def _map_balanced(self, y, flat_f_map, x_full, xsinv):
         raise NotImplementedError
 
+    def _effect_ms_batch(self, betas):
+        "Mean squares for each effect, (n_perm, n_effects, n_tests)"
+        x = self.p.x
+        ms = np.empty((len(betas), len(self._effect_to_beta), betas.shape[2]))
+        for i, (start, df) in enumerate(self._effect_to_beta):
+            stop = start + df
+            xtx = x[:, start:stop].T.dot(x[:, start:stop])
+            ms[:, i] = _fitted_ss(betas[:, start:stop], xtx)
+            ms[:, i] /= df
+        return ms
+
 
 class _BalancedFixedNDANOVA(_BalancedNDANOVA):
     "For balanced but not fully specified models"
@@ -467,6 +552,13 @@ class _BalancedFixedNDANOVA(_BalancedNDANOVA):
         anova_fmaps(y, x_full, xsinv, flat_f_map, self._effect_to_beta,
                     self.df_error)
 
+    def _map_batch(self, y, ss_y, perms, out):
+        betas = _perm_betas(self.p.projector, y, perms)
+        x = self.p.x
+        ms_res = ss_y - _fitted_ss(betas, x.T.dot(x))
+        ms_res /= self.df_error
+        np.divide(self._effect_ms_batch(betas), ms_res[:, None], out)
+
 
 class _BalancedMixedNDANOVA(_BalancedNDANOVA):
     """For balanced, fully specified models.
@@ -496,6 +588,17 @@ class _BalancedMixedNDANOVA(_BalancedNDANOVA):
         anova_full_fmaps(y, x_full, xsinv, flat_f_map, self._effect_to_beta,
                          self._e_ms_array)
 
+    def _map_batch(self, y, ss_y, perms, out):
+        betas = _perm_betas(self.p.projector, y, perms)
+        ms = self._effect_ms_batch(betas)
+        i_fmap = 0
+        for i_effect, e_ms in enumerate(self._e_ms_array > 0):
+            if not np.any(e_ms):
+                continue
+            ms_denom = ms[:, e_ms].sum(1)
+            np.divide(ms[:, i_effect], ms_denom, out[:, i_fmap])
+            i_fmap += 1
+
 
 class _IncrementalNDANOVA(_NDANOVA):
     def __init__(self, x):
@@ -585,6 +688,28 @@ class _IncrementalNDANOVA(_NDANOVA):
             np.divide(SS_diff, e_test.df, MS_diff)
             np.divide(MS_diff, MS_e, flat_f_map[i])
 
+    def _map_batch(self, y, ss_y, perms, out):
+        SS_res = {}
+        for i, x in self._x_orig.iteritems():
+            if x is None:
+                SS_res[i] = ss_y
+            else:
+                x_full, xsinv = x
+                betas = _perm_betas(xsinv, y, perms)
+                SS_res[i] = ss_y - _fitted_ss(betas, x_full.T.dot(x_full))
+
+        # incremental comparisons
+        if not self._comparisons.mixed:
+            MS_e = SS_res[0] / self.x.df_error
+        for i, (e_test, i1, i0) in enumerate(self._comparisons.comparisons):
+            if self._comparisons.mixed:
+                i_ems = self._comparisons.ems_idx[e_test]
+                MS_e = SS_res[self._full_ss_i] - SS_res[i_ems]
+                MS_e /= self.dfs_denom[i]
+            MS_diff = SS_res[i0] - SS_res[i1]
+            MS_diff /= e_test.df
+            np.divide(MS_diff, MS_e, out[:, i])
+
 
 class IncrementalComparisons(object):
     """Determine models for incremental comparisons
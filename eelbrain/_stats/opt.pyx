@@ -433,27 +433,30 @@ def t_1samp_perm(cnp.ndarray[FLOAT64, ndim=2] y,
     cdef double div = (n_cases - 1) * n_cases
     cdef double *case_buffer = <double *>malloc(sizeof(double) * n_cases)
 
-    for i in range(n_tests):
-        for case in range(n_cases):
-            case_buffer[case] = y[case, i] * sign[case]
+    with nogil:
+        for i in range(n_tests):
+            for case in range(n_cases):
+                case_buffer[case] = y[case, i] * sign[case]
 
-        # mean
-        mean = 0
-        for case in range(n_cases):
-            mean += case_buffer[case]
-        mean /= n_cases
+            # mean
+            mean = 0
+            for case in range(n_cases):
+                mean += case_buffer[case]
+            mean /= n_cases
 
-        # variance
-        denom = 0
-        for case in range(n_cases):
-            denom += (case_buffer[case] - mean) ** 2
+            # variance
+            denom = 0
+            for case in range(n_cases):
+                denom += (case_buffer[case] - mean) ** 2
 
-        denom /= div
-        denom **= 0.5
-        if denom > 0:
-            out[i] = mean / denom
-        else:
-            out[i] = 0
+            denom /= div
+            denom **= 0.5
+            if denom > 0:
+                out[i] = mean / denom
+            else:
+                out[i] = 0
+
+    free(case_buffer)
 
 
 def t_ind(cnp.ndarray[FLOAT64, ndim=2] y,
@@ -479,30 +482,31 @@ def t_ind(cnp.ndarray[FLOAT64, ndim=2] y,
 
     cdef double var_mult = (1. / n0 + 1. / n1) / df
 
-    for i in range(n_tests):
-        mean0 = 0.
-        mean1 = 0.
-        var = 0.
+    with nogil:
+        for i in range(n_tests):
+            mean0 = 0.
+            mean1 = 0.
+            var = 0.
 
-        # means
-        for case in range(n_cases):
-            if group[case]:
-                mean1 += y[case, i]
-            else:
-                mean0 += y[case, i]
-        mean0 /= n0
-        mean1 /= n1
-
-        # variance
-        for case in range(n_cases):
-            if group[case]:
-                var += (y[case, i] - mean1) ** 2
-            else:
-                var += (y[case, i] - mean0) ** 2
-        if var == 0:
-            out[i] = 0
-            continue
-        out[i] = (mean1 - mean0) / (var * var_mult) ** 0.5
+            # means
+            for case in range(n_cases):
+                if group[case]:
+                    mean1 += y[case, i]
+                else:
+                    mean0 += y[case, i]
+            mean0 /= n0
+            mean1 /= n1
+
+            # variance
+            for case in range(n_cases):
+                if group[case]:
+                    var += (y[case, i] - mean1) ** 2
+                else:
+                    var += (y[case, i] - mean0) ** 2
+            if var == 0:
+                out[i] = 0
+                continue
+            out[i] = (mean1 - mean0) / (var * var_mult) ** 0.5
 
 
 def has_zero_variance(cnp.ndarray[FLOAT64, ndim=2] y):
@@ -131,6 +131,31 @@ def corr(y, x, out=None, perm=None):
     return out
 
 
+def corr_perm_batch(y, x, out, perms):
+    """Correlation parameter maps for a batch of permutations
+
+    Parameters
+    ----------
+    y : array (n_cases, n_tests)
+        Dependent variable.
+    x : array (n_cases,)
+        Covariate.
+    out : array (n_perm, n_tests)
+        Container for output.
+    perms : array of int (n_perm, n_cases)
+        Permutation index for each permutation (as for :func:`corr`).
+    """
+    z_x = scipy.stats.zscore(x, ddof=1)[perms]
+    z_y = scipy.stats.zscore(y, ddof=1)
+    out = np.dot(z_x, z_y, out)
+    out /= len(x) - 1
+    # replace NaN values
+    isnan = np.isnan(out)
+    if np.any(isnan):
+        out.place(isnan, 0)
+    return out
+
+
 def lm_betas_se_1d(y, b, p):
     """Regression coefficient standard errors
 
@@ -307,6 +332,32 @@ def t_1samp(y, out=None):
     return out
 
 
+def t_1samp_perm_batch(y, out, signs):
+    """T-values for a batch of sign-flip permutations of a 1-sample t-test
+
+    Parameters
+    ----------
+    y : array (n_cases, n_tests)
+        Dependent Measurement.
+    out : array (n_perm, n_tests)
+        Container for output.
+    signs : array (n_perm, n_cases)
+        Sign for each case in each permutation (``1`` or ``-1``).
+    """
+    n_cases = len(y)
+    # sign flips do not affect the sum of squares
+    ss = np.einsum('ij,ij->j', y, y)
+    mean = np.dot(_as_float64(signs), y, out)
+    mean /= n_cases
+    denom = ss - n_cases * mean ** 2
+    denom /= (n_cases - 1) * n_cases
+    np.sqrt(denom.clip(0, out=denom), denom)
+    nonzero = denom > 0
+    np.divide(mean, denom, out, where=nonzero)
+    out[~nonzero] = 0
+    return out
+
+
 def t_ind(y, group, out=None, perm=None):
     "T-value for independent samples t-test, assuming equal variance"
     n_cases = len(y)
@@ -327,6 +378,40 @@ def t_ind(y, group, out=None, perm=None):
     return out
 
 
+def t_ind_perm_batch(y, group, out, perms):
+    """T-values for a batch of permutations of an independent samples t-test
+
+    Parameters
+    ----------
+    y : array (n_cases, n_tests)
+        Dependent Measurement.
+    group : array of int8 (n_cases,)
+        Group membership (``1`` for the first group, ``0`` for the second).
+    out : array (n_perm, n_tests)
+        Container for output.
+    perms : array of int (n_perm, n_cases)
+        Permutation index for each permutation (as for :func:`t_ind`).
+    """
+    n_cases = len(y)
+    n1 = float(np.count_nonzero(group))
+    n0 = n_cases - n1
+    var_mult = (1. / n0 + 1. / n1) / (n_cases - 2)
+    # centering y does not affect t, but improves numerical precision
+    y = y - y.mean(0)
+    ss = np.einsum('ij,ij->j', y, y)
+    mean1 = np.dot(_as_float64(group[perms]), y)
+    mean1 /= n1
+    # since y is centered, mean0 = -mean1 * n1 / n0
+    var = ss - (n1 + n1 ** 2 / n0) * mean1 ** 2
+    var *= var_mult
+    np.sqrt(var.clip(0, out=var), var)
+    nonzero = var > 0
+    mean1 *= 1 + n1 / n0
+    np.divide(mean1, var, out, where=nonzero)
+    out[~nonzero] = 0
+    return out
+
+
 def ftest_f(p, df_num, df_den):
     "F values for given probabilities."
     p = np.asanyarray(p)
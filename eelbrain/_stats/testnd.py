@@ -22,10 +22,14 @@ n_samples : None | int
 '''
 from __future__ import division, print_function
 
+import cPickle as pickle
+from copy import deepcopy
 from datetime import datetime, timedelta
-from itertools import chain, izip
+import hashlib
+from itertools import chain, islice, izip
 from math import ceil
 from multiprocessing import Process
+from multiprocessing.pool import ThreadPool
 from multiprocessing.queues import SimpleQueue
 from multiprocessing.sharedctypes import RawArray
 import logging
@@ -34,13 +38,14 @@ import os
 import re
 import signal
 import socket
+import threading
 from time import time as current_time
 from warnings import warn
 
 import numpy as np
 import scipy.stats
 from scipy import ndimage
-from tqdm import trange
+from tqdm import tqdm
 
 from .. import fmtxt
 from .. import _colorspaces as _cs
@@ -56,7 +61,7 @@ from .._utils import LazyProperty
 from .._utils.numpy_utils import FULL_AXIS_SLICE
 from . import opt, stats
 from .connectivity import Connectivity, find_peaks
-from .connectivity_opt import merge_labels, tfce_increment
+from .connectivity_opt import cluster_extent, label_graph, tfce_sweep
 from .glm import _nd_anova
 from .permutation import _resample_params, permute_order, permute_sign_flip
 from .t_contrast import TContrastRel
@@ -622,9 +627,12 @@ class corr(_Result):
             if cdist.do_permutation:
                 def test_func(y, out, perm):
                     return stats.corr(y, x, out, perm)
+
+                def batch_func(y, out, perms):
+                    return stats.corr_perm_batch(y, x, out, perms)
                 iterator = permute_order(n, samples, unit=match)
                 run_permutation(test_func, cdist, iterator,
-                                MP_FOR_NON_TOP_LEVEL_FUNCTIONS)
+                                MP_FOR_NON_TOP_LEVEL_FUNCTIONS, batch_func)
 
         # compile results
         dims = Y.dims[1:]
@@ -784,7 +792,8 @@ class ttest_1samp(_Result):
             cdist.add_original(tmap)
             if cdist.do_permutation:
                 iterator = permute_sign_flip(n, samples)
-                run_permutation(opt.t_1samp_perm, cdist, iterator)
+                run_permutation(opt.t_1samp_perm, cdist, iterator,
+                                batch_func=stats.t_1samp_perm_batch)
 
         # NDVar map of t-values
         dims = ct.Y.dims[1:]
@@ -953,9 +962,12 @@ class ttest_ind(_Result):
             if cdist.do_permutation:
                 def test_func(y, out, perm):
                     return stats.t_ind(y, groups, out, perm)
+
+                def batch_func(y, out, perms):
+                    return stats.t_ind_perm_batch(y, groups, out, perms)
                 iterator = permute_order(n, samples)
                 run_permutation(test_func, cdist, iterator,
-                                MP_FOR_NON_TOP_LEVEL_FUNCTIONS)
+                                MP_FOR_NON_TOP_LEVEL_FUNCTIONS, batch_func)
 
         dims = ct.Y.dims[1:]
 
@@ -1169,7 +1181,8 @@ class ttest_rel(_Result):
             cdist.add_original(tmap)
             if cdist.do_permutation:
                 iterator = permute_sign_flip(n, samples)
-                run_permutation(opt.t_1samp_perm, cdist, iterator)
+                run_permutation(opt.t_1samp_perm, cdist, iterator,
+                                batch_func=stats.t_1samp_perm_batch)
 
         dims = ct.Y.dims[1:]
         t0, t1, t2 = stats.ttest_t((.05, .01, .001), df, tail)
@@ -1629,30 +1642,6 @@ class anova(_MultiEffectResult):
         return table
 
 
-def flatten(array, connectivity):
-    """Reshape SPM buffer array to 2-dimensional map for connectivity processing
-
-    Parameters
-    ----------
-    array : ndarray
-        N-dimensional array (with non-adjacent dimension at first position).
-    connectivity : Connectivity
-        N-dimensional connectivity.
-
-    Returns
-    -------
-    flat_array : ndarray
-        The input array reshaped if necessary, making sure that input and output
-        arrays share the same underlying data buffer.
-    """
-    if array.ndim == 2 or not connectivity.custom:
-        return array
-    else:
-        out = array.reshape((array.shape[0], -1))
-        assert out.base is array
-        return out
-
-
 def flatten_1d(array):
     if array.ndim == 1:
         return array
@@ -1680,22 +1669,17 @@ def label_clusters(stat_map, threshold, tail, connectivity, criteria):
         criterion.
     """
     cmap = np.empty(stat_map.shape, np.uint32)
-    bin_buff = np.empty(stat_map.shape, np.bool8)
-    cmap_flat = flatten(cmap, connectivity)
-
-    if tail == 0:
-        int_buff = np.empty(stat_map.shape, np.uint32)
-        int_buff_flat = flatten(int_buff, connectivity)
-    else:
-        int_buff = int_buff_flat = None
-
-    cids = _label_clusters(stat_map, threshold, tail, connectivity, criteria,
-                           cmap, cmap_flat, bin_buff, int_buff, int_buff_flat)
+    sign_buff = np.empty(stat_map.shape, np.int8)
+    bin_buff = np.empty(stat_map.shape, np.bool8) if tail == 0 else None
+    graph = flat_graph(stat_map.shape, connectivity)
+    buffers = cluster_buffers(stat_map.shape)
+    cids = _label_clusters(stat_map, threshold, tail, graph, criteria, cmap,
+                           sign_buff, bin_buff, buffers)
     return cmap, cids
 
 
-def _label_clusters(stat_map, threshold, tail, conn, criteria, cmap, cmap_flat,
-                    bin_buff, int_buff, int_buff_flat):
+def _label_clusters(stat_map, threshold, tail, graph, criteria, cmap,
+                    sign_buff, bin_buff, buffers):
     """Find clusters on a statistical parameter map
 
     Parameters
@@ -1705,6 +1689,10 @@ def _label_clusters(stat_map, threshold, tail, conn, criteria, cmap, cmap_flat,
         axis).
     cmap : array of int
         Buffer for the cluster id map (will be modified).
+    sign_buff : array of int8
+        Buffer (same shape as ``stat_map``).
+    bin_buff : array of bool
+        Buffer (only needed for ``tail == 0``).
 
     Returns
     -------
@@ -1712,27 +1700,16 @@ def _label_clusters(stat_map, threshold, tail, conn, criteria, cmap, cmap_flat,
         Identifiers of the clusters that survive the minimum duration
         criterion.
     """
-    # compute clusters
-    if tail >= 0:
-        bin_map_above = np.greater(stat_map, threshold, bin_buff)
-        cids = _label_clusters_binary(bin_map_above, cmap, cmap_flat, conn,
-                                      criteria)
-
-    if tail <= 0:
-        bin_map_below = np.less(stat_map, -threshold, bin_buff)
-        if tail < 0:
-            cids = _label_clusters_binary(bin_map_below, cmap, cmap_flat, conn,
-                                          criteria)
-        else:
-            cids_l = _label_clusters_binary(bin_map_below, int_buff,
-                                            int_buff_flat, conn, criteria)
-            x = cmap.max()
-            int_buff[bin_map_below] += x
-            cids_l += x
-            cmap += int_buff
-            cids = np.concatenate((cids, cids_l))
-
-    return cids
+    # positive clusters are 1, negative clusters -1 in sign_buff
+    if tail > 0:
+        np.greater(stat_map, threshold, sign_buff)
+    elif tail < 0:
+        np.less(stat_map, -threshold, sign_buff)
+    else:
+        np.greater(stat_map, threshold, sign_buff)
+        np.less(stat_map, -threshold, bin_buff)
+        np.subtract(sign_buff, bin_buff, sign_buff)
+    return _label_clusters_binary(sign_buff, cmap, graph, criteria, buffers)
 
 
 def label_clusters_binary(bin_map, connectivity, criteria=None):
@@ -1754,102 +1731,151 @@ def label_clusters_binary(bin_map, connectivity, criteria=None):
     cluster_ids : numpy.ndarray of uint32
         Sorted identifiers of the clusters that survive the selection criteria.
     """
+    sign = np.ascontiguousarray(bin_map, np.bool8).view(np.int8)
     cmap = np.empty(bin_map.shape, np.uint32)
-    cmap_flat = flatten(cmap, connectivity)
-    cids = _label_clusters_binary(bin_map, cmap, cmap_flat, connectivity, criteria)
+    graph = flat_graph(bin_map.shape, connectivity)
+    buffers = cluster_buffers(bin_map.shape)
+    cids = _label_clusters_binary(sign, cmap, graph, criteria, buffers)
     return cmap, cids
 
 
-def _label_clusters_binary(bin_map, cmap, cmap_flat, connectivity, criteria):
+def _label_clusters_binary(sign_map, cmap, graph, criteria, buffers):
     """Label clusters in a binary array
 
     Parameters
     ----------
-    bin_map : np.ndarray
-        Binary map of where the parameter map exceeds the threshold for a
-        cluster (non-adjacent dimension on the first axis).
+    sign_map : np.ndarray of int8
+        Map of where the parameter map exceeds the threshold for a cluster
+        (non-adjacent dimension on the first axis); adjacent non-zero points
+        with the same value form a cluster.
     cmap : np.ndarray
         Array in which to label the clusters.
-    cmap_flat : np.ndarray
-        Flat copy of cmap (ndim=2, only used when all_adjacent==False)
-    connectivity : Connectivity
-        Connectivity.
+    graph : tuple
+        Connectivity of the flattened map (see :func:`flat_graph`).
     criteria : None | list
         Cluster size criteria, list of (axes, v) tuples. Collapse over axes
         and apply v minimum length).
+    buffers : tuple
+        Buffers from :func:`cluster_buffers`.
 
     Returns
     -------
     cluster_ids : np.ndarray of uint32
         Sorted identifiers of the clusters that survive the selection criteria.
     """
-    # find clusters
-    n = ndimage.label(bin_map, connectivity.struct, cmap)
-    if n <= 1:
-        # in older versions, n is 1 even when no cluster is found
-        if n == 0 or cmap.max() == 0:
-            return np.array((), np.uint32)
-        else:
-            cids = np.array((1,), np.uint32)
-    elif connectivity.custom:
-        cids = merge_labels(cmap_flat, n, *connectivity.custom[0])
-    else:
-        cids = np.arange(1, n + 1, 1, np.uint32)
+    parent, mark, extent = buffers
+    cmap_1d = flatten_1d(cmap)
+    n = label_graph(sign_map.reshape(-1), *(graph + (parent, cmap_1d)))
+    cids = np.arange(1, n + 1, dtype=np.uint32)
 
     # apply minimum cluster size criteria
-    if criteria and cids.size:
+    if criteria and n:
+        keep = np.ones(n, bool)
+        shape = cmap.shape
         for axes, v in criteria:
-            cids = np.setdiff1d(cids,
-                                [i for i in cids if np.count_nonzero(np.equal(cmap, i).any(axes)) < v],
-                                True)
-            if cids.size == 0:
-                break
+            ax = (set(xrange(len(shape))) - set(axes)).pop()
+            stride = int(np.prod(shape[ax + 1:]))
+            cluster_extent(cmap_1d, n, stride, shape[ax], mark, extent)
+            keep &= extent[1:n + 1] >= v
+        cids = cids[keep]
 
     return cids
 
 
+def cluster_buffers(shape):
+    "Buffers for :func:`_label_clusters_binary`"
+    n = reduce(operator.mul, shape)
+    return (np.empty(n, np.int64), np.empty(n + 1, np.int64),
+            np.empty(n + 1, np.int64))
+
+
 def tfce(stat_map, tail, connectivity):
     tfce_im = np.empty(stat_map.shape, np.float64)
     tfce_im_1d = flatten_1d(tfce_im)
-    bin_buff = np.empty(stat_map.shape, np.bool8)
-    int_buff = np.empty(stat_map.shape, np.uint32)
-    int_buff_flat = flatten(int_buff, connectivity)
-    int_buff_1d = flatten_1d(int_buff)
-    return _tfce(stat_map, tail, connectivity, tfce_im, tfce_im_1d, bin_buff, int_buff,
-                 int_buff_flat, int_buff_1d)
+    graph = flat_graph(stat_map.shape, connectivity)
+    buffers = tfce_buffers(stat_map.shape)
+    return _tfce(stat_map, tail, graph, tfce_im, tfce_im_1d, buffers)
 
 
-def _tfce(stat_map, tail, conn, out, out_1d, bin_buff, int_buff,
-          int_buff_flat, int_buff_1d, dh=0.1, e=0.5, h=2.0):
-    "Threshold-free cluster enhancement"
-    out.fill(0)
+def flat_graph(shape, connectivity):
+    """Neighborhood structure of the flattened array
 
-    # determine slices
-    if tail == 0:
-        hs = chain(np.arange(-dh, stat_map.min(), -dh),
-                   np.arange(dh, stat_map.max(), dh))
-    elif tail < 0:
-        hs = np.arange(-dh, stat_map.min(), -dh)
+    Returns
+    -------
+    grid_strides : array of int
+        Strides (in elements) of the axes with grid connectivity.
+    grid_lengths : array of int
+        Lengths of the axes with grid connectivity.
+    edges, edge_start, edge_stop : array of int
+        Connectivity of the first axis if it is custom (with edges in both
+        directions, sorted by source).
+    custom_stride : int
+        Stride of the first axis if it is custom, 0 otherwise.
+    """
+    ndim = len(shape)
+    strides = [int(np.prod(shape[i + 1:])) for i in xrange(ndim)]
+    grid_axes = [i for i in xrange(ndim) if
+                 connectivity.struct[(1,) * i + (2,) + (1,) * (ndim - i - 1)]]
+    grid_strides = np.array([strides[i] for i in grid_axes], np.int64)
+    grid_lengths = np.array([shape[i] for i in grid_axes], np.int64)
+    if connectivity.custom:
+        # both directions for each edge
+        edges = connectivity.custom[0][0]
+        edges = edges[edges[:, 0] != edges[:, 1]]
+        edges = np.vstack((edges, edges[:, ::-1])).astype(np.uint32)
+        edges = edges[np.argsort(edges[:, 0], kind='mergesort')]
+        n_edges = np.bincount(edges[:, 0], minlength=shape[0])
+        edge_stop = np.cumsum(n_edges)
+        edge_start = edge_stop - n_edges
+        custom_stride = strides[0]
     else:
-        hs = np.arange(dh, stat_map.max(), dh)
-
-    # label clusters in slices at different heights
-    # fill each cluster with total section value
-    # each point's value is the vertical sum
-    for h_ in hs:
-        if h_ > 0:
-            np.greater_equal(stat_map, h_, bin_buff)
-            h_factor = h_ ** h
-        else:
-            np.less_equal(stat_map, h_, bin_buff)
-            h_factor = (-h_) ** h
+        edges = np.empty((0, 2), np.uint32)
+        edge_start = edge_stop = np.empty(0, np.int64)
+        custom_stride = 0
+    return grid_strides, grid_lengths, edges, edge_start, edge_stop, custom_stride
+
 
-        c_ids = _label_clusters_binary(bin_buff, int_buff, int_buff_flat, conn, None)
-        tfce_increment(c_ids, int_buff_1d, out_1d, e, h_factor)
+def tfce_buffers(shape):
+    "Buffers for :func:`_tfce`"
+    n = reduce(operator.mul, shape)
+    return (np.empty(n, np.int64), np.empty(n, np.float64),
+            np.empty(n, np.int64), np.empty(n, np.int64),
+            np.empty(n, np.int64))
+
+
+def _tfce(stat_map, tail, graph, out, out_1d, buffers, dh=0.1, e=0.5, h=2.0):
+    """Threshold-free cluster enhancement
 
+    Equivalent to labeling clusters at each height ``dh, 2 * dh, ...`` and
+    adding ``extent ** e * height ** h`` to all points in each cluster, but
+    with a single union-find sweep over all points (see
+    :func:`connectivity_opt.tfce_sweep`).
+    """
+    out.fill(0)
+    x = np.ascontiguousarray(stat_map).ravel()
+    if tail >= 0:
+        _tfce_sweep(x, np.arange(dh, x.max(), dh), graph, out_1d, buffers, e, h)
+    if tail <= 0:
+        hs = -np.arange(-dh, x.min(), -dh)
+        _tfce_sweep(np.negative(x), hs, graph, out_1d, buffers, e, h)
     return out
 
 
+def _tfce_sweep(x, hs, graph, out, buffers, e, h):
+    "Add TFCE for the positive part of x at heights hs (ascending)"
+    if len(hs) == 0:
+        return
+    index = np.flatnonzero(x >= hs[0])
+    values = x[index]
+    sort = np.argsort(-values, kind='mergesort')
+    order = index[sort]
+    level = np.searchsorted(hs, values[sort], 'right') - 1
+    cum_factor = np.zeros(len(hs) + 1)
+    np.cumsum(hs ** h, out=cum_factor[1:])
+    buffers[0].fill(-1)
+    tfce_sweep(x, order, cum_factor, level, e, *(graph + buffers + (out,)))
+
+
 class StatMapProcessor(object):
 
     def __init__(self, tail, max_axes, parc):
@@ -1880,19 +1906,14 @@ class TFCEProcessor(StatMapProcessor):
         self.connectivity = connectivity
 
         # Pre-allocate memory buffers used for cluster processing
-        self._bin_buff = np.empty(shape, np.bool8)
-        self._int_buff = np.empty(shape, np.uint32)
         self._tfce_im = np.empty(shape, np.float64)
         self._tfce_im_1d = flatten_1d(self._tfce_im)
-        self._int_buff_flat = flatten(self._int_buff, connectivity)
-        self._int_buff_1d = flatten_1d(self._int_buff)
+        self._graph = flat_graph(shape, connectivity)
+        self._buffers = tfce_buffers(shape)
 
     def max_stat(self, stat_map):
-        v = _tfce(
-            stat_map, self.tail, self.connectivity, self._tfce_im,
-            self._tfce_im_1d,
-            self._bin_buff, self._int_buff, self._int_buff_flat, self._int_buff_1d,
-        ).max(self.max_axes)
+        v = _tfce(stat_map, self.tail, self._graph, self._tfce_im,
+                  self._tfce_im_1d, self._buffers).max(self.max_axes)
         if self.parc is None:
             return v
         else:
@@ -1910,43 +1931,58 @@ class ClusterProcessor(StatMapProcessor):
         self.criteria = criteria
 
         # Pre-allocate memory buffers used for cluster processing
-        self._bin_buff = np.empty(shape, np.bool8)
-
         self._cmap = np.empty(shape, np.uint32)
-        self._cmap_flat = flatten(self._cmap, connectivity)
-
-        if tail == 0:
-            self._int_buff = np.empty(shape, np.uint32)
-            self._int_buff_flat = flatten(self._int_buff, connectivity)
+        self._sign_buff = np.empty(shape, np.int8)
+        self._bin_buff = np.empty(shape, np.bool8) if tail == 0 else None
+        self._graph = flat_graph(shape, connectivity)
+        self._buffers = cluster_buffers(shape)
+        self._cmap_1d = flatten_1d(self._cmap)
+
+        # parcel index for each point of the flattened map
+        if parc is None:
+            self._parc_map = None
         else:
-            self._int_buff = self._int_buff_flat = None
+            parc_ax = (set(xrange(len(shape))) - set(max_axes)).pop()
+            parc_index = np.full(shape[parc_ax], -1, np.intp)
+            for i, idx in enumerate(parc):
+                parc_index[idx] = i
+            index_shape = [1] * len(shape)
+            index_shape[parc_ax] = shape[parc_ax]
+            parc_map = np.broadcast_to(parc_index.reshape(index_shape), shape)
+            self._parc_map = parc_map.ravel()
+            self._cluster_parc = np.empty(self._cmap.size + 1, np.intp)
 
     def max_stat(self, stat_map, threshold=None):
         if threshold is None:
             threshold = self.threshold
-        cmap = self._cmap
-        cids = _label_clusters(stat_map, threshold, self.tail, self.connectivity,
-                               self.criteria, cmap, self._cmap_flat,
-                               self._bin_buff, self._int_buff,
-                               self._int_buff_flat)
-        if self.parc is not None:
-            v = []
-            for idx in self.parc:
-                clusters_v = ndimage.sum(stat_map[idx], cmap[idx], cids)
-                if len(clusters_v):
-                    if self.tail <= 0:
-                        np.abs(clusters_v, clusters_v)
-                    v.append(clusters_v.max())
-                else:
-                    v.append(0)
-            return v
-        elif len(cids):
-            clusters_v = ndimage.sum(stat_map, cmap, cids)
+        cids = _label_clusters(stat_map, threshold, self.tail, self._graph,
+                               self.criteria, self._cmap, self._sign_buff,
+                               self._bin_buff, self._buffers)
+        if len(cids):
+            # cluster mass: sum of stat_map values in each cluster
+            clusters_v = np.bincount(self._cmap_1d, stat_map.ravel())[cids]
             if self.tail <= 0:
                 np.abs(clusters_v, clusters_v)
-            return clusters_v.max()
-        else:
+        elif self.parc is None:
             return 0
+        else:
+            return np.zeros(len(self.parc))
+
+        if self.parc is None:
+            return clusters_v.max()
+        # clusters do not cross parcel boundaries, so any point of a cluster
+        # determines its parcel
+        points = np.flatnonzero(self._cmap_1d)
+        cluster_parc = self._cluster_parc
+        cluster_parc[self._cmap_1d[points]] = self._parc_map[points]
+        cluster_parc = cluster_parc[cids]
+        v = np.zeros(len(self.parc))
+        if cluster_parc.min() < 0:  # points outside of all parcels
+            keep = cluster_parc >= 0
+            cluster_parc = cluster_parc[keep]
+            clusters_v = clusters_v[keep]
+        np.maximum.at(v, cluster_parc, clusters_v)
+        return v
 
 
 def get_map_processor(kind, *args):
@@ -2165,6 +2201,7 @@ class _ClusterDist:
         self.has_original = False
         self.do_permutation = False
         self.dt_perm = None
+        self._perm_digest = None  # identifies the permutations in dist
         self._finalized = False
         self._init_time = current_time()
         self._host = socket.gethostname()
@@ -2309,7 +2346,8 @@ class _ClusterDist:
                  'dims', 'shape', '_nad_ax', '_criteria', '_connectivity',
                  # results ...
                  'dt_original', 'dt_perm', 'n_clusters', '_dist_dims', 'dist',
-                 '_original_param_map', '_original_cluster_map', '_cids')
+                 '_original_param_map', '_original_cluster_map', '_cids',
+                 '_perm_digest')
         state = {name: getattr(self, name) for name in attrs}
         state['version'] = 1
         return state
@@ -2317,6 +2355,8 @@ class _ClusterDist:
     def __setstate__(self, state):
         # backwards compatibility
         version = state.pop('version', 0)
+        if '_perm_digest' not in state:
+            state['_perm_digest'] = None
         if version == 0:
             if '_connectivity_src' in state:
                 del state['_connectivity_src']
@@ -2438,6 +2478,9 @@ class _ClusterDist:
         ----------
         raw : bool
             Return a RawArray and a shape tuple instead of a numpy array.
+            Contiguous memory-mapped data are returned as :class:`numpy.memmap`
+            instead of a RawArray, so that worker processes read the data from
+            the file instead of a copy.
         """
         # get data in the right shape
         x = self.y_perm.x
@@ -2446,6 +2489,9 @@ class _ClusterDist:
 
         if not raw:
             return x.reshape((len(x), -1))
+        elif (isinstance(x, np.memmap) and x.flags.c_contiguous and
+              x.dtype == np.float64):
+            return x, x.shape
 
         n = reduce(operator.mul, self.y_perm.shape)
         ra = RawArray('d', n)
@@ -2871,40 +2917,485 @@ class _MergedTemporalClusterDist:
         return clusters
 
 
-def distribution_worker(dist_array, dist_shape, in_queue):
+class PermutationCheckpoint(object):
+    """Resume an interrupted permutation test or extend a previous one
+
+    Parameters
+    ----------
+    path : str
+        Checkpoint file. While permutations are computed, the partial
+        permutation distribution is periodically saved to this file. If the
+        file exists from an interrupted run of the same test, permutations that
+        were already computed are skipped.
+    previous : _Result
+        Result of the same test with fewer samples. If the new test starts with
+        the same permutations as ``previous``, the permutation distribution of
+        ``previous`` is reused and only the additional permutations are
+        computed.
+    interval : scalar
+        Minimum interval between saving checkpoints, in seconds (default 300).
+
+    Notes
+    -----
+    Applies to a single test performed in the context::
+
+        with PermutationCheckpoint(path, previous):
+            res = testnd.ttest_rel(...)
+
+    The checkpoint file is deleted when the test is completed successfully.
+    """
+    def __init__(self, path, previous=None, interval=300):
+        self.path = path
+        self.previous = previous
+        self.interval = interval
+        self._used = False
+
+    def __enter__(self):
+        global _CHECKPOINT
+        if _CHECKPOINT is not None:
+            raise RuntimeError("Nested PermutationCheckpoint")
+        _CHECKPOINT = self
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        global _CHECKPOINT
+        _CHECKPOINT = None
+        if exc_type is None and os.path.exists(self.path):
+            os.remove(self.path)
+
+    @staticmethod
+    def _test_params(dists):
+        "Parameters that have to match for a checkpoint to be used"
+        return [(d.kind, d.threshold, d.tail, d.criteria, d.parc, d.samples)
+                for d in dists]
+
+    def _load(self, dists, perm_digest):
+        """Load previous distribution values if they match ``dists``
+
+        The checkpoint is only used if it was saved for a test with the same
+        parameters and the same permutation sequence (``perm_digest``).
+        """
+        if not os.path.exists(self.path):
+            return
+        logger = logging.getLogger(__name__)
+        try:
+            with open(self.path, 'rb') as fid:
+                state = pickle.load(fid)
+        except Exception as exception:
+            logger.warning("Ignoring unreadable checkpoint %s (%s)", self.path,
+                           exception)
+            return
+        old_dists = state['dists']
+        if (state.get('tests') != self._test_params(dists) or
+                state.get('perm_digest') != perm_digest or
+                len(old_dists) != len(dists) or not all(
+                    (old is None) == (not d.do_permutation) and
+                    (old is None or old.shape == d.dist_shape) and
+                    np.array_equal(param_map, d._original_param_map)
+                    for d, old, param_map in
+                    izip(dists, old_dists, state['param_maps']))):
+            logger.warning("Ignoring checkpoint for a different test: %s",
+                           self.path)
+            return
+        return state['done'], old_dists
+
+    def _load_previous(self, dists, iterator):
+        """Reuse the distribution of a previous result if it matches ``dists``
+
+        Returns
+        -------
+        done : None | array of bool
+            Permutations that were loaded from ``previous``.
+        iterator : iterator
+            The permutation iterator (the first permutations are consumed and
+            re-inserted for comparison with ``previous``).
+        """
+        if self.previous is None:
+            return None, iterator
+        old_dists = [d for _, d in self.previous._iter_cdists()]
+        if len(old_dists) != len(dists):
+            return None, iterator
+        n_old = None
+        for d, old in izip(dists, old_dists):
+            if not d.do_permutation:
+                continue
+            elif (old.dist is None or old.kind != d.kind or
+                  old.threshold != d.threshold or old.tail != d.tail or
+                  old.criteria != d.criteria or old.parc != d.parc or
+                  old.dist.shape[1:] != d.dist_shape[1:] or
+                  old.samples >= d.samples or
+                  not np.array_equal(old._original_param_map,
+                                     d._original_param_map)):
+                return None, iterator
+            elif n_old is None:
+                n_old = old.samples
+                digest = old._perm_digest
+            elif old.samples != n_old or old._perm_digest != digest:
+                return None, iterator
+        if n_old is None or digest is None:
+            return None, iterator
+
+        # check that the first permutations are the same as in previous
+        head = [perm.copy() for perm in islice(iterator, n_old)]
+        iterator = chain(head, iterator)
+        head_digest = hashlib.sha1()
+        for perm in head:
+            head_digest.update(perm)
+        if head_digest.hexdigest() != digest:
+            return None, iterator
+
+        for d, old in izip(dists, old_dists):
+            if d.do_permutation:
+                d.dist[:n_old] = old.dist
+        done = np.zeros(dists[0].samples, bool)
+        done[:n_old] = True
+        return done, iterator
+
+    def _start(self, dists, iterator):
+        """Prepare the permutation distribution(s) for a test
+
+        Returns
+        -------
+        iterator : iterator
+            Iterator over ``(index, permutation)`` tuples for the permutations
+            that still need to be computed.
+        writer : _CheckpointWriter
+            Object to update the checkpoint as permutations are completed.
+        """
+        if self._used:
+            raise RuntimeError("PermutationCheckpoint can only be used for a "
+                               "single test")
+        self._used = True
+        logger = logging.getLogger(__name__)
+        # the permutation sequence identifies the checkpoint
+        perms = [perm.copy() for perm in iterator]
+        digest = hashlib.sha1()
+        for perm in perms:
+            digest.update(perm)
+        perm_digest = digest.hexdigest()
+        iterator = iter(perms)
+        done = None
+        loaded = self._load(dists, perm_digest)
+        if loaded is not None:
+            done, old_dists = loaded
+            for d, old in izip(dists, old_dists):
+                if d.do_permutation:
+                    d.dist[:] = old
+            logger.info("Resuming permutation test from checkpoint with %i of "
+                        "%i permutations", done.sum(), len(done))
+        else:
+            done, iterator = self._load_previous(dists, iterator)
+            if done is not None:
+                logger.info("Extending permutation test from %i to %i "
+                            "permutations", done.sum(), len(done))
+        if done is None:
+            done = np.zeros(dists[0].samples, bool)
+        test = {'param_maps': [d._original_param_map for d in dists],
+                'tests': self._test_params(dists),
+                'perm_digest': perm_digest}
+        writer = _CheckpointWriter(self.path, self.interval, done, test)
+        return iter_indexed_permutations(iterator, dists, done), writer
+
+
+class _CheckpointWriter(object):
+    "Periodically save a partial permutation distribution"
+    def __init__(self, path, interval, done, test):
+        self.path = path
+        self.interval = interval
+        self.done = done
+        self.test = test
+        self._t_last = current_time()
+
+    def n_todo(self):
+        return len(self.done) - np.count_nonzero(self.done)
+
+    def update(self, index, dists):
+        self.done[index] = True
+        if current_time() - self._t_last > self.interval:
+            self.save(dists)
+
+    def save(self, dists):
+        dists = [None if d is None else np.asarray(d) for d in dists]
+        state = dict(self.test, done=self.done, dists=dists)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'wb') as fid:
+            pickle.dump(state, fid, pickle.HIGHEST_PROTOCOL)
+        os.rename(tmp_path, self.path)
+        self._t_last = current_time()
+
+
+_CHECKPOINT = None  # active PermutationCheckpoint
+
+
+def iter_indexed_permutations(iterator, dists, done=None):
+    """Enumerate permutations and skip those that are already done
+
+    Also records a digest of the permutation sequence in each of ``dists``,
+    which is used to determine whether a later test with more samples can
+    reuse the distribution.
+    """
+    digest = hashlib.sha1()
+    for i, perm in enumerate(iterator):
+        digest.update(perm)
+        if done is None or not done[i]:
+            yield i, perm
+    for dist in dists:
+        dist._perm_digest = digest.hexdigest()
+
+
+def start_permutations(dists, iterator):
+    """Apply an active :class:`PermutationCheckpoint`
+
+    Returns
+    -------
+    iterator : iterator
+        Iterator over ``(index, permutation)`` tuples for the permutations
+        that need to be computed.
+    writer : None | _CheckpointWriter
+        Checkpoint writer (None if no checkpoint is active).
+    """
+    if _CHECKPOINT is None:
+        return iter_indexed_permutations(iterator, dists), None
+    return _CHECKPOINT._start(dists, iterator)
+
+
+def iter_permutation_batches(iterator, n_batch):
+    """Collect permutations into arrays of ``n_batch`` rows
+
+    Parameters
+    ----------
+    iterator : iterator
+        Iterator over ``(index, permutation)`` tuples.
+    n_batch : int
+        Number of permutations per batch.
+
+    Yields
+    ------
+    index : array of int
+        Index of the permutations in the batch.
+    perms : array
+        Permutations.
+
+    Notes
+    -----
+    The permutation iterators modify and yield the same array in each
+    iteration, so each permutation is copied into the batch array.
+    """
+    index = []
+    batch = []
+    for i, perm in iterator:
+        index.append(i)
+        batch.append(perm.copy())
+        if len(batch) == n_batch:
+            yield np.array(index), np.array(batch)
+            index = []
+            batch = []
+    if batch:
+        yield np.array(index), np.array(batch)
+
+
+def distribution_worker(dist_array, dist_shape, in_queue, n_todo, writer=None):
     "Worker that accumulates values and places them into the distribution"
     signal.signal(signal.SIGINT, signal.SIG_IGN)
     n = reduce(operator.mul, dist_shape)
     dist = np.frombuffer(dist_array, np.float64, n)
     dist.shape = dist_shape
     samples = dist_shape[0]
-    for i in trange(samples, desc="Permutation test", unit=' permutations'):
-        dist[i] = in_queue.get()
+    with tqdm(total=samples, initial=samples - n_todo, desc="Permutation test",
+              unit=' permutations') as progress:
+        while n_todo:
+            index, v = in_queue.get()
+            dist[index] = v
+            if writer is not None:
+                writer.update(index, (dist,))
+            n_new = np.size(index)
+            n_todo -= n_new
+            progress.update(n_new)
+
+
+def shared_data_array(y, shape):
+    "Data from :meth:`_ClusterDist.data_for_permutation` as (n_cases, n) array"
+    if isinstance(y, np.ndarray):
+        return y.reshape((shape[0], -1))
+    n = reduce(operator.mul, shape)
+    return np.frombuffer(y, np.float64, n).reshape((shape[0], -1))
 
 
-def permutation_worker(in_queue, out_queue, y, shape, test_func, map_args):
+def permutation_worker(in_queue, out_queue, y, shape, test_func, map_args,
+                       n_batch=0):
     "Worker for 1 sample t-test"
     signal.signal(signal.SIGINT, signal.SIG_IGN)
-    n = reduce(operator.mul, shape)
-    y = np.frombuffer(y, np.float64, n).reshape((shape[0], -1))
-    stat_map = np.empty(shape[1:])
-    stat_map_flat = stat_map.ravel()
+    y = shared_data_array(y, shape)
     map_processor = get_map_processor(*map_args)
-    while True:
-        perm = in_queue.get()
-        if perm is None:
-            break
-        test_func(y, stat_map_flat, perm)
-        max_v = map_processor.max_stat(stat_map)
-        out_queue.put(max_v)
+    if n_batch:
+        stat_maps = np.empty((n_batch,) + shape[1:])
+        stat_maps_flat = stat_maps.reshape((n_batch, -1))
+        while True:
+            item = in_queue.get()
+            if item is None:
+                break
+            index, perms = item
+            n_perm = len(perms)
+            test_func(y, stat_maps_flat[:n_perm], perms)
+            max_v = [map_processor.max_stat(m) for m in stat_maps[:n_perm]]
+            out_queue.put((index, max_v))
+    else:
+        stat_map = np.empty(shape[1:])
+        stat_map_flat = stat_map.ravel()
+        while True:
+            item = in_queue.get()
+            if item is None:
+                break
+            i, perm = item
+            test_func(y, stat_map_flat, perm)
+            max_v = map_processor.max_stat(stat_map)
+            out_queue.put((i, max_v))
+
+
+_THREAD_POOL = None
+_THREAD_POOL_N_WORKERS = None  # number of threads in _THREAD_POOL
+
+
+def get_thread_pool():
+    "Persistent thread pool for permutation tests"
+    global _THREAD_POOL, _THREAD_POOL_N_WORKERS
+    n_workers = CONFIG['n_workers']
+    if _THREAD_POOL is None or _THREAD_POOL_N_WORKERS != n_workers:
+        if _THREAD_POOL is not None:
+            _THREAD_POOL.close()
+        _THREAD_POOL = ThreadPool(n_workers)
+        _THREAD_POOL_N_WORKERS = n_workers
+    return _THREAD_POOL
 
 
-def run_permutation(test_func, dist, iterator, use_mp=True):
-    if use_mp and CONFIG['n_workers']:
-        workers, out_queue = setup_workers(test_func, dist)
+class PermutationThreadWorker(object):
+    """Evaluate permutations in a pool thread
 
-        for perm in iterator:
-            out_queue.put(perm)
+    Data and distribution arrays are shared between threads; the test
+    function and map processor, which contain buffers, are instantiated once
+    per thread.
+    """
+    def __init__(self, func, y, test, *args):
+        self.func = func
+        self.y = y
+        self.test = test
+        self.args = args
+        self._local = threading.local()
+
+    def __call__(self, item):
+        local = self._local
+        if not hasattr(local, 'test'):
+            local.test = deepcopy(self.test)
+            local.buffers = {}
+        index, perm = item
+        self.func(local.test, local.buffers, self.y, index, perm, *self.args)
+        return index
+
+
+def permutation_thread_worker(test_func, buffers, y, index, perm, dist,
+                              n_batch):
+    "Evaluate permutation(s) and write the results to the distribution"
+    if not buffers:
+        buffers['map_processor'] = get_map_processor(*dist.map_args)
+        buffers['stat_maps'] = np.empty((n_batch or 1,) + dist.shape)
+    map_processor = buffers['map_processor']
+    stat_maps = buffers['stat_maps']
+    if n_batch:
+        n_perm = len(perm)
+        test_func(y, stat_maps[:n_perm].reshape((n_perm, -1)), perm)
+        for i, stat_map in izip(index, stat_maps):
+            dist.dist[i] = map_processor.max_stat(stat_map)
+    else:
+        stat_map = stat_maps[0]
+        test_func(y, stat_map.reshape(-1), perm)
+        dist.dist[index] = map_processor.max_stat(stat_map)
+
+
+def permutation_thread_worker_me(test, buffers, y, index, perm, dists,
+                                 thresholds, n_batch):
+    "Evaluate permutation(s) and write the results to the distributions"
+    dist = dists[0]
+    if not buffers:
+        buffers['map_processor'] = get_map_processor(*dist.map_args)
+        if n_batch:
+            buffers['stat_maps'] = np.empty(
+                (n_batch, test.n_effects) + dist.shape)
+        else:
+            buffers['stat_maps'] = test.preallocate((0,) + dist.shape)[None]
+    map_processor = buffers['map_processor']
+    stat_maps = buffers['stat_maps']
+    if n_batch:
+        n_perm = len(perm)
+        test.map_batch(y, perm, stat_maps[:n_perm].reshape(
+            (n_perm, test.n_effects, -1)))
+    else:
+        test.map(y, perm)
+        index = (index,)
+    for i, maps in izip(index, stat_maps):
+        for i_effect, d in enumerate(dists):
+            if not d.do_permutation:
+                continue
+            elif thresholds:
+                d.dist[i] = map_processor.max_stat(maps[i_effect],
+                                                   thresholds[i_effect])
+            else:
+                d.dist[i] = map_processor.max_stat(maps[i_effect])
+
+
+def run_in_thread_pool(worker, iterator, dists, writer):
+    "Evaluate permutations with the persistent thread pool"
+    samples = dists[0].samples
+    n_todo = samples if writer is None else writer.n_todo()
+    # permutation iterators modify the same array in place
+    items = ((index, perm.copy()) for index, perm in iterator)
+    pool = get_thread_pool()
+    with tqdm(total=samples, initial=samples - n_todo,
+              desc="Permutation test", unit=' permutations') as progress:
+        for index in pool.imap_unordered(worker, items):
+            if writer is not None:
+                writer.update(index, [d.dist for d in dists])
+            progress.update(np.size(index))
+
+
+def run_permutation(test_func, dist, iterator, use_mp=True, batch_func=None):
+    """Compute the permutation distribution
+
+    Parameters
+    ----------
+    test_func : callable
+        ``test_func(y, out, perm)`` computing the statistical map for one
+        permutation.
+    dist : _ClusterDist
+        Distribution to fill.
+    iterator : iterator
+        Permutations.
+    use_mp : bool
+        Use multiprocessing (if enabled in the configuration).
+    batch_func : callable
+        ``batch_func(y, out, perms)`` computing the statistical maps for a
+        batch of permutations; used if ``CONFIG['permutation_batch']`` is
+        set.
+    """
+    iterator, writer = start_permutations((dist,), iterator)
+    if batch_func is not None and CONFIG['permutation_batch']:
+        n_batch = CONFIG['permutation_batch']
+        test_func = batch_func
+        iterator = iter_permutation_batches(iterator, n_batch)
+    else:
+        n_batch = 0
+
+    if CONFIG['n_workers'] and CONFIG['permutation_backend'] == 'thread':
+        y = dist.data_for_permutation(False)
+        worker = PermutationThreadWorker(
+            permutation_thread_worker, y, test_func, dist, n_batch)
+        run_in_thread_pool(worker, iterator, (dist,), writer)
+    elif use_mp and CONFIG['n_workers']:
+        n_todo = dist.samples if writer is None else writer.n_todo()
+        workers, out_queue = setup_workers(test_func, dist, n_batch, n_todo,
+                                           writer)
+
+        for item in iterator:
+            out_queue.put(item)
 
         for _ in xrange(len(workers) - 1):
             out_queue.put(None)
@@ -2913,18 +3404,32 @@ def run_permutation(test_func, dist, iterator, use_mp=True):
         for w in workers:
             w.join()
             logger.debug("worker joined")
+    elif n_batch:
+        y = dist.data_for_permutation(False)
+        map_processor = get_map_processor(*dist.map_args)
+        stat_maps = np.empty((n_batch,) + dist.shape)
+        stat_maps_flat = stat_maps.reshape((n_batch, -1))
+        for index, perms in iterator:
+            n_perm = len(perms)
+            test_func(y, stat_maps_flat[:n_perm], perms)
+            for i, stat_map in izip(index, stat_maps):
+                dist.dist[i] = map_processor.max_stat(stat_map)
+            if writer is not None:
+                writer.update(index, (dist.dist,))
     else:
         y = dist.data_for_permutation(False)
         map_processor = get_map_processor(*dist.map_args)
         stat_map = np.empty(dist.shape)
         stat_map_flat = stat_map.ravel()
-        for i, perm in enumerate(iterator):
+        for i, perm in iterator:
             test_func(y, stat_map_flat, perm)
             dist.dist[i] = map_processor.max_stat(stat_map)
+            if writer is not None:
+                writer.update(i, (dist.dist,))
     dist.finalize()
 
 
-def setup_workers(test_func, dist):
+def setup_workers(test_func, dist, n_batch, n_todo, writer):
     "Initialize workers for permutation tests"
     logger = logging.getLogger(__name__)
     logger.debug("Setting up %i worker processes..." % CONFIG['n_workers'])
@@ -2933,7 +3438,8 @@ def setup_workers(test_func, dist):
 
     # permutation workers
     y, shape = dist.data_for_permutation()
-    args = (permutation_queue, dist_queue, y, shape, test_func, dist.map_args)
+    args = (permutation_queue, dist_queue, y, shape, test_func, dist.map_args,
+            n_batch)
     workers = []
     for _ in xrange(CONFIG['n_workers']):
         w = Process(target=permutation_worker, args=args)
@@ -2942,7 +3448,7 @@ def setup_workers(test_func, dist):
         workers.append(w)
 
     # distribution worker
-    args = (dist.dist_array, dist.dist_shape, dist_queue)
+    args = (dist.dist_array, dist.dist_shape, dist_queue, n_todo, writer)
     w = Process(target=distribution_worker, args=args)
     w.daemon = True
     w.start()
@@ -2958,11 +3464,23 @@ def run_permutation_me(test, dists, iterator):
     else:
         thresholds = None
 
-    if CONFIG['n_workers']:
-        workers, out_queue = setup_workers_me(test, dists, thresholds)
+    iterator, writer = start_permutations(dists, iterator)
+    n_batch = CONFIG['permutation_batch']
+    if n_batch:
+        iterator = iter_permutation_batches(iterator, n_batch)
+
+    if CONFIG['n_workers'] and CONFIG['permutation_backend'] == 'thread':
+        y = dist.data_for_permutation(False)
+        worker = PermutationThreadWorker(
+            permutation_thread_worker_me, y, test, dists, thresholds, n_batch)
+        run_in_thread_pool(worker, iterator, dists, writer)
+    elif CONFIG['n_workers']:
+        n_todo = dist.samples if writer is None else writer.n_todo()
+        workers, out_queue = setup_workers_me(test, dists, thresholds, n_batch,
+                                              n_todo, writer)
 
-        for perm in iterator:
-            out_queue.put(perm)
+        for item in iterator:
+            out_queue.put(item)
 
         for _ in xrange(len(workers) - 1):
             out_queue.put(None)
@@ -2971,6 +3489,25 @@ def run_permutation_me(test, dists, iterator):
         for w in workers:
             w.join()
             logger.debug("worker joined")
+    elif n_batch:
+        y = dist.data_for_permutation(False)
+        map_processor = get_map_processor(*dist.map_args)
+        stat_maps = np.empty((n_batch, test.n_effects) + dist.shape)
+        stat_maps_flat = stat_maps.reshape((n_batch, test.n_effects, -1))
+        for index, perms in iterator:
+            n_perm = len(perms)
+            test.map_batch(y, perms, stat_maps_flat[:n_perm])
+            for i, maps in izip(index, stat_maps):
+                for i_effect, d in enumerate(dists):
+                    if not d.do_permutation:
+                        continue
+                    elif thresholds:
+                        d.dist[i] = map_processor.max_stat(
+                            maps[i_effect], thresholds[i_effect])
+                    else:
+                        d.dist[i] = map_processor.max_stat(maps[i_effect])
+            if writer is not None:
+                writer.update(index, [d.dist for d in dists])
     else:
         y = dist.data_for_permutation(False)
         map_processor = get_map_processor(*dist.map_args)
@@ -2982,7 +3519,7 @@ def run_permutation_me(test, dists, iterator):
         else:
             stat_maps_iter = zip(stat_maps_iter, dists)
 
-        for i, perm in enumerate(iterator):
+        for i, perm in iterator:
             test.map(y, perm)
             if thresholds:
                 for m, t, d in stat_maps_iter:
@@ -2992,13 +3529,15 @@ def run_permutation_me(test, dists, iterator):
                 for m, d in stat_maps_iter:
                     if d.do_permutation:
                         d.dist[i] = map_processor.max_stat(m)
+            if writer is not None:
+                writer.update(i, [d.dist for d in dists])
 
     for d in dists:
         if d.do_permutation:
             d.finalize()
 
 
-def setup_workers_me(test_func, dists, thresholds):
+def setup_workers_me(test_func, dists, thresholds, n_batch, n_todo, writer):
     "Initialize workers for permutation tests"
     logger = logging.getLogger(__name__)
     logger.debug("Setting up %i worker processes..." % CONFIG['n_workers'])
@@ -3009,7 +3548,7 @@ def setup_workers_me(test_func, dists, thresholds):
     dist = dists[0]
     y, shape = dist.data_for_permutation()
     args = (permutation_queue, dist_queue, y, shape, test_func, dist.map_args,
-            thresholds)
+            thresholds, n_batch)
     workers = []
     for _ in xrange(CONFIG['n_workers']):
         w = Process(target=permutation_worker_me, args=args)
@@ -3018,7 +3557,8 @@ def setup_workers_me(test_func, dists, thresholds):
         workers.append(w)
 
     # distribution worker
-    args = ([d.dist_array for d in dists], dist.dist_shape, dist_queue)
+    args = ([d.dist_array for d in dists], dist.dist_shape, dist_queue, n_todo,
+            writer)
     w = Process(target=distribution_worker_me, args=args)
     w.daemon = True
     w.start()
@@ -3028,35 +3568,65 @@ def setup_workers_me(test_func, dists, thresholds):
 
 
 def permutation_worker_me(in_queue, out_queue, y, shape, test, map_args,
-                          thresholds):
+                          thresholds, n_batch=0):
     signal.signal(signal.SIGINT, signal.SIG_IGN)
-    n = reduce(operator.mul, shape)
-    y = np.frombuffer(y, np.float64, n).reshape((shape[0], -1))
+    y = shared_data_array(y, shape)
+    map_processor = get_map_processor(*map_args)
+    if n_batch:
+        stat_maps = np.empty((n_batch, test.n_effects) + shape[1:])
+        stat_maps_flat = stat_maps.reshape((n_batch, test.n_effects, -1))
+        while True:
+            item = in_queue.get()
+            if item is None:
+                break
+            index, perms = item
+            n_perm = len(perms)
+            test.map_batch(y, perms, stat_maps_flat[:n_perm])
+            # one list of values per effect
+            effect_maps = stat_maps[:n_perm].swapaxes(0, 1)
+            if thresholds:
+                max_v = [[map_processor.max_stat(m, t) for m in maps] for
+                         maps, t in izip(effect_maps, thresholds)]
+            else:
+                max_v = [[map_processor.max_stat(m) for m in maps] for maps in
+                         effect_maps]
+            out_queue.put((index, max_v))
+        return
+
     iterator = list(test.preallocate(shape))
     if thresholds:
         iterator = zip(iterator, thresholds)
-    map_processor = get_map_processor(*map_args)
     while True:
-        perm = in_queue.get()
-        if perm is None:
+        item = in_queue.get()
+        if item is None:
             break
+        i, perm = item
         test.map(y, perm)
 
         if thresholds:
             max_v = [map_processor.max_stat(m, t) for m, t in iterator]
         else:
             max_v = [map_processor.max_stat(m) for m in iterator]
-        out_queue.put(max_v)
+        out_queue.put((i, max_v))
 
 
-def distribution_worker_me(dist_arrays, dist_shape, in_queue):
+def distribution_worker_me(dist_arrays, dist_shape, in_queue, n_todo,
+                           writer=None):
     "Worker that accumulates values and places them into the distribution"
     signal.signal(signal.SIGINT, signal.SIG_IGN)
     n = reduce(operator.mul, dist_shape)
     dists = [d if d is None else np.frombuffer(d, np.float64, n).reshape(dist_shape)
              for d in dist_arrays]
     samples = dist_shape[0]
-    for i in trange(samples, desc="Permutation test", unit=' permutations'):
-        for dist, v in izip(dists, in_queue.get()):
-            if dist is not None:
-                dist[i] = v
+    with tqdm(total=samples, initial=samples - n_todo, desc="Permutation test",
+              unit=' permutations') as progress:
+        while n_todo:
+            index, values = in_queue.get()
+            for dist, v in izip(dists, values):
+                if dist is not None:
+                    dist[index] = v
+            if writer is not None:
+                writer.update(index, dists)
+            n_new = np.size(index)
+            n_todo -= n_new
+            progress.update(n_new)
@@ -1,8 +1,10 @@
 # Author: Christian Brodbeck <christianbrodbeck@nyu.edu>
 from nose.tools import assert_almost_equal
 import numpy as np
+from numpy.testing import assert_allclose
 
-from eelbrain._stats.error_functions import l1, l2
+from eelbrain._stats.error_functions import (
+    l1, l2, l1_for_delta, l2_for_delta, l1_for_delta_grid, l2_xcorr)
 
 PRECISION = 10
 
@@ -25,3 +27,34 @@ def test_error_functions():
 
     assert_almost_equal(l1(x), np_l1(x), PRECISION)
     assert_almost_equal(l2(x), np_l2(x), PRECISION)
+
+
+def test_delta_error_grid():
+    "Test vectorized error change functions"
+    y = np.random.normal(0., 1., 100)
+    x = np.random.normal(0., 1., (3, 100))
+    delta = 0.1
+    e_add = np.empty((3, 10))
+    e_sub = np.empty((3, 10))
+    for i_stim in xrange(3):
+        for shift in xrange(10):
+            e_add[i_stim, shift], e_sub[i_stim, shift] = \
+                l1_for_delta(y, x[i_stim], delta, shift)
+    e_pos = np.zeros((3, 10))
+    e_neg = np.zeros((3, 10))
+    l1_for_delta_grid(y, x, delta, e_pos, e_neg)
+    assert_allclose(e_pos, e_add)
+    assert_allclose(e_neg, e_sub)
+
+    # l2 in closed form
+    for i_stim in xrange(3):
+        for shift in xrange(10):
+            e_add[i_stim, shift], e_sub[i_stim, shift] = \
+                l2_for_delta(y, x[i_stim], delta, shift)
+    xcorr = np.zeros((3, 10))
+    l2_xcorr(y, x, xcorr)
+    x_ss = np.array([[np.sum(xi[:100 - shift] ** 2) for shift in xrange(10)]
+                     for xi in x])
+    e = l2(y)
+    assert_allclose(e - 2 * delta * xcorr + delta ** 2 * x_ss, e_add)
+    assert_allclose(e + 2 * delta * xcorr + delta ** 2 * x_ss, e_sub)
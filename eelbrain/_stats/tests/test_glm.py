@@ -171,6 +171,19 @@ def test_ndanova():
     eq_(len(res.find_clusters(0.05)), 8)
 
 
+@nottest
+def assert_map_batch_equal(aov, y, n_perm=4):
+    "Test _NDANOVA.map_batch() against .map()"
+    n_cases, n_tests = y.shape
+    perms = np.array([perm.copy() for perm in permute_order(n_cases, n_perm)])
+    f_maps = aov.preallocate(y.shape)
+    f_maps_batch = np.empty((n_perm,) + f_maps.shape)
+    aov.map_batch(y, perms, f_maps_batch)
+    for perm, f_maps_perm in izip(perms, f_maps_batch):
+        aov.map(y, perm)
+        assert_allclose(f_maps_perm, f_maps, 1e-6, 1e-6)
+
+
 def test_anova_perm():
     "Test permutation argument for ANOVA"
     ds = datasets.get_uts()
@@ -187,6 +200,7 @@ def test_anova_perm():
         y_perm[perm] = y
         aov.map(y_perm)
         assert_allclose(r2, r1, 1e-6, 1e-6)
+    assert_map_batch_equal(aov, y)
 
     # full repeated measures anova
     aov = glm._BalancedMixedNDANOVA(ds.eval('A*B*rm'))
@@ -197,6 +211,7 @@ def test_anova_perm():
         y_perm[perm] = y
         aov.map(y_perm)
         assert_allclose(r2, r1, 1e-6, 1e-6)
+    assert_map_batch_equal(aov, y)
 
     # incremental anova
     ds = ds[1:]
@@ -211,6 +226,7 @@ def test_anova_perm():
         y_perm[perm] = y
         aov.map(y_perm)
         assert_allclose(r2, r1, 1e-6, 1e-6)
+    assert_map_batch_equal(aov, y)
 
 
 def test_anova_r_adler():
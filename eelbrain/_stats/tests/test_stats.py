@@ -8,7 +8,7 @@ import scipy.stats
 
 from eelbrain import datasets
 from eelbrain._stats import stats
-from eelbrain._stats.permutation import permute_order
+from eelbrain._stats.permutation import permute_order, permute_sign_flip
 
 
 def test_confidence_interval():
@@ -67,6 +67,13 @@ def test_corr():
             r_sp, _ = scipy.stats.pearsonr(y_perm[:, i], x)
             assert_almost_equal(corr[i], r_sp)
 
+    # batch of permutations
+    perms = np.array([perm.copy() for perm in permute_order(n_cases, 4)])
+    corr_batch = np.empty((len(perms), y.shape[1]))
+    stats.corr_perm_batch(y, x, corr_batch, perms)
+    for perm, corr_perm in zip(perms, corr_batch):
+        assert_allclose(corr_perm, stats.corr(y, x, perm=perm))
+
 
 def test_lm():
     "Test linear model function against scipy lstsq"
@@ -142,6 +149,14 @@ def test_t_1samp():
     t = scipy.stats.ttest_1samp(y, 0, 0)[0]
     assert_allclose(stats.t_1samp(y), t, 10)
 
+    # batch of sign flips
+    y = ds['uts'].x
+    signs = np.array([sign.copy() for sign in permute_sign_flip(len(y), 4)])
+    t_batch = np.empty((len(signs), y.shape[1]))
+    stats.t_1samp_perm_batch(y, t_batch, signs)
+    for sign, t_perm in zip(signs, t_batch):
+        assert_allclose(t_perm, stats.t_1samp(y * sign[:, None]))
+
 
 def test_t_ind():
     "Test independent samples t-test"
@@ -166,3 +181,11 @@ def test_t_ind():
         y_perm[perm] = y
         t_sp, _ = scipy.stats.ttest_ind(y_perm[:n], y_perm[n:])
         assert_allclose(t, t_sp)
+
+    # batch of permutations
+    y = y.reshape((n_cases, -1))
+    perms = np.array([perm.copy() for perm in permute_order(n_cases, 4)])
+    t_batch = np.empty((len(perms), y.shape[1]))
+    stats.t_ind_perm_batch(y, groups, t_batch, perms)
+    for perm, t_perm in zip(perms, t_batch):
+        assert_allclose(t_perm, stats.t_ind(y, groups, perm=perm))
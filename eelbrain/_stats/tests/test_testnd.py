@@ -4,6 +4,7 @@ from __future__ import print_function
 from itertools import izip
 import cPickle as pickle
 import logging
+import os
 
 from nose.tools import (eq_, ok_, assert_equal, assert_not_equal,
                         assert_greater, assert_greater_equal, assert_less,
@@ -15,10 +16,11 @@ import eelbrain
 from eelbrain import (NDVar, Categorial, Scalar, UTS, Sensor, configure,
                       datasets, testnd, set_log_level, cwt_morlet)
 from eelbrain._exceptions import ZeroVariance
-from eelbrain._stats.testnd import (Connectivity, _ClusterDist, label_clusters,
-                                    _MergedTemporalClusterDist, find_peaks)
+from eelbrain._stats.testnd import (
+    Connectivity, _ClusterDist, label_clusters, label_clusters_binary, tfce,
+    _MergedTemporalClusterDist, find_peaks)
 from eelbrain._utils.testing import (assert_dataobj_equal, assert_dataset_equal,
-                                     requires_mne_sample_data)
+                                     requires_mne_sample_data, TempDir)
 
 
 def test_anova():
@@ -102,6 +104,14 @@ def test_anova():
     res = testnd.anova('utsnd', 'A*B*rm', match='rm', ds=ds, pmin=0.05, samples=5)
     assert_dataset_equal(res.clusters, res0.clusters)
     configure(n_workers=True)
+    # batched permutations
+    configure(permutation_batch=2)
+    res = testnd.anova('utsnd', 'A*B*rm', match='rm', ds=ds, pmin=0.05, samples=5)
+    assert_dataset_equal(res.clusters, res0.clusters)
+    configure(n_workers=0)
+    res = testnd.anova('utsnd', 'A*B*rm', match='rm', ds=ds, pmin=0.05, samples=5)
+    assert_dataset_equal(res.clusters, res0.clusters)
+    configure(n_workers=True, permutation_batch=0)
 
     # permutation
     eelbrain._stats.permutation._YIELD_ORIGINAL = 1
@@ -341,6 +351,13 @@ def test_clusterdist():
     assert_array_equal(p_parc.x, res.compute_probability_map().x)
     ok_(np.all(p_parc.sub(categorial='a').x >= p_a))
     ok_(np.all(p_parc.sub(categorial='b').x >= p_b))
+    # parc with clusters on unconnected dimension
+    kwargs = dict(pmin=0.05, samples=3, force_permutation=True)
+    res_parc = testnd.ttest_1samp(y, parc='categorial', **kwargs)
+    res0 = testnd.ttest_1samp(y0, **kwargs)
+    res1 = testnd.ttest_1samp(y1, **kwargs)
+    assert_array_equal(res_parc._cdist.dist[:, 0], res0._cdist.dist)
+    assert_array_equal(res_parc._cdist.dist[:, 1], res1._cdist.dist)
     configure(True)
 
 
@@ -365,6 +382,137 @@ def test_corr():
     assert_dataobj_equal(res.p_uncorrected, res_.p_uncorrected)
     assert_dataobj_equal(res.p, res_.p)
 
+    # batched permutations
+    configure(permutation_batch=4)
+    res_b = testnd.corr('utsnd', 'Y', 'rm', ds=ds, samples=10, pmin=0.05)
+    configure(permutation_batch=0)
+    assert_dataobj_equal(res_b.p, res.p)
+
+
+def test_permutation_backend():
+    "Test the thread backend for permutation tests"
+    ds = datasets.get_uts(True)
+    tests = (
+        (testnd.ttest_ind, ('utsnd', 'A', 'a1', 'a0'), {'pmin': 0.05}),
+        (testnd.ttest_rel, ('utsnd', 'A', 'a1', 'a0', 'rm'), {'tfce': True}),
+        (testnd.t_contrast_rel, ('utsnd', 'A', 'a1>a0', 'rm'), {'pmin': 0.05}),
+        (testnd.anova, ('utsnd', 'A*B'), {'pmin': 0.05}),
+        (testnd.anova, ('utsnd', 'A*B*rm'), {'match': 'rm'}),
+    )
+    results = [func(*args, ds=ds, samples=10, **kwargs) for func, args, kwargs
+               in tests]
+    n_workers = eelbrain._config.CONFIG['n_workers']
+    configure(n_workers=2, permutation_backend='thread')
+    try:
+        for (func, args, kwargs), res in izip(tests, results):
+            res_t = func(*args, ds=ds, samples=10, **kwargs)
+            for (_, cdist), (_, cdist_t) in izip(res._iter_cdists(),
+                                                 res_t._iter_cdists()):
+                assert_array_equal(cdist_t.dist, cdist.dist)
+        configure(permutation_batch=3)
+        res_t = testnd.anova('utsnd', 'A*B', ds=ds, samples=10, pmin=0.05)
+        for cdist, cdist_t in izip(results[3]._cdist, res_t._cdist):
+            assert_allclose(cdist_t.dist, cdist.dist)
+    finally:
+        configure(n_workers=n_workers, permutation_backend='process',
+                  permutation_batch=0)
+
+
+def test_memmap():
+    "Test permutation tests with memory-mapped data"
+    ds = datasets.get_uts(True)
+    tempdir = TempDir()
+    ds['utsnd_mm'] = eelbrain.combine((ds['utsnd'],),
+                                      memmap=os.path.join(tempdir, 'y.npy'))
+    res = testnd.ttest_1samp('utsnd', ds=ds, samples=10, pmin=0.05)
+    n_workers = eelbrain._config.CONFIG['n_workers']
+    try:
+        for n in (0, 2):
+            configure(n_workers=n)
+            res_mm = testnd.ttest_1samp('utsnd_mm', ds=ds, samples=10,
+                                        pmin=0.05)
+            assert_array_equal(res_mm.t.x, res.t.x)
+            assert_array_equal(res_mm._cdist.dist, res._cdist.dist)
+    finally:
+        configure(n_workers=n_workers)
+
+
+def test_permutation_checkpoint():
+    "Test extending and resuming permutation tests"
+    ds = datasets.get_uts(True)
+    tempdir = TempDir()
+    path = os.path.join(tempdir, 'test.checkpoint')
+
+    # extend a previous result
+    res5 = testnd.ttest_ind('utsnd', 'A', 'a1', 'a0', ds=ds, pmin=0.05, samples=5)
+    res10 = testnd.ttest_ind('utsnd', 'A', 'a1', 'a0', ds=ds, pmin=0.05, samples=10)
+    res10_dist = res10._cdist.dist
+    with testnd.PermutationCheckpoint(path, res5):
+        res = testnd.ttest_ind('utsnd', 'A', 'a1', 'a0', ds=ds, pmin=0.05,
+                               samples=10)
+    assert_array_equal(res._cdist.dist, res10._cdist.dist)
+    assert_dataset_equal(res.clusters, res10.clusters)
+    ok_(not os.path.exists(path))
+    # the previous distribution is reused
+    res5_ = pickle.loads(pickle.dumps(res5, pickle.HIGHEST_PROTOCOL))
+    res5_._cdist.dist += 1000
+    with testnd.PermutationCheckpoint(path, res5_):
+        res = testnd.ttest_ind('utsnd', 'A', 'a1', 'a0', ds=ds, pmin=0.05,
+                               samples=10)
+    assert_array_equal(res._cdist.dist[:5], res5_._cdist.dist)
+    assert_array_equal(res._cdist.dist[5:], res10._cdist.dist[5:])
+    # ... but not for a different test
+    res5_ = testnd.ttest_ind('utsnd', 'A', 'a1', 'a0', ds=ds, pmin=0.1, samples=5)
+    with testnd.PermutationCheckpoint(path, res5_):
+        res = testnd.ttest_ind('utsnd', 'A', 'a1', 'a0', ds=ds, pmin=0.05,
+                               samples=10)
+    assert_array_equal(res._cdist.dist, res10._cdist.dist)
+
+    # anova
+    res5 = testnd.anova('utsnd', 'A*B', ds=ds, samples=5, pmin=0.05)
+    res10 = testnd.anova('utsnd', 'A*B', ds=ds, samples=10, pmin=0.05)
+    with testnd.PermutationCheckpoint(path, res5):
+        res = testnd.anova('utsnd', 'A*B', ds=ds, samples=10, pmin=0.05)
+    for cdist, cdist10 in izip(res._cdist, res10._cdist):
+        assert_array_equal(cdist.dist, cdist10.dist)
+
+    # resume from an interrupted test
+    checkpoint = testnd.PermutationCheckpoint(path, interval=0)
+    checkpoint.__enter__()
+    testnd.ttest_ind('utsnd', 'A', 'a1', 'a0', ds=ds, pmin=0.05, samples=10)
+    checkpoint.__exit__(KeyboardInterrupt, None, None)
+    with open(path, 'rb') as fid:
+        state = pickle.load(fid)
+    ok_(state['done'].all())
+    state['done'][5:] = False
+    state['dists'][0][:5] += 1000
+    with open(path, 'wb') as fid:
+        pickle.dump(state, fid, pickle.HIGHEST_PROTOCOL)
+    with testnd.PermutationCheckpoint(path):
+        res = testnd.ttest_ind('utsnd', 'A', 'a1', 'a0', ds=ds, pmin=0.05,
+                               samples=10)
+    assert_array_equal(res._cdist.dist[:5], res10_dist[:5] + 1000)
+    assert_array_equal(res._cdist.dist[5:], res10_dist[5:])
+    ok_(not os.path.exists(path))
+    # ... but not for a test with different parameters
+    for kwargs in ({'pmin': 0.1}, {'pmin': 0.05, 'tail': 1}, {'tfce': True}):
+        with open(path, 'wb') as fid:
+            pickle.dump(state, fid, pickle.HIGHEST_PROTOCOL)
+        res_ = testnd.ttest_ind('utsnd', 'A', 'a1', 'a0', ds=ds, samples=10,
+                                **kwargs)
+        with testnd.PermutationCheckpoint(path):
+            res = testnd.ttest_ind('utsnd', 'A', 'a1', 'a0', ds=ds, samples=10,
+                                   **kwargs)
+        assert_array_equal(res._cdist.dist, res_._cdist.dist)
+    # ... or a different permutation sequence
+    state['perm_digest'] = 'x'
+    with open(path, 'wb') as fid:
+        pickle.dump(state, fid, pickle.HIGHEST_PROTOCOL)
+    with testnd.PermutationCheckpoint(path):
+        res = testnd.ttest_ind('utsnd', 'A', 'a1', 'a0', ds=ds, pmin=0.05,
+                               samples=10)
+    assert_array_equal(res._cdist.dist, res10_dist)
+
 
 def test_t_contrast():
     ds = datasets.get_uts()
@@ -421,6 +569,16 @@ def test_labeling():
     assert_equal(len(cids), 6)
     assert_array_equal(cmap > 0, np.abs(pmap) > 2)
 
+    # cluster size criteria
+    for criteria in ([((1,), 2)], [((0,), 3)], [((1,), 2), ((0,), 2)]):
+        cmap, cids = label_clusters(pmap, 2, 0, conn, criteria)
+        target = [i for i in xrange(1, cmap.max() + 1) if
+                  all(np.count_nonzero((cmap == i).any(axes)) >= v for
+                      axes, v in criteria)]
+        assert_array_equal(cids, target)
+        ok_(0 < len(cids) < 6)
+    criteria = None
+
     # some other clusters
     pmap[:] = [[4, 4, 4, 4, 4, 4, 4, 4, 4, 4, 4, 4, 4, 4, 4, 4, 4, 4, 0, 0],
                [0, 4, 0, 0, 0, 0, 0, 4, 0, 4, 4, 4, 0, 0, 0, 0, 0, 0, 0, 0],
@@ -431,6 +589,31 @@ def test_labeling():
     assert_array_equal(cmap > 0, np.abs(pmap) > 2)
 
 
+def test_tfce():
+    "Test TFCE against labeling clusters at each height"
+    edges = np.array([(0, 1), (0, 3), (1, 2), (2, 3), (4, 5)], np.uint32)
+    dims = (Scalar('graph', range(6), connectivity=edges), UTS(0, 0.01, 30))
+    conn = Connectivity(dims)
+    conn_grid = Connectivity((Scalar('scalar', range(6)), dims[1]))
+    rng = np.random.RandomState(0)
+    stat_map = np.cumsum(rng.normal(0, 1, (6, 30)), 1)
+    for connectivity in (conn, conn_grid):
+        for tail in (0, 1, -1):
+            target = np.zeros(stat_map.shape)
+            hs = []
+            if tail >= 0:
+                hs.extend(np.arange(0.1, stat_map.max(), 0.1))
+            if tail <= 0:
+                hs.extend(np.arange(-0.1, stat_map.min(), -0.1))
+            for h in hs:
+                bin_map = stat_map >= h if h > 0 else stat_map <= h
+                cmap, cids = label_clusters_binary(bin_map, connectivity)
+                for cid in cids:
+                    index = cmap == cid
+                    target[index] += index.sum() ** 0.5 * abs(h) ** 2
+            assert_allclose(tfce(stat_map, tail, connectivity), target)
+
+
 def test_ttest_1samp():
     "Test testnd.ttest_1samp()"
     ds = datasets.get_uts(True)
@@ -533,6 +716,13 @@ def test_ttest_ind():
     res = testnd.ttest_ind('utsnd', 'A', 'a1', 'a0', ds=ds, pmin=0.05, samples=2)
     eq_(res._cdist.n_clusters, 10)
 
+    # batched permutations
+    res0 = testnd.ttest_ind('utsnd', 'A', 'a1', 'a0', ds=ds, pmin=0.05, samples=5)
+    configure(permutation_batch=2)
+    res_b = testnd.ttest_ind('utsnd', 'A', 'a1', 'a0', ds=ds, pmin=0.05, samples=5)
+    configure(permutation_batch=0)
+    assert_dataset_equal(res_b.clusters, res0.clusters)
+
     # zero variance
     ds['utsnd'].x[:, 1, 10] = 0.
     res_zv = testnd.ttest_ind('utsnd', 'A', 'a1', 'a0', ds=ds)
@@ -571,6 +761,11 @@ def test_ttest_rel():
                             ds=ds, samples=100)
     assert_dataset_equal(res4.find_clusters(maps=True), res.clusters)
     configure(n_workers=True)
+    configure(permutation_batch=16)
+    res5 = testnd.ttest_rel('uts', 'A%B', ('a1', 'b1'), ('a0', 'b0'), 'rm',
+                            ds=ds, samples=100)
+    assert_dataset_equal(res5.find_clusters(maps=True), res.clusters)
+    configure(permutation_batch=0)
     sds = ds.sub("B=='b0'")
     # thresholded, UTS
     configure(n_workers=0)
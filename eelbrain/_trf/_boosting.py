@@ -13,13 +13,17 @@ x2 = ds['x2']
 """
 from __future__ import division
 from inspect import getargspec
-from itertools import chain, izip, product
+from itertools import chain, izip
+import logging
 from math import floor
-from multiprocessing import Process, Queue
-from multiprocessing.sharedctypes import RawArray
+from multiprocessing import Process, Queue, Value
+import os
+from Queue import Empty
+import shutil
 import signal
+import tempfile
 import time
-from threading import Event, Thread
+import traceback
 
 import numpy as np
 from scipy.stats import spearmanr
@@ -27,24 +31,42 @@ from tqdm import tqdm
 
 from .._config import CONFIG
 from .._data_obj import NDVar, UTS, dataobj_repr
-from .._stats.error_functions import (l1, l2, l1_for_delta, l2_for_delta,
+from .._stats.error_functions import (l1, l2, l1_for_delta_grid, l2_xcorr,
                                       update_error)
 from .._utils import LazyProperty
+from .._utils.numpy_utils import convolve_kernels
+from .._utils.system import SHARED_DIR
 from .shared import RevCorrData
 
 
 # BoostingResult version
-VERSION = 6
+VERSION = 7
 
 # cross-validation
 N_SEGS = 10
 
+# maximum number of signals boosted together with batch=True
+BATCH_SIZE = 256
+# with batch=True, signals are boosted separately if the lagged predictors
+# would take up more than this many bytes
+BATCH_MAX_BYTES = 2 ** 28
+
+# reasons for stopping the boosting iteration
+STOP_MAXITER = 0
+STOP_TEST_ERROR = 1
+STOP_MINDELTA = 2
+STOP_OSCILLATION = 3
+STOP_REASONS = ('max iterations', 'test error', 'mindelta', 'oscillation')
+
 # process messages
-JOB_TERMINATE = -1
+JOB_TERMINATE = None
+# seconds between checks of the worker processes
+POLL_INTERVAL = 0.1
+# seconds to wait for workers to release shared data
+RELEASE_TIMEOUT = 10.
 
 # error functions
 ERROR_FUNC = {'l2': l2, 'l1': l1}
-DELTA_ERROR_FUNC = {'l2': l2_for_delta, 'l1': l1_for_delta}
 
 
 class BoostingResult(object):
@@ -86,10 +108,24 @@ class BoostingResult(object):
         Mean that was subtracted from ``x``.
     x_scale : NDVar | scalar | tuple
         Scale by which ``x`` was divided.
+    n_iter : array of int
+        Number of boosting iterations for each cross-validation segment, with
+        shape ``(n_segs,)`` for a single signal ``y``, and shape
+        ``(n_signals, n_segs)`` otherwise.
+    stop_reason : array of str
+        Reason why boosting stopped for each cross-validation segment
+        (shaped like ``n_iter``): ``'test error'`` (error in the test segment
+        increased), ``'mindelta'`` (the training error could not be reduced
+        with ``delta >= mindelta``) or ``'oscillation'`` (the kernel moved in
+        circles).
+    t_fit : array of float
+        Time for fitting each cross-validation segment, in seconds (shaped
+        like ``n_iter``; with ``batch=True``, the time for the whole batch).
     """
     def __init__(self, h, r, isnan, t_run, version, delta, mindelta, error,
                  spearmanr, fit_error, scale_data, y_mean, y_scale, x_mean,
-                 x_scale, y=None, x=None, tstart=None, tstop=None):
+                 x_scale, y=None, x=None, tstart=None, tstop=None,
+                 n_iter=None, stop_reason=None, t_fit=None):
         self.h = h
         self.r = r
         self.isnan = isnan
@@ -109,6 +145,9 @@ class BoostingResult(object):
         self.x = x
         self.tstart = tstart
         self.tstop = tstop
+        self.n_iter = n_iter
+        self.stop_reason = stop_reason
+        self.t_fit = t_fit
 
     def __getstate__(self):
         return {attr: getattr(self, attr) for attr in
@@ -127,7 +166,8 @@ class BoostingResult(object):
         argspec = getargspec(boosting)
         names = argspec.args[-len(argspec.defaults):]
         for name, default in izip(names, argspec.defaults):
-            value = getattr(self, name)
+            # options that don't affect the result are not stored
+            value = getattr(self, name, default)
             if value != default:
                 items.append('%s=%r' % (name, value))
         return '<%s>' % ', '.join(items)
@@ -166,10 +206,15 @@ class BoostingResult(object):
             x = getattr(self, attr)
             if x is not None:
                 setattr(self, attr, sub(x))
+        # fit information arrays (n_sources, n_segs)
+        for attr in ('n_iter', 'stop_reason', 't_fit'):
+            x = getattr(self, attr)
+            if x is not None:
+                setattr(self, attr, x[index])
 
 
 def boosting(y, x, tstart, tstop, scale_data=True, delta=0.005, mindelta=None,
-             error='l2'):
+             error='l2', batch=False):
     """Estimate a temporal response function through boosting
 
     Parameters
@@ -197,6 +242,15 @@ def boosting(y, x, tstart, tstop, scale_data=True, delta=0.005, mindelta=None,
         i.e. ``delta`` is constant.
     error : 'l2' | 'l1'
         Error function to use (default is ``l2``).
+    batch : bool
+        Boost multiple signals in ``y`` together (only with ``error='l2'``).
+        Computations that depend only on ``x`` are shared across signals, and
+        each boosting iteration is evaluated for all signals with a single
+        matrix multiplication, which is much faster when ``y`` contains many
+        signals (e.g., source space data). Results are equivalent to boosting
+        signals separately up to floating point rounding. Batch boosting holds
+        all time-shifted copies of ``x`` in memory; if these would exceed
+        256 MB, signals are boosted separately.
 
     Returns
     -------
@@ -217,6 +271,9 @@ def boosting(y, x, tstart, tstop, scale_data=True, delta=0.005, mindelta=None,
     """
     # check arguments
     mindelta_ = delta if mindelta is None else mindelta
+    if batch and error != 'l2':
+        raise ValueError("batch=True requires error='l2', got error=%r" %
+                         (error,))
 
     data = RevCorrData(y, x, error, scale_data)
     y_data = data.y
@@ -238,61 +295,28 @@ def boosting(y, x, tstart, tstop, scale_data=True, delta=0.005, mindelta=None,
 
     # progress bar
     pbar = tqdm(desc="Boosting %i signals" % n_y if n_y > 1 else "Boosting",
-                total=n_y * 10)
-    # result containers
-    res = np.empty((3, n_y))  # r, rank-r, error
-    h_x = np.empty((n_y, n_x, trf_length))
+                total=n_y * N_SEGS)
     # boosting
     if CONFIG['n_workers']:
-        # Make sure cross-validations are added in the same order, otherwise
-        # slight numerical differences can occur
-        job_queue, result_queue = setup_workers(
-            y_data, x_data, trf_length, delta, mindelta_, N_SEGS, error)
-        stop_jobs = Event()
-        thread = Thread(target=put_jobs, args=(job_queue, n_y, N_SEGS, stop_jobs))
-        thread.daemon = True
-        thread.start()
-
-        # collect results
-        try:
-            h_segs = {}
-            for _ in xrange(n_y * N_SEGS):
-                y_i, seg_i, h = result_queue.get()
-                pbar.update()
-                if y_i in h_segs:
-                    h_seg = h_segs[y_i]
-                    h_seg[seg_i] = h
-                    if len(h_seg) == N_SEGS:
-                        del h_segs[y_i]
-                        hs = [h for h in (h_seg[i] for i in xrange(N_SEGS)) if
-                              h is not None]
-                        if hs:
-                            h = np.mean(hs, 0, out=h_x[y_i])
-                            res[:, y_i] = evaluate_kernel(y_data[y_i], x_data, h, error)
-                        else:
-                            h_x[y_i] = 0
-                            res[:, y_i] = 0.
-                else:
-                    h_segs[y_i] = {seg_i: h}
-        except KeyboardInterrupt:
-            stop_jobs.set()
-            raise
+        pool = get_pool()
+        res, h_x, fit_info = pool.boost(y_data, x_data, trf_length, delta,
+                                        mindelta_, error, batch, pbar)
     else:
-        for y_i, y_ in enumerate(y_data):
-            hs = []
-            for i in xrange(N_SEGS):
-                h = boost_1seg(x_data, y_, trf_length, delta, N_SEGS, i,
-                               mindelta_, error)
-                if h is not None:
-                    hs.append(h)
-                pbar.update()
-
-            if hs:
-                h = np.mean(hs, 0, out=h_x[y_i])
-                res[:, y_i] = evaluate_kernel(y_, x_data, h, error)
-            else:
-                h_x[y_i].fill(0)
-                res[:, y_i].fill(0.)
+        # result containers
+        res = np.empty((3, n_y))  # r, rank-r, error
+        h_x = np.empty((n_y, n_x, trf_length))
+        fit_info = np.empty((n_y, N_SEGS, 3))
+        if batch:
+            for start in xrange(0, n_y, BATCH_SIZE):
+                index = slice(start, start + BATCH_SIZE)
+                res[:, index] = boost_batch(y_data[index], x_data, trf_length,
+                                            delta, mindelta_, h_x[index],
+                                            fit_info[index], pbar)
+        else:
+            for y_i, y_ in enumerate(y_data):
+                res[:, y_i] = boost_signal(y_, x_data, trf_length, delta,
+                                           mindelta_, error, h_x[y_i],
+                                           fit_info[y_i], pbar)
 
     pbar.close()
     dt = time.time() - pbar.start_t
@@ -307,14 +331,123 @@ def boosting(y, x, tstart, tstop, scale_data=True, delta=0.005, mindelta=None,
 
     y_mean, y_scale, x_mean, x_scale = data.data_scale_ndvars()
 
+    # fit information
+    if data.ydim is None:
+        fit_info = fit_info[0]
+    n_iter = fit_info[..., 0].astype(int)
+    stop_reason = np.take(STOP_REASONS, fit_info[..., 1].astype(int))
+    t_fit = fit_info[..., 2]
+
     return BoostingResult(data.package_kernel(h_x, tstart), r, isnan, dt, VERSION,
                           delta, mindelta, error, rr, err,
                           scale_data, y_mean, y_scale, x_mean, x_scale,
-                          data.y_name, data.x_name, tstart, tstop)
+                          data.y_name, data.x_name, tstart, tstop,
+                          n_iter, stop_reason, t_fit)
+
+
+def boost_signal(y, x, trf_length, delta, mindelta, error, out, fit_info,
+                 pbar=None):
+    """Boost all cross-validation segments for one signal
+
+    Parameters
+    ----------
+    y : array (n_times,)
+        Dependent signal.
+    x : array (n_stims, n_times)
+        Stimulus.
+    ...
+    out : array (n_stims, trf_length)
+        Container for the kernel (average of the kernels from all
+        cross-validation segments).
+    fit_info : array (n_segs, 3)
+        Container for the number of iterations, the reason for stopping and
+        the time for each cross-validation segment.
+    pbar : tqdm
+        Progress bar to update after each segment.
+
+    Returns
+    -------
+    r, rank_r, error : float
+        Fit quality statistics (see :func:`evaluate_kernel`).
+    """
+    buffers = (np.empty(out.shape), np.empty(out.shape))
+    hs = []
+    info = {}
+    for i in xrange(N_SEGS):
+        t0 = time.time()
+        h = boost_1seg(x, y, trf_length, delta, N_SEGS, i, mindelta, error,
+                       buffers=buffers, info=info)
+        fit_info[i] = (info['n_iter'], info['stop'], time.time() - t0)
+        if h is not None:
+            hs.append(h)
+        if pbar is not None:
+            pbar.update()
+
+    if hs:
+        h = np.mean(hs, 0, out=out)
+        return evaluate_kernel(y, x, h, error)
+    else:
+        out.fill(0)
+        return 0., 0., 0.
+
+
+def boost_batch(y, x, trf_length, delta, mindelta, out, fit_info, pbar=None):
+    """Boost all cross-validation segments for multiple signals together
+
+    Parameters
+    ----------
+    y : array (n_y, n_times)
+        Dependent signals.
+    x : array (n_stims, n_times)
+        Stimulus.
+    ...
+    out : array (n_y, n_stims, trf_length)
+        Container for the kernels.
+    fit_info : array (n_y, n_segs, 3)
+        Container for fit information (see :func:`boost_signal`; the time
+        applies to the whole batch).
+    pbar : tqdm
+        Progress bar to update after each segment.
+
+    Returns
+    -------
+    res : array (3, n_y)
+        Fit quality statistics (see :func:`evaluate_kernel`) for each signal.
+    """
+    n_y = len(y)
+    n_stims, n_times = x.shape
+    if n_stims * trf_length * n_times * 8 > BATCH_MAX_BYTES:
+        # lagged predictors would not fit in memory
+        res = np.empty((3, n_y))
+        for y_i in xrange(n_y):
+            res[:, y_i] = boost_signal(y[y_i], x, trf_length, delta, mindelta,
+                                       'l2', out[y_i], fit_info[y_i], pbar)
+        return res
+
+    out.fill(0)
+    n_hs = np.zeros(n_y, int)
+    info = {}
+    for i in xrange(N_SEGS):
+        t0 = time.time()
+        h, has_h = boost_1seg(x, y, trf_length, delta, N_SEGS, i, mindelta,
+                              'l2', info=info)
+        fit_info[:, i, 0] = info['n_iter']
+        fit_info[:, i, 1] = info['stop']
+        fit_info[:, i, 2] = time.time() - t0
+        out[has_h] += h[has_h]
+        n_hs += has_h
+        if pbar is not None:
+            pbar.update(n_y)
+
+    res = np.zeros((3, n_y))
+    for y_i in np.flatnonzero(n_hs):
+        out[y_i] /= n_hs[y_i]
+        res[:, y_i] = evaluate_kernel(y[y_i], x, out[y_i], 'l2')
+    return res
 
 
 def boost_1seg(x, y, trf_length, delta, nsegs, segno, mindelta, error,
-               return_history=False):
+               return_history=False, buffers=None, info=None):
     """Boosting with one test segment determined by regular division
 
     Based on port of svdboostV4pred
@@ -323,8 +456,9 @@ def boost_1seg(x, y, trf_length, delta, nsegs, segno, mindelta, error,
     ----------
     x : array (n_stims, n_times)
         Stimulus.
-    y : array (n_times,)
-        Dependent signal, time series to predict.
+    y : array ([n_y,] n_times)
+        Dependent signal, time series to predict. If ``y`` is two-dimensional,
+        signals are boosted together with :func:`boost_segs_batch`.
     trf_length : int
         Length of the TRF (in time samples).
     delta : scalar
@@ -341,6 +475,10 @@ def boost_1seg(x, y, trf_length, delta, nsegs, segno, mindelta, error,
         Error function to use.
     return_history : bool
         Return error history as second return value.
+    buffers : tuple of array
+        Buffers for :func:`boost_segs`.
+    info : dict
+        Store fit information (see :func:`boost_segs`).
 
     Returns
     -------
@@ -350,7 +488,7 @@ def boost_1seg(x, y, trf_length, delta, nsegs, segno, mindelta, error,
         SSE for test data at each iteration.
     """
     assert x.ndim == 2
-    assert y.shape == (x.shape[1],)
+    assert y.shape[-1] == x.shape[1]
 
     # separate training and testing signal
     test_seg_len = int(floor(x.shape[1] / nsegs))
@@ -370,12 +508,19 @@ def boost_1seg(x, y, trf_length, delta, nsegs, segno, mindelta, error,
     x_train = tuple(x[:, i] for i in train_index)
     x_test = (x[:, test_index],)
 
+    if y.ndim == 2:
+        if error != 'l2' or return_history:
+            raise NotImplementedError("Batch boosting with error=%r, "
+                                      "return_history=%r" %
+                                      (error, return_history))
+        return boost_segs_batch(y_train, y_test, x_train, x_test, trf_length,
+                                delta, mindelta, info)
     return boost_segs(y_train, y_test, x_train, x_test, trf_length, delta,
-                      mindelta, error, return_history)
+                      mindelta, error, return_history, buffers, info)
 
 
 def boost_segs(y_train, y_test, x_train, x_test, trf_length, delta, mindelta,
-               error, return_history):
+               error, return_history, buffers=None, info=None):
     """Boosting supporting multiple array segments
 
     Parameters
@@ -396,6 +541,12 @@ def boost_segs(y_train, y_test, x_train, x_test, trf_length, delta, mindelta,
         Error function to use.
     return_history : bool
         Return error history as second return value.
+    buffers : tuple of array
+        Two float buffers with shape ``(n_stims, trf_length)`` (to reuse them
+        across segments).
+    info : dict
+        If provided, store the number of iterations (``'n_iter'``) and the
+        reason for stopping (``'stop'``, one of the ``STOP_*`` constants).
 
     Returns
     -------
@@ -404,7 +555,7 @@ def boost_segs(y_train, y_test, x_train, x_test, trf_length, delta, mindelta,
     test_sse_history : list (only if ``return_history==True``)
         SSE for test data at each iteration.
     """
-    delta_error = DELTA_ERROR_FUNC[error]
+    error_name = error
     error = ERROR_FUNC[error]
     n_stims = len(x_train[0])
     if any(len(x) != n_stims for x in chain(x_train, x_test)):
@@ -422,24 +573,39 @@ def boost_segs(y_train, y_test, x_train, x_test, trf_length, delta, mindelta,
     ys_error = y_train_error + y_test_error
     xs = x_train + x_test
 
-    new_error = np.empty(h.shape)
-    new_sign = np.empty(h.shape, np.int8)
-
-    # history lists
-    history = []
+    if buffers is None:
+        new_error = np.empty(h.shape)
+        buf = np.empty(h.shape)
+    else:
+        new_error, buf = buffers
+
+    if error_name == 'l2':
+        # sum of x**2 for each shift (closed form change in l2 error)
+        x_ss = np.zeros(h.shape)
+        for x in x_train:
+            n = min(trf_length, x.shape[1])
+            x_ss[:, :n] += np.cumsum(x ** 2, 1)[:, :-n - 1:-1]
+
+    # best kernel and test error history
+    best_h = None
+    best_error = np.inf
     test_error_history = []
+    # steps in the two previous iterations (index and value before step)
+    step_1 = step_2 = None
+    h_old_1 = h_old_2 = None
+    stop_reason = STOP_MAXITER
     # pre-assign iterators
-    iter_h = tuple(product(xrange(h.shape[0]), xrange(h.shape[1])))
     iter_train_error = zip(y_train_error, x_train)
     iter_error = zip(ys_error, xs)
     for i_boost in xrange(999999):
-        history.append(h.copy())
-
         # evaluate current h
         e_test = sum(error(y) for y in y_test_error)
         e_train = sum(error(y) for y in y_train_error)
 
         test_error_history.append(e_test)
+        if e_test < best_error:
+            best_error = e_test
+            best_h = h.copy() if i_boost else None
 
         # stop the iteration if all the following requirements are met
         # 1. more than 10 iterations are done
@@ -447,130 +613,436 @@ def boost_segs(y_train, y_test, x_train, x_test, trf_length, delta, mindelta,
         #    the previous two iterations
         if (i_boost > 10 and e_test > test_error_history[-2] and
                 e_test > test_error_history[-3]):
-            # print("error(test) not improving in 2 steps")
+            stop_reason = STOP_TEST_ERROR
             break
 
         # generate possible movements -> training error
-        for i_stim, i_time in iter_h:
-            # +/- delta
-            e_add = e_sub = 0.
+        buf.fill(0)
+        if error_name == 'l2':
+            # e(h +/- delta) = e(h) -/+ 2 * delta * xcorr + delta**2 * x_ss
             for y_err, x in iter_train_error:
-                e_add_, e_sub_ = delta_error(y_err, x[i_stim], delta, i_time)
-                e_add += e_add_
-                e_sub += e_sub_
-
-            if e_add > e_sub:
-                new_error[i_stim, i_time] = e_sub
-                new_sign[i_stim, i_time] = -1
-            else:
-                new_error[i_stim, i_time] = e_add
-                new_sign[i_stim, i_time] = 1
+                l2_xcorr(y_err, x, buf)
+            np.abs(buf, new_error)
+            new_error *= -2 * delta
+            new_error += x_ss * delta ** 2
+            new_error += e_train
+        else:
+            # new_error: e(h + delta); buf: e(h - delta)
+            new_error.fill(0)
+            for y_err, x in iter_train_error:
+                l1_for_delta_grid(y_err, x, delta, new_error, buf)
+            sub_is_better = new_error > buf
+            np.minimum(new_error, buf, new_error)
 
         i_stim, i_time = np.unravel_index(np.argmin(new_error), h.shape)
         new_train_error = new_error[i_stim, i_time]
-        delta_signed = new_sign[i_stim, i_time] * delta
+        if error_name == 'l2':
+            delta_signed = delta if buf[i_stim, i_time] >= 0 else -delta
+        else:
+            delta_signed = -delta if sub_is_better[i_stim, i_time] else delta
 
         # If no improvements can be found reduce delta
         if new_train_error > e_train:
             delta *= 0.5
             if delta >= mindelta:
-                # print("new delta: %s" % delta)
+                step_2, h_old_2 = step_1, h_old_1
+                step_1 = None
                 continue
             else:
-                # print("No improvement possible for training data")
+                stop_reason = STOP_MINDELTA
                 break
 
         # update h with best movement
-        h[i_stim, i_time] += delta_signed
-
-        # abort if we're moving in circles
-        if i_boost >= 2 and h[i_stim, i_time] == history[-2][i_stim, i_time]:
-            # print("Same h after 2 iterations")
-            break
-        elif i_boost >= 3 and h[i_stim, i_time] == history[-3][i_stim, i_time]:
-            # print("Same h after 3 iterations")
+        step = (i_stim, i_time)
+        h_old = h[step]
+        h[step] += delta_signed
+
+        # abort if we're moving in circles (compare with h in the previous two
+        # iterations)
+        h_prev_2 = h_old_1 if step == step_1 else h_old
+        h_prev_3 = h_old_2 if step == step_2 else h_prev_2
+        if (i_boost >= 2 and h[step] == h_prev_2) or \
+                (i_boost >= 3 and h[step] == h_prev_3):
+            stop_reason = STOP_OSCILLATION
             break
+        step_2, h_old_2 = step_1, h_old_1
+        step_1, h_old_1 = step, h_old
 
         # update error
         for err, x in iter_error:
             update_error(err, x[i_stim], delta_signed, i_time)
-    # else:
-    #     print("maxiter exceeded")
 
-    best_iter = np.argmin(test_error_history)
-    # print('  (%i iterations)' % (i_boost + 1))
+    if info is not None:
+        info['n_iter'] = i_boost + 1
+        info['stop'] = stop_reason
 
     if return_history:
-        return history[best_iter] if best_iter else None, test_error_history
+        return best_h, test_error_history
     else:
-        return history[best_iter] if best_iter else None
+        return best_h
 
 
-def setup_workers(y, x, trf_length, delta, mindelta, nsegs, error):
-    n_y, n_times = y.shape
-    n_x, _ = x.shape
+def lagged_predictors(x, trf_length):
+    """Stack shifted copies of the predictors
 
-    y_buffer = RawArray('d', n_y * n_times)
-    y_buffer[:] = y.ravel()
-    x_buffer = RawArray('d', n_x * n_times)
-    x_buffer[:] = x.ravel()
+    Returns
+    -------
+    x_lags : array (n_stims * trf_length, n_times)
+        ``x_lags[i_stim * trf_length + shift, i] == x[i_stim, i - shift]``
+        (0 for ``i < shift``).
+    """
+    n_stims, n_times = x.shape
+    out = np.zeros((n_stims, trf_length, n_times))
+    for shift in xrange(min(trf_length, n_times)):
+        out[:, shift, shift:] = x[:, :n_times - shift]
+    return out.reshape((n_stims * trf_length, n_times))
 
-    job_queue = Queue(200)
-    result_queue = Queue(200)
 
-    args = (y_buffer, x_buffer, n_y, n_times, n_x, trf_length, delta,
-            mindelta, nsegs, error, job_queue, result_queue)
-    for _ in xrange(CONFIG['n_workers']):
-        process = Process(target=boosting_worker, args=args)
-        process.daemon = True
-        process.start()
+def boost_segs_batch(y_train, y_test, x_train, x_test, trf_length, delta,
+                     mindelta, info=None):
+    """l2-boosting of multiple signals at once
 
-    return job_queue, result_queue
+    Implements the same algorithm as :func:`boost_segs`, but the change in
+    error for each possible step is evaluated for all signals with a single
+    matrix multiplication per iteration.
 
+    Parameters
+    ----------
+    y_train, y_test : tuple of array (n_y, n_times)
+        Dependent signals.
+    x_train, x_test : tuple of array (n_stims, n_times)
+        Stimulus.
+    ...
+    info : dict
+        Store fit information for each signal (see :func:`boost_segs`).
 
-def boosting_worker(y_buffer, x_buffer, n_y, n_times, n_x, trf_length,
-                    delta, mindelta, nsegs, error, job_queue, result_queue):
-    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    Returns
+    -------
+    h : array (n_y, n_stims, trf_length)
+        Winning kernel for each signal.
+    has_h : array of bool (n_y,)
+        False for signals for which 0 is the best kernel.
+    """
+    n_y = len(y_train[0])
+    n_stims = len(x_train[0])
+    if any(len(x) != n_stims for x in chain(x_train, x_test)):
+        raise ValueError("Not all x have same number of stimuli")
+    n_h = n_stims * trf_length
+
+    # predictors shared by all signals
+    x_train_lags = tuple(lagged_predictors(x, trf_length) for x in x_train)
+    x_test_lags = tuple(lagged_predictors(x, trf_length) for x in x_test)
+    x_ss = sum(np.einsum('ij,ij->i', x, x) for x in x_train_lags)
+    xs_lags = x_train_lags + x_test_lags
+
+    # output
+    h_out = np.zeros((n_y, n_h))
+    has_h = np.zeros(n_y, bool)
+    n_iter = np.zeros(n_y, int)
+    stop_reason = np.full(n_y, STOP_MAXITER, int)
+
+    # state of active signals
+    signals = np.arange(n_y)
+    ys_error = tuple(y.copy() for y in chain(y_train, y_test))
+    y_train_error = ys_error[:len(y_train)]
+    y_test_error = ys_error[len(y_train):]
+    h = np.zeros((n_y, n_h))
+    deltas = np.full(n_y, delta, np.float64)
+    best_h = np.zeros((n_y, n_h))
+    best_error = np.full(n_y, np.inf)
+    best_iter = np.zeros(n_y, int)
+    test_error_1 = np.zeros(n_y)  # test error in the two previous iterations
+    test_error_2 = np.zeros(n_y)
+    # steps in the two previous iterations (index and value before step)
+    step_1 = np.full(n_y, -1, int)
+    step_2 = np.full(n_y, -1, int)
+    h_old_1 = np.zeros(n_y)
+    h_old_2 = np.zeros(n_y)
+    for i_boost in xrange(999999):
+        # evaluate current h
+        e_test = sum(np.einsum('ij,ij->i', y, y) for y in y_test_error)
+        e_train = sum(np.einsum('ij,ij->i', y, y) for y in y_train_error)
+        is_best = e_test < best_error
+        best_error[is_best] = e_test[is_best]
+        best_iter[is_best] = i_boost
+        best_h[is_best] = h[is_best]
+
+        # stop if the test error is higher than in the previous two iterations
+        if i_boost > 10:
+            stop = (e_test > test_error_1) & (e_test > test_error_2)
+        else:
+            stop = np.zeros(len(signals), bool)
+        test_error_2, test_error_1 = test_error_1, e_test
+        reason = np.where(stop, STOP_TEST_ERROR, STOP_MAXITER)
 
-    y = np.frombuffer(y_buffer, np.float64, n_y * n_times).reshape((n_y, n_times))
-    x = np.frombuffer(x_buffer, np.float64, n_x * n_times).reshape((n_x, n_times))
+        # generate possible movements -> training error
+        xcorr = sum(np.dot(y, x.T) for y, x in izip(y_train_error, x_train_lags))
+        new_error = np.abs(xcorr)
+        new_error *= -2 * deltas[:, None]
+        new_error += x_ss * (deltas ** 2)[:, None]
+        new_error += e_train[:, None]
+        i_h = np.argmin(new_error, 1)
+        rows = np.arange(len(signals))
+        new_train_error = new_error[rows, i_h]
+        delta_signed = np.where(xcorr[rows, i_h] >= 0, deltas, -deltas)
+
+        # if no improvements can be found reduce delta
+        no_improvement = new_train_error > e_train
+        deltas[no_improvement] *= 0.5
+        stop_mindelta = no_improvement & (deltas < mindelta) & ~stop
+        reason[stop_mindelta] = STOP_MINDELTA
+        stop |= stop_mindelta
 
+        # update h with best movement
+        h_old = h[rows, i_h]
+        h_new = h_old + delta_signed
+        # abort if we're moving in circles
+        if i_boost >= 2:
+            h_prev_2 = np.where(step_1 == i_h, h_old_1, h_old)
+            circle = h_new == h_prev_2
+            if i_boost >= 3:
+                h_prev_3 = np.where(step_2 == i_h, h_old_2, h_prev_2)
+                circle |= h_new == h_prev_3
+            circle &= ~(no_improvement | stop)
+            reason[circle] = STOP_OSCILLATION
+            stop |= circle
+        step = ~(no_improvement | stop)
+        h[rows[step], i_h[step]] = h_new[step]
+        step_2 = step_1
+        step_1 = np.where(step, i_h, -1)
+        h_old_2 = h_old_1
+        h_old_1 = h_old
+
+        # update error
+        for y, x in izip(ys_error, xs_lags):
+            y[step] -= delta_signed[step, None] * x[i_h[step]]
+
+        # retire signals that stopped
+        if np.any(stop):
+            index = signals[stop]
+            h_out[index] = best_h[stop]
+            has_h[index] = best_iter[stop] > 0
+            n_iter[index] = i_boost + 1
+            stop_reason[index] = reason[stop]
+            keep = ~stop
+            if not np.any(keep):
+                break
+            signals = signals[keep]
+            ys_error = tuple(y[keep] for y in ys_error)
+            y_train_error = ys_error[:len(y_train)]
+            y_test_error = ys_error[len(y_train):]
+            h, deltas, best_h, best_error, best_iter = \
+                (a[keep] for a in (h, deltas, best_h, best_error, best_iter))
+            test_error_1, test_error_2, step_1, step_2, h_old_1, h_old_2 = \
+                (a[keep] for a in (test_error_1, test_error_2, step_1, step_2,
+                                   h_old_1, h_old_2))
+
+    if info is not None:
+        info['n_iter'] = n_iter
+        info['stop'] = stop_reason
+    return h_out.reshape((n_y, n_stims, trf_length)), has_h
+
+
+class BoostingPool(object):
+    """Persistent pool of boosting worker processes
+
+    Data are shared with the workers through memory-mapped files. Each job
+    consists of all cross-validation segments of one signal (or of a batch of
+    signals with ``batch=True``), and workers write the kernel and fit
+    statistics directly into the shared result arrays.
+    """
+    def __init__(self, n_workers):
+        self.n_workers = n_workers
+        self._job_queue = Queue()
+        self._result_queue = Queue()
+        self._active_task = Value('l', -1, lock=False)
+        # number of workers with shared data mapped (its lock also guards
+        # _active_task)
+        self._n_mapped = Value('l', 0)
+        self._task_id = 0
+        self._processes = []
+        args = (self._job_queue, self._result_queue, self._active_task,
+                self._n_mapped)
+        for _ in xrange(n_workers):
+            process = Process(target=boosting_worker, args=args)
+            process.daemon = True
+            process.start()
+            self._processes.append(process)
+
+    def is_alive(self):
+        return all(p.is_alive() for p in self._processes)
+
+    def close(self):
+        for _ in self._processes:
+            self._job_queue.put(JOB_TERMINATE)
+        for process in self._processes:
+            process.join()
+
+    def boost(self, y, x, trf_length, delta, mindelta, error, batch, pbar):
+        """Boost each signal in y
+
+        Returns
+        -------
+        res : array (3, n_y)
+            Fit quality statistics (r, rank-r, error) for each signal.
+        h_x : array (n_y, n_x, trf_length)
+            Kernels.
+        fit_info : array (n_y, n_segs, 3)
+            Fit information (see :func:`boost_signal`).
+        """
+        n_y = len(y)
+        n_x = len(x)
+        self._task_id += 1
+        task_id = self._task_id
+        tempdir = tempfile.mkdtemp(dir=SHARED_DIR)
+        try:
+            # shared data
+            for name, data in (('y', y), ('x', x)):
+                array = np.lib.format.open_memmap(
+                    os.path.join(tempdir, name + '.npy'), 'w+', np.float64,
+                    data.shape)
+                array[:] = data
+                del array
+            res = np.lib.format.open_memmap(
+                os.path.join(tempdir, 'res.npy'), 'w+', np.float64, (3, n_y))
+            h_x = np.lib.format.open_memmap(
+                os.path.join(tempdir, 'h.npy'), 'w+', np.float64,
+                (n_y, n_x, trf_length))
+            fit_info = np.lib.format.open_memmap(
+                os.path.join(tempdir, 'info.npy'), 'w+', np.float64,
+                (n_y, N_SEGS, 3))
+
+            # submit jobs
+            task = (task_id, tempdir, trf_length, delta, mindelta, error, batch)
+            if batch:
+                n_jobs = self.n_workers * 4
+                batch_size = min(-(-n_y // n_jobs), BATCH_SIZE)
+            else:
+                batch_size = 1
+            self._active_task.value = task_id
+            for start in xrange(0, n_y, batch_size):
+                self._job_queue.put((task, start, min(start + batch_size, n_y)))
+
+            # collect results
+            try:
+                n_done = 0
+                while n_done < n_y:
+                    try:
+                        result = self._result_queue.get(True, POLL_INTERVAL)
+                    except Empty:
+                        if not self.is_alive():
+                            raise RuntimeError("Boosting worker process "
+                                               "terminated unexpectedly")
+                        continue
+                    result_task_id, n, err = result
+                    if result_task_id != task_id:
+                        continue
+                    elif err is not None:
+                        raise RuntimeError("Error in boosting worker:\n" + err)
+                    n_done += n
+                    pbar.update(n * N_SEGS)
+            finally:
+                # skip remaining jobs and let workers release shared data
+                with self._n_mapped.get_lock():
+                    self._active_task.value = -1
+            return np.array(res), np.array(h_x), np.array(fit_info)
+        finally:
+            res = h_x = fit_info = None
+            self._remove_shared(tempdir)
+
+    def _remove_shared(self, tempdir):
+        "Remove shared data once workers have released it"
+        t_stop = time.time() + RELEASE_TIMEOUT
+        while self._n_mapped.value and time.time() < t_stop:
+            if not self.is_alive():
+                break
+            time.sleep(POLL_INTERVAL / 10)
+        logger = logging.getLogger(__name__)
+        if self._n_mapped.value:
+            logger.warning("Boosting workers did not release shared data")
+        try:
+            shutil.rmtree(tempdir)
+        except OSError as error:
+            logger.warning("Could not remove boosting data in %s: %s",
+                           tempdir, error)
+
+
+_POOL = None
+
+
+def get_pool():
+    "Persistent boosting pool with ``CONFIG['n_workers']`` workers"
+    global _POOL
+    n_workers = CONFIG['n_workers']
+    if _POOL is None or _POOL.n_workers != n_workers or not _POOL.is_alive():
+        if _POOL is not None:
+            logging.getLogger(__name__).debug("Restarting boosting pool")
+            _POOL.close()
+        _POOL = BoostingPool(n_workers)
+    return _POOL
+
+
+def boosting_worker(job_queue, result_queue, active_task, n_mapped):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    task_id = y = x = res = h_x = fit_info = None
     while True:
-        y_i, seg_i = job_queue.get()
-        if y_i == JOB_TERMINATE:
+        try:
+            job = job_queue.get(True, POLL_INTERVAL)
+        except Empty:
+            job = False
+        # release shared data when the task ended
+        if task_id is not None and (job is JOB_TERMINATE or
+                                    task_id != active_task.value):
+            task_id = y = x = res = h_x = fit_info = None
+            with n_mapped.get_lock():
+                n_mapped.value -= 1
+        if job is JOB_TERMINATE:
             return
-        h = boost_1seg(x, y[y_i], trf_length, delta, nsegs, seg_i, mindelta,
-                       error)
-        result_queue.put((y_i, seg_i, h))
-
-
-def put_jobs(queue, n_y, n_segs, stop):
-    "Feed boosting jobs into a Queue"
-    for job in product(xrange(n_y), xrange(n_segs)):
-        queue.put(job)
-        if stop.isSet():
-            while not queue.empty():
-                queue.get()
-            break
-    for _ in xrange(CONFIG['n_workers']):
-        queue.put((JOB_TERMINATE, None))
+        elif job is False:
+            continue
+        task, start, stop = job
+        if task[0] != task_id:
+            with n_mapped.get_lock():
+                if task[0] != active_task.value:
+                    continue
+                n_mapped.value += 1
+            task_id, tempdir, trf_length, delta, mindelta, error, batch = task
+            y, x, res, h_x, fit_info = (
+                np.load(os.path.join(tempdir, name + '.npy'), mmap_mode)
+                for name, mmap_mode in
+                (('y', 'r'), ('x', 'r'), ('res', 'r+'), ('h', 'r+'),
+                 ('info', 'r+')))
+        try:
+            if batch:
+                index = slice(start, stop)
+                res[:, index] = boost_batch(y[index], x, trf_length, delta,
+                                            mindelta, h_x[index],
+                                            fit_info[index])
+            else:
+                for y_i in xrange(start, stop):
+                    res[:, y_i] = boost_signal(y[y_i], x, trf_length, delta,
+                                               mindelta, error, h_x[y_i],
+                                               fit_info[y_i])
+        except Exception:
+            result_queue.put((task_id, stop - start, traceback.format_exc()))
+        else:
+            result_queue.put((task_id, stop - start, None))
 
 
 def apply_kernel(x, h, out=None):
     """Predict ``y`` by applying kernel ``h`` to ``x``
 
     x.shape is (n_stims, n_samples)
-    h.shape is (n_stims, n_trf_samples)
+    h.shape is (n_stims, n_trf_samples), or (n_y, n_stims, n_trf_samples) to
+    predict several signals at once
+    out.shape is (n_samples,), or (n_y, n_samples) for 3d ``h``
     """
-    if out is None:
-        out = np.zeros(x.shape[1])
-    else:
-        out.fill(0)
-
-    for ind in xrange(len(h)):
-        out += np.convolve(h[ind], x[ind])[:len(out)]
-
-    return out
+    if h.ndim == 2:
+        if out is None:
+            out = np.empty(x.shape[1])
+        convolve_kernels(h[np.newaxis], x, out[np.newaxis])
+        return out
+    return convolve_kernels(h, x, out)
 
 
 def evaluate_kernel(y, x, h, error):
@@ -1,4 +1,5 @@
 # Author: Christian Brodbeck <christianbrodbeck@nyu.edu>
+from itertools import izip
 from math import floor
 import os
 
@@ -7,9 +8,13 @@ import numpy as np
 from numpy.testing import assert_array_equal, assert_allclose
 import cPickle as pickle
 import scipy.io
-from eelbrain import boosting, convolve, configure, datasets
+from tqdm import tqdm
+from eelbrain import (
+    NDVar, Factor, Scalar, UTS, boosting, convolve, configure, datasets)
+from eelbrain._data_obj import SourceSpace
+from eelbrain._trf import _boosting
 from eelbrain._trf._boosting import boost_1seg, evaluate_kernel
-from eelbrain._utils.testing import assert_dataobj_equal
+from eelbrain._utils.testing import TempDir, assert_dataobj_equal
 
 
 def assert_res_equal(res1, res):
@@ -72,6 +77,76 @@ def test_boosting():
     yield run_boosting, ds
 
 
+def test_boosting_pool():
+    "Test boosting multiple signals with the persistent worker pool"
+    ds = datasets._get_continuous()
+    y = ds['x2'].copy('y')
+    x = ds['x1']
+
+    configure(n_workers=0)
+    res = boosting(y, x, 0, 1)
+    configure(n_workers=2)
+    try:
+        res_mp = boosting(y, x, 0, 1)
+        assert_res_equal(res_mp, res)
+        pool = _boosting._POOL
+        pids = [p.pid for p in pool._processes]
+        # pool is reused across calls
+        res_mp = boosting(y, x, 0, 1)
+        assert_res_equal(res_mp, res)
+        assert _boosting._POOL is pool
+        eq_([p.pid for p in _boosting._POOL._processes], pids)
+        # workers released the shared data
+        eq_(pool._n_mapped.value, 0)
+        # dead workers raise an error instead of blocking
+        for process in pool._processes:
+            process.terminate()
+            process.join()
+        assert_raises(RuntimeError, pool.boost, y.x[None], x.x[None], 10, 0.1,
+                      0.01, 'l2', False, tqdm(disable=True))
+        res_mp = boosting(y, x, 0, 1)
+        assert_res_equal(res_mp, res)
+    finally:
+        configure(n_workers=True)
+
+
+def test_boosting_batch():
+    "Test boosting multiple signals together"
+    ds = datasets._get_continuous()
+    y = ds['y']
+    noise = np.random.RandomState(0).normal(0, y.std(), (5,) + y.shape)
+    ys = NDVar(y.x + noise, (Scalar('ch', range(5)), y.time), name='y')
+    x = [ds['x1'], ds['x2']]
+
+    configure(n_workers=0)
+    res = boosting(ys, x, 0, 1)
+    res_b = boosting(ys, x, 0, 1, batch=True)
+    for h_b, h in izip(res_b.h, res.h):
+        assert_dataobj_equal(h_b, h, decimal=10)
+    assert_dataobj_equal(res_b.r, res.r, decimal=10)
+    eq_(res_b.n_iter.shape, (5, 10))
+    assert_array_equal(res_b.n_iter, res.n_iter)
+    assert_array_equal(res_b.stop_reason, res.stop_reason)
+    # signals are boosted separately when lagged predictors are too large
+    batch_max_bytes = _boosting.BATCH_MAX_BYTES
+    _boosting.BATCH_MAX_BYTES = 0
+    try:
+        res_s = boosting(ys, x, 0, 1, batch=True)
+    finally:
+        _boosting.BATCH_MAX_BYTES = batch_max_bytes
+    for h_s, h in izip(res_s.h, res.h):
+        assert_dataobj_equal(h_s, h)
+    # workers
+    configure(n_workers=2)
+    try:
+        res_mp = boosting(ys, x, 0, 1, batch=True)
+        for h_mp, h_b in izip(res_mp.h, res_b.h):
+            assert_dataobj_equal(h_mp, h_b, decimal=10)
+    finally:
+        configure(n_workers=True)
+    assert_raises(ValueError, boosting, ys, x, 0, 1, error='l1', batch=True)
+
+
 def test_result():
     "Test boosting results"
     ds = datasets._get_continuous()
@@ -83,6 +158,15 @@ def test_result():
 
     # test prediction with res.h and res.h_scaled
     res = boosting(ds['y'], ds['x1'], 0, 1)
+    # fit information
+    eq_(res.n_iter.shape, (10,))
+    eq_(res.stop_reason.shape, (10,))
+    eq_(res.t_fit.shape, (10,))
+    assert np.all(res.n_iter > 10)
+    assert set(res.stop_reason).issubset(('test error', 'mindelta',
+                                          'oscillation'))
+    res_p = pickle.loads(pickle.dumps(res, pickle.HIGHEST_PROTOCOL))
+    assert_array_equal(res_p.n_iter, res.n_iter)
     y1 = convolve(res.h_scaled, ds['x1'])
     x_scaled = ds['x1'] / res.x_scale
     y2 = convolve(res.h, x_scaled)
@@ -101,6 +185,27 @@ def test_result():
     assert_raises(ValueError, boosting, ds['y'], ds['x1'], 0, .5, False)
 
 
+def test_result_parc():
+    "Test changing the parcellation of a source space result"
+    rng = np.random.RandomState(0)
+    source = SourceSpace([np.arange(3), np.arange(2)], 'subject', 'ico-1',
+                         TempDir(), None)
+    time = UTS(0, 0.01, 1000)
+    x = NDVar(rng.normal(0, 1, 1000), (time,), name='x')
+    y = NDVar(rng.normal(0, 1, (5, 1000)), (source, time), name='y')
+    configure(n_workers=0)
+    try:
+        res = boosting(y, x, 0, 0.05)
+    finally:
+        configure(n_workers=True)
+    n_iter = res.n_iter
+    res._set_parc(Factor(['a', 'unknown-lh', 'b', 'c', 'unknown-rh']))
+    eq_(len(res.r.source), 3)
+    for attr in ('n_iter', 'stop_reason', 't_fit'):
+        eq_(getattr(res, attr).shape, (3, 10))
+    assert_array_equal(res.n_iter, n_iter[[0, 2, 3]])
+
+
 def test_boosting_func():
     "Test boosting() against svdboostV4pred.m"
     # 1d-TRF
@@ -1,6 +1,6 @@
 # Author: Christian Brodbeck <christianbrodbeck@nyu.edu>
 from .basic import (
     WrappedFormater, ask, deprecated, deprecated_attribute, intervals,
-    LazyProperty, keydefaultdict, n_decimals, natsorted, log_level,
+    LazyProperty, LRUCache, keydefaultdict, n_decimals, natsorted, log_level,
     set_log_level)
 from .system import caffeine
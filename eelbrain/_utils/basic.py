@@ -1,6 +1,6 @@
 # Author: Christian Brodbeck <christianbrodbeck@nyu.edu>
 "A few basic operations needed throughout Eelbrain"
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
 import functools
 import logging
 import re
@@ -191,6 +191,31 @@ def n_decimals(number):
         return 1
 
 
+class LRUCache(OrderedDict):
+    """Dictionary that keeps only the ``maxsize`` most recently used items
+
+    Items are marked as used when they are set or retrieved with :meth:`get`
+    (but not with ``cache[key]``).
+    """
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        OrderedDict.__init__(self)
+
+    def get(self, key, default=None):
+        if key in self:
+            value = self.pop(key)
+            OrderedDict.__setitem__(self, key, value)
+            return value
+        return default
+
+    def __setitem__(self, key, value):
+        if key in self:
+            del self[key]
+        OrderedDict.__setitem__(self, key, value)
+        while len(self) > self.maxsize:
+            self.popitem(False)
+
+
 class keydefaultdict(defaultdict):
     "http://stackoverflow.com/a/2912455/166700"
     def __missing__(self, key):
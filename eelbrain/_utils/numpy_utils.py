@@ -152,3 +152,85 @@ if LooseVersion(np.__version__) < LooseVersion('1.10'):
         return np.digitize(x, bins, right)
 else:
     digitize = np.digitize
+
+
+# kernel length from which convolve_kernels() uses the FFT
+CONVOLVE_FFT_MIN = 16
+# minimum FFT length for overlap-add blocks, and in multiples of kernel length
+CONVOLVE_FFT_N = 2048
+CONVOLVE_FFT_FACTOR = 16
+
+
+def convolve_kernels(h, x, out=None, i_start=0, method='auto'):
+    """Convolve several kernels with several signals and sum over signals
+
+    ``out[i, t] = sum_j (h[i, j] * x[j])[t + i_start]``, where ``*`` is the
+    full convolution.
+
+    Parameters
+    ----------
+    h : array (n_out, n_in, n_h)
+        Kernels.
+    x : array (n_in, n_times)
+        Signals.
+    out : array (n_out, n_out_times)
+        Buffer for the result (default ``(n_out, n_times)``).
+    i_start : int
+        Index into the full convolution corresponding to the first sample of
+        ``out`` (e.g., ``-i_start`` is the kernel's first sample for kernels
+        starting before 0).
+    method : 'auto' | 'direct' | 'fft'
+        Direct convolution of each kernel with each signal, or overlap-add
+        FFT convolution of all kernels with all signals. With ``'auto'``
+        (default), the FFT is used for kernels with at least
+        ``CONVOLVE_FFT_MIN`` samples.
+
+    Returns
+    -------
+    out : array (n_out, n_out_times)
+        Result.
+    """
+    n_out, n_in, n_h = h.shape
+    n_times = x.shape[1]
+    if x.shape[0] != n_in:
+        raise ValueError("h with shape %s does not match x with shape %s" %
+                         (h.shape, x.shape))
+    if out is None:
+        out = np.zeros((n_out, n_times))
+    else:
+        out.fill(0)
+    n_out_times = out.shape[1]
+    if method == 'auto':
+        method = 'fft' if n_h >= CONVOLVE_FFT_MIN else 'direct'
+    elif method not in ('direct', 'fft'):
+        raise ValueError("method=%r" % (method,))
+
+    # full convolution indexes for out: [i_start, i_stop)
+    i_stop = i_start + n_out_times
+    j_start = max(0, i_start)
+    j_stop = min(n_times + n_h - 1, i_stop)
+    if j_stop <= j_start:
+        return out
+
+    if method == 'direct':
+        for h_i, out_i in izip(h, out):
+            for h_ij, x_j in izip(h_i, x):
+                y = np.convolve(h_ij, x_j)
+                out_i[j_start - i_start:j_stop - i_start] += y[j_start:j_stop]
+    else:
+        n_fft = max(CONVOLVE_FFT_FACTOR * n_h, CONVOLVE_FFT_N)
+        n_fft = 2 ** int(np.ceil(np.log2(n_fft)))
+        n_block = n_fft - n_h + 1
+        h_fft = np.fft.rfft(h, n_fft)
+        for block_start in xrange(max(0, i_start - n_h + 1),
+                                  min(n_times, i_stop), n_block):
+            block_stop = min(block_start + n_block, n_times)
+            x_fft = np.fft.rfft(x[:, block_start:block_stop], n_fft)
+            y_fft = np.einsum('ijf,jf->if', h_fft, x_fft)
+            y = np.fft.irfft(y_fft, n_fft)
+            # block result covers the full convolution from block_start
+            jb_start = max(block_start, i_start)
+            jb_stop = min(block_stop + n_h - 1, i_stop)
+            out[:, jb_start - i_start:jb_stop - i_start] += \
+                y[:, jb_start - block_start:jb_stop - block_start]
+    return out
@@ -1,10 +1,15 @@
 # Author: Christian Brodbeck <christianbrodbeck@nyu.edu>
 from distutils.version import LooseVersion
+import os
 import platform
 from subprocess import Popen
 from warnings import warn
 
 
+# directory for data shared with worker processes
+SHARED_DIR = '/dev/shm' if os.path.isdir('/dev/shm') else None
+
+
 class Caffeinator(object):
     """Keep track of processes blocking idle sleep"""
     #  ~ 7.5 ms on my old MacBook Pro
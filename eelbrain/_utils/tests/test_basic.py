@@ -0,0 +1,18 @@
+# Author: Christian Brodbeck <christianbrodbeck@nyu.edu>
+from nose.tools import eq_
+
+from eelbrain._utils import LRUCache
+
+
+def test_lru_cache():
+    "Test LRUCache"
+    cache = LRUCache(2)
+    cache['a'] = 1
+    cache['b'] = 2
+    eq_(cache.get('a'), 1)
+    cache['c'] = 3
+    eq_(list(cache), ['a', 'c'])
+    eq_(cache.get('b'), None)
+    cache['a'] = 4
+    cache['d'] = 5
+    eq_(cache.items(), [('a', 4), ('d', 5)])
@@ -0,0 +1,46 @@
+# Author: Christian Brodbeck <christianbrodbeck@nyu.edu>
+import os
+
+from nose.tools import eq_, ok_, assert_raises
+import numpy as np
+
+from eelbrain import Datalist, datasets, load, save
+from eelbrain._utils.testing import (
+    TempDir, assert_dataobj_equal, assert_dataset_equal)
+
+
+def test_dataset_io():
+    "Test columnar Dataset I/O"
+    tempdir = TempDir()
+    ds = datasets.get_uts(True)
+    ds['list'] = Datalist(range(ds.n_cases))
+    ds.info['key'] = 'value'
+    ds.name = 'uts'
+
+    dst = os.path.join(tempdir, 'ds')
+    save.dataset(ds, dst)
+    ok_(os.path.exists(dst + '.eds'))
+    ds_ = load.dataset(dst)
+    assert_dataset_equal(ds_, ds)
+    eq_(ds_.name, 'uts')
+    eq_(ds_.info, ds.info)
+    eq_(list(ds_['list']), list(ds['list']))
+
+    # subset of columns
+    ds_ = load.dataset(dst, ('utsnd', 'A'))
+    eq_(ds_.keys(), ['utsnd', 'A'])
+    assert_dataobj_equal(ds_['utsnd'], ds['utsnd'])
+    assert_raises(KeyError, load.dataset, dst, ('utsnd', 'C'))
+
+    # memory-mapped
+    ds_ = load.dataset(dst, mmap=True)
+    ok_(isinstance(ds_['utsnd'].x, np.memmap))
+    ok_(not isinstance(ds_['Y'].x, np.memmap))
+    assert_dataset_equal(ds_, ds)
+    ds_['utsnd'].x += 1
+    assert_dataset_equal(load.dataset(dst), ds)
+
+    # not a dataset file
+    path = os.path.join(tempdir, 'ds.pickled')
+    save.pickle(ds, path)
+    assert_raises(IOError, load.dataset, path)
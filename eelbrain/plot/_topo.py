@@ -10,7 +10,7 @@ from warnings import warn
 
 import matplotlib as mpl
 import numpy as np
-from scipy import interpolate, linalg
+from scipy import interpolate
 from scipy.spatial import ConvexHull
 
 from . import _base
@@ -159,10 +159,15 @@ class TopomapBins(EelFigure):
         vlims = _base.find_fig_vlims(epochs, vmax, vmin, cmaps)
 
         for row, layers in enumerate(epochs):
+            # interpolate all bins of a layer at once
+            images = [_topomap_images(l.sensor, l.get_data(('sensor', 'time')),
+                                      'default', 100, 'linear')
+                      for l in layers]
             for column, t in enumerate(time):
                 ax = self._axes[row * n_bins + column]
                 topo_layers = [l.sub(time=t) for l in layers]
-                _ax_topomap(ax, topo_layers, cmaps=cmaps, vlims=vlims)
+                _ax_topomap(ax, topo_layers, cmaps=cmaps, vlims=vlims,
+                            images=[im[column] for im in images])
 
         self._set_axtitle((str(t) for t in time), axes=self._axes[:len(time)])
         self._show()
@@ -377,6 +382,59 @@ class TopoButterfly(ColorMapMixin, TimeSlicerEF, TopoMapKey, YLimMixin,
             self.canvas.redraw(self.topo_axes)
 
 
+def _topomap_images(sensor, data, proj, res, method):
+    """Interpolate topomap images for several data vectors at once
+
+    Parameters
+    ----------
+    sensor : Sensor
+        Sensor dimension of the data.
+    data : array (n_sensors, n_maps)
+        Data for each topomap in columns.
+    proj : str
+        Sensor projection.
+    res : int
+        Image resolution.
+    method : None | 'nearest' | 'linear' | 'cubic' | 'spline'
+        Interpolation method (None for thin-plate spline).
+
+    Returns
+    -------
+    images : array (n_maps, res, res)
+        Image for each topomap.
+    """
+    if method is None:
+        m = sensor._topomap_interpolator(proj, res, SENSORMAP_FRAME)
+        return m.dot(data).T.reshape((-1, res, res))
+
+    locs = sensor.get_locs_2d(proj, frame=SENSORMAP_FRAME)
+    visible = sensor._visible_sensors(proj)
+    if visible is not None:
+        data = data[visible]
+        locs = locs[visible]
+    grid = np.linspace(0, 1, res)
+
+    if method == 'spline':
+        k = int(floor(sqrt(len(locs)))) - 1
+        images = np.empty((data.shape[1], res, res))
+        for image, v in izip(images, data.T):
+            tck = interpolate.bisplrep(locs[:, 1], locs[:, 0], v, kx=k, ky=k)
+            image[:] = interpolate.bisplev(grid, grid, tck)
+        return images
+
+    # griddata triangulates once for all columns
+    mgrid = tuple(np.meshgrid(grid, grid))
+    isnan = np.isnan(data)
+    if np.any(isnan):
+        nanmap = interpolate.griddata(locs, isnan, mgrid, method)
+        data = np.where(isnan, 0, data)
+        images = interpolate.griddata(locs, data, mgrid, method)
+        images[nanmap > 0.5] = np.NaN
+    else:
+        images = interpolate.griddata(locs, data, mgrid, method)
+    return np.rollaxis(images, 2)
+
+
 class _plt_topomap(_plt_im):
     """Topomap plot
 
@@ -389,17 +447,18 @@ class _plt_topomap(_plt_im):
         Override the colorspace vmax.
     method : 'nearest' | 'linear' | 'cubic' | 'spline'
         Method for interpolating topo-map between sensors.
+    image : array (res, res)
+        Image interpolated in advance (see :func:`_topomap_images`).
     """
     _aspect = 'equal'
 
     def __init__(self, ax, ndvar, overlay, proj, res, interpolation, vlims,
-                 cmaps, contours, method, clip, clip_distance):
+                 cmaps, contours, method, clip, clip_distance, image=None):
         # store attributes
         self._proj = proj
-        self._visible_data = ndvar.sensor._visible_sensors(proj)
-        self._grid = np.linspace(0, 1, res)
-        self._mgrid = tuple(np.meshgrid(self._grid, self._grid))
+        self._res = res
         self._method = method
+        self._image = image
 
         # clip mask
         if method is None and clip:
@@ -430,57 +489,13 @@ class _plt_topomap(_plt_im):
                          (0, 1, 0, 1), interpolation, mask)
 
     def _data_from_ndvar(self, ndvar):
+        if self._image is not None:
+            image = self._image
+            self._image = None
+            return image
         v = ndvar.get_data(('sensor',))
-        locs = ndvar.sensor.get_locs_2d(self._proj, frame=SENSORMAP_FRAME)
-        if self._visible_data is not None:
-            v = v[self._visible_data]
-            locs = locs[self._visible_data]
-
-        if self._method is None:
-            # interpolate data
-            xi, yi = self._mgrid
-
-            # code adapted from mne-python topmap _griddata()
-            xy = locs[:, 0] + locs[:, 1] * -1j
-            d = np.abs(xy - xy[:, None])
-            diagonal_step = len(locs) + 1
-            d.flat[::diagonal_step] = 1.
-
-            g = (d * d) * (np.log(d) - 1.)
-            g.flat[::diagonal_step] = 0.
-            weights = linalg.solve(g, v.ravel())
-
-            m, n = xi.shape
-            out = np.empty_like(xi)
-
-            g = np.empty(xy.shape)
-            for i in range(m):
-                for j in range(n):
-                    d = np.abs(xi[i, j] + -1j * yi[i, j] - xy)
-                    mask = np.where(d == 0)[0]
-                    if len(mask):
-                        d[mask] = 1.
-                    np.log(d, out=g)
-                    g -= 1.
-                    g *= d * d
-                    if len(mask):
-                        g[mask] = 0.
-                    out[i, j] = g.dot(weights)
-            return out
-        elif self._method == 'spline':
-            k = int(floor(sqrt(len(locs)))) - 1
-            tck = interpolate.bisplrep(locs[:, 1], locs[:, 0], v, kx=k, ky=k)
-            return interpolate.bisplev(self._grid, self._grid, tck)
-        else:
-            isnan = np.isnan(v)
-            if np.any(isnan):
-                nanmap = interpolate.griddata(locs, isnan, self._mgrid, self._method)
-                mask = nanmap > 0.5
-                v = np.where(isnan, 0, v)
-                vmap = interpolate.griddata(locs, v, self._mgrid, self._method)
-                np.place(vmap, mask, np.NaN)
-                return vmap
-            return interpolate.griddata(locs, v, self._mgrid, self._method)
+        return _topomap_images(ndvar.sensor, v[:, None], self._proj, self._res,
+                               self._method)[0]
 
 
 class _ax_topomap(_ax_im_array):
@@ -493,13 +508,15 @@ class _ax_topomap(_ax_im_array):
         is removed; with 'fullname', the full name is shown.
     mark : list of IDs
         highlight a subset of the sensors
+    images : list of array
+        Images interpolated in advance, one for each layer.
     """
     def __init__(self, ax, layers, clip=False, clip_distance=0.05,
                  sensorlabels=None, mark=None, mcolor=None, mmarker=None,
                  proj='default',
                  res=100, interpolation=None, xlabel=None, vlims={}, cmaps={},
                  contours={}, method='linear', head_radius=None, head_pos=0.,
-                 head_linewidth=None):
+                 head_linewidth=None, images=None):
         self.ax = ax
         self.data = layers
         self.proj = proj
@@ -510,9 +527,12 @@ class _ax_topomap(_ax_im_array):
 
         ax.set_axis_off()
         overlay = False
-        for layer in layers:
+        if images is None:
+            images = repeat(None)
+        for layer, image in izip(layers, images):
             h = _plt_topomap(ax, layer, overlay, proj, res, interpolation,
-                             vlims, cmaps, contours, method, clip, clip_distance)
+                             vlims, cmaps, contours, method, clip, clip_distance,
+                             image)
             self.layers.append(h)
             overlay = True
 
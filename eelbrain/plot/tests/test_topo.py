@@ -1,7 +1,11 @@
 # Author: Christian Brodbeck <christianbrodbeck@nyu.edu>
-from nose.tools import eq_
+from matplotlib import pyplot
+from nose.tools import eq_, ok_
+from numpy.testing import assert_array_almost_equal
 
 from eelbrain import datasets, plot, testnd
+from eelbrain.plot._sensors import SENSORMAP_FRAME
+from eelbrain.plot._topo import _plt_topomap, _topomap_images
 from eelbrain._utils.testing import requires_mne_sample_data
 
 
@@ -21,6 +25,34 @@ def test_plot_topomap():
     p.close()
 
 
+def test_topomap_interpolator():
+    "Test the cached topomap interpolation matrix"
+    ds = datasets.get_uts(utsnd=True)
+    topo = ds['utsnd'].sub(time=0.1)[0]
+    m = topo.sensor._topomap_interpolator('default', 20, SENSORMAP_FRAME)
+    eq_(m.shape, (400, len(topo.sensor)))
+    ok_(topo.sensor._topomap_interpolator('default', 20, SENSORMAP_FRAME) is m)
+
+    # image for a different time point reuses the matrix
+    topo = ds['utsnd'].sub(time=0.2)[0]
+    figure = pyplot.figure()
+    h = _plt_topomap(figure.gca(), topo, False, 'default', 20, None, {}, {},
+                     {}, None, False, 0)
+    assert_array_almost_equal(h._data, m.dot(topo.x).reshape((20, 20)))
+    pyplot.close(figure)
+
+    # batch interpolation
+    y = ds['utsnd'].sub(time=(0.1, 0.2))[0]
+    data = y.get_data(('sensor', 'time'))
+    for method in (None, 'linear'):
+        images = _topomap_images(y.sensor, data, 'default', 20, method)
+        eq_(images.shape, (len(y.time), 20, 20))
+        for i in (0, len(y.time) - 1):
+            image = _topomap_images(y.sensor, data[:, i:i + 1], 'default', 20,
+                                    method)
+            assert_array_almost_equal(images[i], image[0])
+
+
 @requires_mne_sample_data
 def test_plot_topomap_mne():
     "Test plot.Topomap with MNE data"
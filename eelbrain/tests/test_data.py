@@ -19,15 +19,19 @@ import numpy as np
 from numpy.testing import (
     assert_equal, assert_array_equal, assert_allclose,
     assert_array_almost_equal)
-from scipy import signal
+from scipy import signal, sparse
+from scipy.spatial.distance import pdist, squareform
 
 from eelbrain import (
     datasets, load, Var, Factor, NDVar, Datalist, Dataset, Celltable,
     Case, Categorial, Scalar, Sensor, UTS, align, align1, choose, combine,
     cwt_morlet, shuffled_index)
+from eelbrain import _data_obj
 from eelbrain._data_obj import (
-    all_equal, asvar, assub, FULL_AXIS_SLICE, FULL_SLICE, longname, SourceSpace,
-    assert_has_no_empty_cells)
+    all_equal, asvar, assub, CellIndex, FULL_AXIS_SLICE, FULL_SLICE, longname,
+    SourceSpace, assert_has_no_empty_cells, _matrix_graph, _point_graph,
+    _tri_graph)
+from eelbrain._data_opt import gaussian_smoother
 from eelbrain._exceptions import DimensionMismatchError
 from eelbrain._stats.stats import rms
 from eelbrain._utils.testing import (
@@ -74,6 +78,41 @@ def test_aggregate():
     dsa = sds.aggregate('A%B', drop=drop, equal_count=True)
     assert_array_equal(dsa['n'], [12, 12, 12])
 
+    # unsorted cells
+    ds = datasets.get_uts()[::-1]
+    dsa = ds.aggregate('B%A', drop=drop)
+    for i, (b, a) in enumerate(dsa.eval("B % A")):
+        index = ds.eval("(A == %r) & (B == %r)" % (a, b))
+        assert_allclose(dsa[i, 'uts'].x, ds[index, 'uts'].x.mean(0))
+        assert_almost_equal(dsa[i, 'Y'], ds[index, 'Y'].mean())
+
+
+def test_cell_index():
+    "Test CellIndex"
+    ds = datasets.get_uv()
+    ds = ds[ds.eval("~((A == 'a1') & (B == 'b2'))")][::-1]
+    x = ds.eval('A % B')
+    index = CellIndex(x)
+    eq_(index.cells, tuple(cell for cell in x.cells if np.any(x == cell)))
+    eq_(len(index), ds.n_cases)
+    for i, cell in enumerate(index.cells):
+        assert_array_equal(index.index(i), x.index(cell))
+        assert_array_equal(np.arange(ds.n_cases)[index.index_opt(cell)],
+                           x.index(cell))
+        eq_(index.counts[i], np.sum(x == cell))
+    eq_(len(index.index_opt(('a1', 'b2'))), 0)
+    assert_allclose(index.mean(ds['fltvar'].x),
+                    [ds[x == cell, 'fltvar'].mean() for cell in index.cells])
+    # reduce
+    y = np.random.RandomState(0).normal(0, 1, (ds.n_cases, 3))
+    cells_y = [y[x == cell] for cell in index.cells]
+    assert_allclose(index.reduce(y, np.mean, axis=0),
+                    [y_.mean(0) for y_ in cells_y])
+    assert_allclose(index.reduce(y, np.mean), [y_.mean() for y_ in cells_y])
+    eq_(index.reduce(y, np.sum, axis=0, dtype=np.float32).dtype, np.float32)
+    assert_allclose(index.reduce(y, np.std, axis=0, ddof=1),
+                    [y_.std(0, ddof=1) for y_ in cells_y])
+
 
 def test_align():
     "Testing align() and align1() functions"
@@ -283,6 +322,42 @@ def test_combine():
     assert_array_equal(dsc.info['b'][0], np.arange(2))
 
 
+def test_memmap_ndvar():
+    "Test memory-mapped NDVar"
+    ds = datasets.get_uts(utsnd=True)
+    y = ds['utsnd']
+    tempdir = tempfile.mkdtemp()
+    chunk_size = _data_obj.MEMMAP_CHUNK_SIZE
+    try:
+        path = os.path.join(tempdir, 'y.npy')
+        y_mm = combine((y[:30], y[30:]), memmap=path)
+        ok_(isinstance(y_mm.x, np.memmap))
+        assert_dataobj_equal(y_mm, y)
+        assert_raises(TypeError, combine, (ds['Y'], ds['Y']), memmap=path)
+        # case slices are views
+        ok_(isinstance(y_mm[10:20].x, np.memmap))
+        # process data in chunks
+        _data_obj.MEMMAP_CHUNK_SIZE = y.x.nbytes // 7
+        assert_dataobj_equal(y_mm.mean('case'), y.mean('case'), decimal=12)
+        assert_dataobj_equal(y_mm.mean(('case', 'time')),
+                             y.mean(('case', 'time')), decimal=12)
+        assert_dataobj_equal(y_mm.rms('time'), y.rms('time'))
+        assert_dataobj_equal(y_mm.summary(), y.summary(), decimal=12)
+        assert_dataobj_equal(y_mm.summary(time=(0.1, 0.2)),
+                             y.summary(time=(0.1, 0.2)))
+        assert_dataobj_equal(y_mm.max('sensor'), y.max('sensor'))
+        for func in ('max', 'min', 'rms', 'std'):
+            assert_dataobj_equal(getattr(y_mm, func)('case'),
+                                 getattr(y, func)('case'), decimal=12)
+        assert_dataobj_equal(y_mm.var(('case', 'time'), ddof=1),
+                             y.var(('case', 'time'), ddof=1), decimal=12)
+        assert_almost_equal(y_mm.std(), y.std(), 12)
+        del y_mm
+    finally:
+        _data_obj.MEMMAP_CHUNK_SIZE = chunk_size
+        shutil.rmtree(tempdir)
+
+
 def test_datalist():
     "Test Datalist class"
     dl = Datalist(range(10))
@@ -1374,6 +1449,36 @@ def test_sensor():
     eq_(s1.intersect(s2), sensor[[1]])
     eq_(sensor._dim_index(np.array([0, 1, 1], bool)), ['2', '3'])
 
+    # connectivity
+    sensor.set_connectivity([('3', '1'), ('1', '2'), ('2', '1')])
+    assert_array_equal(sensor.connectivity(), [[0, 1], [0, 2]])
+    locs = np.array([[0., 0., 0.], [1., 0., 0.], [3., 0., 0.], [3., 1.5, 0.]])
+    sensor = Sensor(locs, ['a', 'b', 'c', 'd'])
+    sensor.set_connectivity(connect_dist=1.6)
+    assert_array_equal(sensor.connectivity(), [[0, 1], [1, 2], [2, 3]])
+
+
+def test_graphs():
+    "Test connectivity graph construction"
+    rng = np.random.RandomState(0)
+    tris = np.array([rng.choice(20, 3, False) for _ in xrange(30)])
+    pairs = set()
+    for tri in tris:
+        a, b, c = sorted(tri)
+        pairs.update(((a, b), (a, c), (b, c)))
+    assert_array_equal(_tri_graph(tris), sorted(pairs))
+
+    matrix = sparse.coo_matrix((np.ones(len(tris)), tris[:, :2].T), (20, 20))
+    pairs = {(min(a, b), max(a, b)) for a, b in tris[:, :2]}
+    assert_array_equal(_matrix_graph(matrix), sorted(pairs))
+
+    coords = rng.uniform(0, 1, (50, 3))
+    dist = squareform(pdist(coords))
+    pairs = [(i, j) for i, j in zip(*np.nonzero(dist < 0.3)) if i < j]
+    graph = _point_graph(coords, 0.3)
+    assert_array_equal(graph, pairs)
+    eq_(graph.dtype, np.uint32)
+
 
 def test_shuffle():
     x = Factor('aabbaa')
@@ -1382,6 +1487,38 @@ def test_shuffle():
         eq_(sorted(i[2:4]), [2, 3])
         eq_(sorted(i), range(6))
 
+
+def test_source_space_smoothing():
+    "Test sparse Gaussian smoothing on SourceSpace"
+    rng = np.random.RandomState(0)
+    vertices = [np.arange(0, 30, 2), np.arange(1, 30, 3)]
+    dists = []
+    for _ in xrange(2):
+        points = rng.uniform(0, 0.1, (30, 3))
+        dists.append(np.sqrt(((points[:, None] - points) ** 2).sum(-1)))
+    source = SourceSpace(vertices, 'subject', 'ico-1', None, None)
+    source.get_source_space = lambda: [{'dist': sparse.csr_matrix(d)} for
+                                       d in dists]
+    dense = -np.ones((len(source), len(source)))
+    n_lh = len(vertices[0])
+    dense[:n_lh, :n_lh] = dists[0][vertices[0]][:, vertices[0]]
+    dense[n_lh:, n_lh:] = dists[1][vertices[1]][:, vertices[1]]
+
+    # without truncation: identical to dense smoother
+    m = source._gaussian_smoother(0.02, np.inf)
+    assert_allclose(m.toarray(), gaussian_smoother(dense, 0.02))
+    # truncated smoother is sparse and cached
+    m = source._gaussian_smoother(0.02)
+    ok_(m.nnz < np.sum(dense >= 0))
+    ok_(source._gaussian_smoother(0.02) is m)
+    assert_allclose(m.sum(1), 1)
+
+    x = NDVar(rng.normal(size=(3, 4, len(source))),
+              ('case', UTS(0, 0.1, 4), source))
+    xs = x.smooth('source', 0.02, 'gaussian')
+    assert_allclose(xs.x, np.einsum('ij,ctj->cti', m.toarray(), x.x))
+
+
 @requires_mne_sample_data
 def test_source_space():
     "Test SourceSpace Dimension"
@@ -1,4 +1,5 @@
 """Test mne interaction"""
+import copy
 from itertools import izip
 import os
 
@@ -7,16 +8,21 @@ import numpy as np
 from numpy.testing import assert_array_equal, assert_allclose
 
 import mne
+from mne.minimum_norm import apply_inverse_epochs, make_inverse_operator
 from mne.tests.test_label import assert_labels_equal
 from nibabel.freesurfer import read_annot
+from scipy import sparse
 
 from eelbrain import (
     datasets, load, testnd,
     Dataset, Factor,
     concatenate, morph_source_space)
 from eelbrain._data_obj import SourceSpace, asndvar, _matrix_graph
-from eelbrain._mne import shift_mne_epoch_trigger, combination_label
-from eelbrain._utils.testing import requires_mne_sample_data
+from eelbrain import _mne
+from eelbrain._mne import (
+    InverseKernel, shift_mne_epoch_trigger, combination_label, morph_matrix,
+    _vertices_hash)
+from eelbrain._utils.testing import TempDir, requires_mne_sample_data
 from eelbrain.tests.test_data import assert_dataobj_equal
 
 data_dir = mne.datasets.testing.data_path()
@@ -210,6 +216,43 @@ def test_morphing():
                                             parc=None)
     assert_dataobj_equal(morphed_ndvar, morphed_stc_ndvar)
 
+    # disk cache
+    tempdir = TempDir()
+    _mne._morph_cache.clear()
+    morphed_ndvar = morph_source_space(ndvar, 'fsaverage', cache_dir=tempdir)
+    assert_array_equal(morphed_ndvar.x[0], morphed_stc.data)
+    eq_(len(os.listdir(tempdir)), 1)
+
+
+def test_morph_matrix_cache():
+    "Test caching of morph matrices"
+    tempdir = TempDir()
+    vertices_from = [np.arange(3), np.arange(2)]
+    vertices_to = [np.arange(4), np.arange(3)]
+    mm = sparse.random(7, 5, 0.5, 'csr', random_state=0)
+    digest = _vertices_hash(vertices_from, vertices_to)
+    _mne._save_sparse(os.path.join(tempdir, 'a-b-%s.npz' % digest), mm)
+    _mne._morph_cache.clear()
+
+    # load from disk
+    mm_ = morph_matrix('a', 'b', vertices_from, vertices_to, tempdir, tempdir)
+    assert_array_equal(mm_.toarray(), mm.toarray())
+    # in-memory cache
+    os.remove(os.path.join(tempdir, 'a-b-%s.npz' % digest))
+    ok_(morph_matrix('a', 'b', vertices_from, vertices_to, tempdir) is mm_)
+    # different vertices
+    assert_not_equal(_vertices_hash(vertices_to, vertices_from), digest)
+    # least recently used matrices are discarded
+    for i in xrange(_mne.MORPH_CACHE_SIZE):
+        vertices_to_i = [np.arange(4), np.arange(i + 4)]
+        digest_i = _vertices_hash(vertices_from, vertices_to_i)
+        _mne._save_sparse(os.path.join(tempdir, 'a-b-%s.npz' % digest_i),
+                          sparse.random(i + 8, 5, 0.5, 'csr', random_state=i))
+        morph_matrix('a', 'b', vertices_from, vertices_to_i, tempdir, tempdir)
+    eq_(len(_mne._morph_cache), _mne.MORPH_CACHE_SIZE)
+    ok_(('a', 'b', digest) not in [key[1:] for key in _mne._morph_cache])
+    _mne._morph_cache.clear()
+
 
 @requires_mne_sample_data  # source space distance computation times out
 def test_source_space():
@@ -245,3 +288,43 @@ def test_source_space():
         ss2 = SourceSpace(vertices, subject, 'ico-4', subjects_dir, 'aparc')
         ss2sub = ss2[ss2._array_index('superiortemporal-rh')]
         assert_array_equal(sssub.connectivity(), ss2sub.connectivity())
+
+
+def test_inverse_kernel():
+    "Test applying a prepared inverse kernel to epochs"
+    mne.set_log_level('warning')
+    montage = mne.channels.read_montage('standard_1020')
+    info = mne.create_info(montage.ch_names[:32], 100., 'eeg', montage=montage)
+    sphere = mne.make_sphere_model('auto', 'auto', info)
+    rng = np.random.RandomState(0)
+    epochs = mne.EpochsArray(rng.normal(0, 1e-5, (4, 32, 10)), info,
+                             tmin=-0.02)
+    epochs.set_eeg_reference(projection=True)
+    cov = mne.make_ad_hoc_cov(info)
+
+    # free orientation
+    src = mne.setup_volume_source_space(sphere=sphere, pos=30.)
+    fwd = mne.make_forward_solution(info, None, src, sphere)
+    inv = make_inverse_operator(epochs.info, fwd, cov, loose=1., depth=None)
+    for method in ('MNE', 'dSPM', 'sLORETA'):
+        stcs = apply_inverse_epochs(epochs, inv, 1. / 9, method)
+        kernel = InverseKernel(inv, 1. / 9, method)
+        x = kernel.apply(epochs.get_data(), epochs.info)
+        assert_allclose(x, [stc.data for stc in stcs])
+
+    # fixed orientation (surface source space from the volume grid)
+    src = mne.SourceSpaces([copy.deepcopy(src[0]) for _ in xrange(2)])
+    for ss, id_ in izip(src, (mne.io.constants.FIFF.FIFFV_MNE_SURF_LEFT_HEMI,
+                              mne.io.constants.FIFF.FIFFV_MNE_SURF_RIGHT_HEMI)):
+        ss['type'] = 'surf'
+        ss['id'] = id_
+    fwd = mne.make_forward_solution(info, None, src, sphere)
+    fwd = mne.convert_forward_solution(fwd, True, True)
+    inv = make_inverse_operator(epochs.info, fwd, cov, loose=0., fixed=True,
+                                depth=None)
+    stcs = apply_inverse_epochs(epochs, inv, 1. / 9, 'dSPM')
+    kernel = InverseKernel(inv, 1. / 9, 'dSPM')
+    out = np.empty((4, kernel.n_sources, 10))
+    x = kernel.apply(epochs.get_data(), epochs.info, out)
+    ok_(x is out)
+    assert_allclose(x, [stc.data for stc in stcs])
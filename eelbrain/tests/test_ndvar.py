@@ -1,11 +1,12 @@
 # Author: Christian Brodbeck <christianbrodbeck@nyu.edu>
-from nose.tools import eq_
+from nose.tools import eq_, ok_, assert_raises
 import numpy as np
-from numpy.testing import assert_array_equal
+from numpy.testing import assert_array_equal, assert_array_almost_equal
 
 from eelbrain import (
-    NDVar, Scalar, UTS, datasets, concatenate, convolve, cross_correlation,
-    find_intervals, find_peaks)
+    NDVar, Case, Scalar, UTS, datasets, concatenate, convolve,
+    cross_correlation, find_intervals, find_peaks, label_operator, segment)
+from eelbrain._utils.numpy_utils import convolve_kernels
 
 
 def test_concatenate():
@@ -40,6 +41,39 @@ def test_convolve():
                        np.convolve(h2.x[1], x1.x)[:100]))
     assert_array_equal(xc.x, xc_np)
 
+    # kernel with additional dimension, summing over predictors
+    rng = np.random.RandomState(0)
+    sensor = Scalar('sensor', range(3))
+    predictor = Scalar('predictor', range(2))
+    time = UTS(-0.1, 0.01, 50)  # long enough to use FFT
+    h = NDVar(rng.normal(0, 1, (3, 2, 50)), (sensor, predictor, time))
+    x = NDVar(rng.normal(0, 1, (2, 500)), (predictor, UTS(0, 0.01, 500)))
+    xc = convolve(h, x)
+    eq_(xc.dims, (sensor, x.time))
+    for i in xrange(3):
+        xc_np = (np.convolve(h.x[i, 0], x.x[0]) +
+                 np.convolve(h.x[i, 1], x.x[1]))[10:510]
+        assert_array_almost_equal(xc.x[i], xc_np)
+    xc_ = convolve(h.sub(predictor=0), x.sub(predictor=0))
+    xc_ += convolve(h.sub(predictor=1), x.sub(predictor=1))
+    assert_array_almost_equal(xc_.x, xc.x)
+    # output buffer
+    out = np.empty((3, 500))
+    xc_ = convolve(h, x, out)
+    ok_(xc_.x is out)
+    assert_array_almost_equal(xc_.x, xc.x)
+    xc_ = convolve([h.sub(predictor=0), h.sub(predictor=1)],
+                   [x.sub(predictor=0), x.sub(predictor=1)], out)
+    ok_(xc_.x is out)
+    assert_array_almost_equal(xc_.x, xc.x)
+    assert_raises(ValueError, convolve, h, x, np.empty((3, 499)))
+    # direct and FFT
+    h_data = h.get_data(('sensor', 'predictor', 'time'))
+    for i_start in (-20, 0, 10, 600):
+        assert_array_almost_equal(
+            convolve_kernels(h_data, x.x, None, i_start, 'fft'),
+            convolve_kernels(h_data, x.x, None, i_start, 'direct'))
+
 
 def test_cross_correlation():
     ds = datasets._get_continuous()
@@ -76,3 +110,59 @@ def test_find_peaks():
     x, y = np.where(peaks.x)
     assert_array_equal(x, [4])
     assert_array_equal(y, [5])
+
+
+def test_label_operator():
+    "Test label_operator() and applying it with NDVar.dot()"
+    rng = np.random.RandomState(0)
+    source = Scalar('source', range(200))
+    labels = NDVar(rng.randint(0, 10, 200), (source,))
+    weights = NDVar(rng.uniform(0, 1, 200), (source,))
+    data = NDVar(rng.normal(0, 1, (5, 200, 20)),
+                 (Case, source, UTS(0, 0.01, 20)))
+
+    m = label_operator(labels, exclude=0)
+    assert_array_equal(m.label.values, range(1, 10))
+    y = m.dot(data, 'source')
+    eq_(y.dimnames, ('case', 'label', 'time'))
+    for i, v in enumerate(m.label.values):
+        assert_array_almost_equal(y.x[:, i], data.x[:, labels.x == v].mean(1))
+    y = m.dot(data[0], 'source')
+    eq_(y.dimnames, ('label', 'time'))
+    assert_array_almost_equal(y.x[0], data.x[0, labels.x == 1].mean(0))
+    # operator can be modified in place
+    m *= 2
+    assert_array_almost_equal(m.dot(data[0], 'source').x, y.x * 2)
+
+    m = label_operator(labels, 'sum', weights=weights)
+    y = m.dot(data, 'source')
+    index = labels.x == 3
+    target = np.tensordot(weights.x[index], data.x[:, index], (0, 1))
+    assert_array_almost_equal(y.x[:, 3], target)
+
+
+def test_segment():
+    "Test segment()"
+    rng = np.random.RandomState(0)
+    sensor = Scalar('sensor', range(3))
+    x = NDVar(rng.normal(0, 1, (3, 1000)), (sensor, UTS(-1, 0.01, 1000)))
+
+    times = [0.5, 1.234, 3.0, 7.5]
+    y = segment(x, times, -0.1, 0.5)
+    eq_(y.dims[1:], (sensor, UTS(-0.1, 0.01, 60)))
+    for i, t in enumerate(times):
+        assert_array_equal(y.x[i], x.sub(time=(t - 0.1, t + 0.5)).x)
+    y = segment(x, times, -0.1, 0.5, 3)
+    eq_(y.time, UTS(-0.1, 0.03, 20))
+    for i, t in enumerate(times):
+        assert_array_equal(y.x[i], x.sub(time=(t - 0.1, t + 0.5, 0.03)).x)
+
+    # evenly spaced segments without copy
+    times = np.arange(0, 8, 0.5)
+    y = segment(x, times, -0.1, 0.5, copy=False)
+    eq_(y.x.flags.writeable, False)
+    ok_(np.may_share_memory(y.x, x.x))
+    assert_array_equal(y.x, segment(x, times, -0.1, 0.5).x)
+
+    assert_raises(ValueError, segment, x, [-0.95], -0.1, 0.5)
+    assert_raises(ValueError, segment, x, [8.6], -0.1, 0.5)
@@ -79,5 +79,5 @@ setup(
     include_dirs=[np.get_include()],
     packages=find_packages(),
     ext_modules=cythonize(('eelbrain/*.pyx', 'eelbrain/_stats/*.pyx')),
-    scripts=['bin/eelbrain'],
+    scripts=['bin/eelbrain', 'bin/eelbrain-make-cache'],
 )